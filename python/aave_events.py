@@ -1,59 +1,63 @@
+import numpy as np
+
 '''
 AAve V2 event handlers,
+event_data is a dict of decoded event arguments, single values or whole columns
+(see event_decoder), the handler only selects and renames the fields
 '''
 
 def handle_borrow(event_data):
     S = {}
-    S['reserve'] = [event_data['reserve']] #reserve address
-    S['onBehalfOf'] = [event_data['onBehalfOf']]
-    S['user'] = [event_data['user']]
-    S['amount'] = [event_data['amount']]  # amount borrowed, in Wei!
-    S['borrowRateMode'] = [event_data['borrowRateMode']]
-    S['borrow_rate'] = [event_data['borrowRate']]  # 1-Fixed, 2-Float
-    S['referral'] = [event_data['referral']]
+    S['reserve'] = event_data['reserve'] #reserve address
+    S['onBehalfOf'] = event_data['onBehalfOf']
+    S['user'] = event_data['user']
+    S['amount'] = event_data['amount']  # amount borrowed, in Wei!
+    S['borrowRateMode'] = event_data['borrowRateMode']
+    S['borrow_rate'] = event_data['borrowRate']  # 1-Fixed, 2-Float
+    S['referral'] = event_data['referral']
     return S
 
 def handle_deposit(event_data):
     S = {}
-    S['reserve'] = [event_data['reserve']]
-    S['address'] = [event_data['address']]
-    S['onBehalfOf'] = [event_data['onBehalfOf']]
-    S['amount'] = [event_data['amount']]
-    S['referral'] = [event_data['referral']]
+    S['reserve'] = event_data['reserve']
+    S['user'] = event_data['user']
+    S['onBehalfOf'] = event_data['onBehalfOf']
+    S['amount'] = event_data['amount']
+    S['referral'] = event_data['referral']
     return S
 
 def handle_liquidation_call(event_data):
     S = {}
-    S['collateralAsset'] = [event_data['collateralAsset']]
-    S['debtAsset'] = [event_data['debtAsset']]
-    S['user'] = [event_data['user']]
-    S['debtToCover'] = [event_data['debtToCover']]
-    S['liquidatedCollateralAmount'] = [event_data['liquidatedCollateralAmount']]
-    S['liquidator'] = [event_data['liquidator']]
-    S['receiveAToken'] = [event_data['receiveAToken']]
+    S['collateralAsset'] = event_data['collateralAsset']
+    S['debtAsset'] = event_data['debtAsset']
+    S['user'] = event_data['user']
+    S['debtToCover'] = event_data['debtToCover']
+    S['liquidatedCollateralAmount'] = event_data['liquidatedCollateralAmount']
+    S['liquidator'] = event_data['liquidator']
+    S['receiveAToken'] = event_data['receiveAToken']
     return S
 
 def handle_repay(event_data):
     S = {}
-    S['reserve'] = [event_data['reserve']]
-    S['user'] = [event_data['user']]
-    S['repayer'] = [event_data['repayer']]
-    S['amount'] = [event_data['amount']]
+    S['reserve'] = event_data['reserve']
+    S['user'] = event_data['user']
+    S['repayer'] = event_data['repayer']
+    S['amount'] = event_data['amount']
     return S
 
 def handle_swap(event_data):
     S = {}
-    S['reserve'] = [event_data['reserve']]
-    S['user'] = [event_data['user']]
-    S['rateMode'] = [event_data['rateMode']]
+    S['reserve'] = event_data['reserve']
+    S['user'] = event_data['user']
+    S['rateMode'] = event_data['rateMode']
     return S
 
 def handle_withdraw(event_data):
     S = {}
-    S['reserve'] = [event_data['reserve']]
-    S['user'] = [event_data['user']]
-    S['to'] = [event_data['to']]
-    S['amount'] = [event_data['amount']]
+    S['reserve'] = event_data['reserve']
+    S['user'] = event_data['user']
+    S['to'] = event_data['to']
+    S['amount'] = event_data['amount']
     return S
 
 
@@ -67,18 +71,63 @@ def handle_rebalance_stable_borrowRate(event_data):
 def handle_reserve_data_updated(event_data):
     pass
 def handle_reserve_used_as_collateral_disabled(event_data):
-    pass
+    S = {}
+    S['reserve'] = event_data['reserve']
+    S['user'] = event_data['user']
+    return S
+
 def handle_reserve_used_as_collateral_enabled(event_data):
-    pass
+    S = {}
+    S['reserve'] = event_data['reserve']
+    S['user'] = event_data['user']
+    return S
 
 def handle_unpause(event_data):
     pass
 
 
-
-
-
-
-
-
-
+'''LendingPool event name to handler, events without handler can not be cached'''
+EVENT_HANDLERS = {
+    'Borrow': handle_borrow,
+    'Deposit': handle_deposit,
+    'LiquidationCall': handle_liquidation_call,
+    'Repay': handle_repay,
+    'Swap': handle_swap,
+    'Withdraw': handle_withdraw,
+    'ReserveUsedAsCollateralDisabled': handle_reserve_used_as_collateral_disabled,
+    'ReserveUsedAsCollateralEnabled': handle_reserve_used_as_collateral_enabled,
+}
+
+'''Columns of the handlers output, addresses and uint256 are Python objects'''
+ADDRESS = object
+UINT256 = object
+EVENT_META_SCHEMA = [('block_number', np.int64), ('transaction_hash', object),
+                     ('log_index', np.int64), ('block_hash', object)]
+
+EVENT_SCHEMAS = {
+    'Borrow': [('reserve', ADDRESS), ('onBehalfOf', ADDRESS), ('user', ADDRESS), ('amount', UINT256),
+               ('borrowRateMode', UINT256), ('borrow_rate', UINT256), ('referral', np.int64)],
+    'Deposit': [('reserve', ADDRESS), ('user', ADDRESS), ('onBehalfOf', ADDRESS), ('amount', UINT256),
+                ('referral', np.int64)],
+    'LiquidationCall': [('collateralAsset', ADDRESS), ('debtAsset', ADDRESS), ('user', ADDRESS),
+                        ('debtToCover', UINT256), ('liquidatedCollateralAmount', UINT256),
+                        ('liquidator', ADDRESS), ('receiveAToken', bool)],
+    'Repay': [('reserve', ADDRESS), ('user', ADDRESS), ('repayer', ADDRESS), ('amount', UINT256)],
+    'Swap': [('reserve', ADDRESS), ('user', ADDRESS), ('rateMode', UINT256)],
+    'Withdraw': [('reserve', ADDRESS), ('user', ADDRESS), ('to', ADDRESS), ('amount', UINT256)],
+    'ReserveUsedAsCollateralDisabled': [('reserve', ADDRESS), ('user', ADDRESS)],
+    'ReserveUsedAsCollateralEnabled': [('reserve', ADDRESS), ('user', ADDRESS)],
+}
+EVENT_SCHEMAS = {event_name: schema + EVENT_META_SCHEMA for event_name, schema in EVENT_SCHEMAS.items()}
+
+'''Fields holding the account whose position is changed by the event'''
+EVENT_USER_FIELDS = {
+    'Borrow': ['onBehalfOf'],
+    'Deposit': ['onBehalfOf'],
+    'LiquidationCall': ['user'],
+    'Repay': ['user'],
+    'Swap': ['user'],
+    'Withdraw': ['user'],
+    'ReserveUsedAsCollateralDisabled': ['user'],
+    'ReserveUsedAsCollateralEnabled': ['user'],
+}
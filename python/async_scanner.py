@@ -0,0 +1,119 @@
+import asyncio
+import random
+import aiohttp
+import config
+import multicall
+import rpc_batch
+from web3 import Web3
+from web3._utils.abi import get_abi_output_types
+
+'''asyncio scanner, Multicall batches are sent concurrently over aiohttp,
+   number of in-flight requests is bounded by a semaphore.
+   Rate limited requests (HTTP 429 or Infura -32005 error) are retried with exponential backoff.
+'''
+RATE_LIMIT_ERROR_CODES = {-32005, 429}
+
+
+class RateLimited(Exception):
+    pass
+
+
+class AggregateFailed(Exception):
+    pass
+
+
+async def post_eth_call(session, semaphore, to, data, block_identifier):
+    request = {'jsonrpc': '2.0', 'id': 1, 'method': 'eth_call',
+               'params': [{'to': to, 'data': data}, rpc_batch.to_block_param(block_identifier)]}
+    for attempt in range(config.RPC_MAX_RETRIES + 1):
+        async with semaphore:
+            async with session.post(config.Infura_EndPoint, json=request) as response:
+                if response.status == 429:
+                    reply = None
+                else:
+                    response.raise_for_status()
+                    reply = await response.json()
+
+        if reply is not None and 'error' not in reply:
+            return Web3.toBytes(hexstr=reply['result'])
+        if reply is not None and reply['error'].get('code') not in RATE_LIMIT_ERROR_CODES:
+            raise AggregateFailed(reply['error'].get('message'))
+
+        delay = config.RPC_BACKOFF_BASE * 2 ** attempt * (1 + random.random())
+        print('Rate limited, retry in {:.1f} sec'.format(delay))
+        await asyncio.sleep(delay)
+
+    raise RateLimited('Rate limited after {} retries'.format(config.RPC_MAX_RETRIES))
+
+'''Same as multicall.try_aggregate_batch, failing aggregate is split until the failing call is isolated'''
+async def try_aggregate_batch(session, semaphore, calls, block_identifier):
+    contract = multicall.get_multicall_contract()
+    output_types = get_abi_output_types(contract.get_function_by_name('tryAggregate').abi)
+    data = contract.encodeABI(fn_name='tryAggregate', args=[False, calls])
+    try:
+        ret = await post_eth_call(session, semaphore, contract.address, data, block_identifier)
+        return contract.web3.codec.decode_abi(output_types, ret)[0]
+    except AggregateFailed:
+        if len(calls) == 1:
+            return [(False, None)]
+        half = len(calls) // 2
+        first = await try_aggregate_batch(session, semaphore, calls[:half], block_identifier)
+        second = await try_aggregate_batch(session, semaphore, calls[half:], block_identifier)
+        return first + second
+
+
+'''Failed batches (network error, timeout or rate limited after all retries) are retried in
+   ASYNC_SCAN_BATCH_RETRIES more passes, calls of batches failed in every pass are None
+'''
+async def scan_function_batch_async(contract, fn_name, args_list, batch_size, concurrency, block_identifier,
+                                    on_batch=None):
+    calls = multicall.encode_calls(contract, fn_name, args_list)
+    semaphore = asyncio.Semaphore(concurrency)
+    timeout = aiohttp.ClientTimeout(total=config.RPC_TIMEOUT)
+    decoded = [None] * len(calls)
+    collected = 0
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        async def run(i):
+            try:
+                results = await try_aggregate_batch(session, semaphore, calls[i:i + batch_size], block_identifier)
+            except (RateLimited, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print('Batch {} failed: {}'.format(i, repr(e)))
+                return i, None
+            return i, results
+
+        pending = list(range(0, len(calls), batch_size))
+        for attempt in range(config.ASYNC_SCAN_BATCH_RETRIES + 1):
+            if attempt > 0:
+                print('Retry {} failed batches'.format(len(pending)))
+            failed = []
+            for task in asyncio.as_completed([run(i) for i in pending]):
+                i, results = await task
+                if results is None:
+                    failed.append(i)
+                    continue
+                batch = multicall.decode_results(contract, fn_name, results)
+                decoded[i:i + len(batch)] = batch
+                collected += len(batch)
+                if on_batch is not None:
+                    on_batch(args_list[i:i + len(batch)], batch)
+                print('Collected {}/{} calls'.format(collected, len(calls)))
+            pending = sorted(failed)
+            if len(pending) == 0:
+                break
+    if len(pending) > 0:
+        print('{} batches failed, {} calls are left None'.format(len(pending), len(calls) - collected))
+    return decoded
+
+'''Async drop-in for multicall.call_function_batch,
+   @on_batch - optional callback(args_list, decoded) called as soon as a batch arrives
+   Returns list of decoded outputs, None for the failed calls
+'''
+def scan_function_batch(contract, fn_name, args_list, batch_size=config.ASYNC_SCAN_BATCH_SIZE,
+                        concurrency=config.ASYNC_SCAN_CONCURRENCY, block_identifier='latest', on_batch=None):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(
+            scan_function_batch_async(contract, fn_name, args_list, batch_size, concurrency, block_identifier,
+                                      on_batch=on_batch))
+    finally:
+        loop.close()
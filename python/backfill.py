@@ -0,0 +1,163 @@
+import os
+import json
+import shutil
+import datetime
+import multiprocessing
+import pandas as pd
+import config
+import aave_events
+import block_range
+import cache_events
+import cache_manifest
+import event_store
+import web3_client
+from config import CACHE_FOLDER
+from record_builder import ColumnarRecordBuilder
+
+'''Parallel historical backfill of the LendingPool events into the event store.
+   The block range is split into shards of BACKFILL_SHARD_BLOCKS, worker processes fetch and decode
+   the shards (a single multi-event getLogs per adaptive window, as cache_events.update_cache) and
+   write every shard independently:
+      <BACKFILL_FOLDER>/plan.json - block range, events and shards of the backfill
+      <BACKFILL_FOLDER>/<b1>_<b2>.bin - dict event name -> frame of the shard
+      <BACKFILL_FOLDER>/<b1>_<b2>.json - completion record: sha256, number of events, time
+   getLogs calls of all workers share a semaphore of BACKFILL_RPC_CONCURRENCY.
+   When all shards are complete they are merged into the event store in block order, events of a shard
+   sorted by (block_number, log_index). A killed backfill resumes from the plan and fetches only shards
+   without a valid completion record.
+   Only confirmed blocks (latest - REORG_CONFIRMATION_BLOCKS) are backfilled, the hash of the last one is
+   recorded in the event store so cache_events.update_cache continues with the unconfirmed tier from there.
+'''
+BACKFILL_FOLDER = '{}/backfill'.format(CACHE_FOLDER)
+PLAN_FNAME = '{}/plan.json'.format(BACKFILL_FOLDER)
+
+'''Dec-01-2020 12:17:34, first block of the event cache'''
+FIRST_BLOCK = 11363357
+
+_rpc_semaphore = None
+
+
+def init_worker(semaphore):
+    global _rpc_semaphore
+    _rpc_semaphore = semaphore
+
+
+def make_shards(from_block, to_block, shard_blocks=config.BACKFILL_SHARD_BLOCKS):
+    return [[b1, min(b1 + shard_blocks - 1, to_block)] for b1 in range(from_block, to_block + 1, shard_blocks)]
+
+
+def get_shard_fname(b1, b2):
+    return '{}/{}_{}.bin'.format(BACKFILL_FOLDER, b1, b2)
+
+
+def get_record_fname(b1, b2):
+    return '{}/{}_{}.json'.format(BACKFILL_FOLDER, b1, b2)
+
+'''True if the shard has a completion record and its file matches the checksum'''
+def is_complete(b1, b2):
+    record_fname = get_record_fname(b1, b2)
+    if not os.path.exists(record_fname):
+        return False
+    return cache_manifest.verify(get_shard_fname(b1, b2), json.load(open(record_fname))['sha256'])
+
+'''Fetch and decode the events of [b1, b2], write the shard and its completion record'''
+def fetch_shard(event_names, b1, b2):
+    t1 = datetime.datetime.now()
+    event_handlers = {event_name: aave_events.EVENT_HANDLERS[event_name] for event_name in event_names}
+    contract = web3_client.get_lending_pool()
+    topic0_table = cache_events.make_topic0_table(contract, event_handlers)
+    event_abis = {event_name: abi for event_name, abi, _ in topic0_table.values()}
+
+    def fetch_logs(w1, w2):
+        with _rpc_semaphore:
+            logs = contract.web3.eth.getLogs(cache_events.make_multi_event_filter_params(contract, topic0_table, w1, w2))
+        return cache_events.dispatch_logs(logs, topic0_table)
+
+    planner = block_range.BlockRangePlanner(key='update_cache')
+    event_builders = {event_name: ColumnarRecordBuilder(aave_events.EVENT_SCHEMAS[event_name])
+                      for event_name in event_names}
+    for _, _, window_logs in planner.iter_ranges(fetch_logs, b1, b2,
+                                                 count_logs=lambda d: sum(len(l) for l in d.values())):
+        for event_name, logs in window_logs.items():
+            cache_events.collect_events(event_builders[event_name], event_abis[event_name], logs,
+                                        event_handlers[event_name])
+
+    frames = {event_name: builder.to_frame() for event_name, builder in event_builders.items()}
+    fname = get_shard_fname(b1, b2)
+    cache_manifest.dump_pickle(frames, fname)
+    t2 = datetime.datetime.now()
+    record = {'sha256': cache_manifest.checksum(fname),
+              'events': {event_name: len(df) for event_name, df in frames.items()},
+              'time': (t2 - t1).total_seconds()}
+    cache_manifest.dump_json(record, get_record_fname(b1, b2))
+    print('shard [{}, {}]: {} events, time:{}'.format(b1, b2, sum(record['events'].values()), record['time']))
+    return b1, b2
+
+
+def _fetch_shard(args):
+    return fetch_shard(*args)
+
+'''Backfill plan of an interrupted run, or a new plan of [from_block, to_block]'''
+def load_plan(event_names, from_block, to_block):
+    if os.path.exists(PLAN_FNAME):
+        plan = json.load(open(PLAN_FNAME))
+        print('Resume backfill [{}, {}]'.format(plan['from_block'], plan['to_block']))
+        return plan
+    plan = {'from_block': from_block, 'to_block': to_block, 'event_names': list(event_names),
+            'shards': make_shards(from_block, to_block)}
+    cache_manifest.dump_json(plan, PLAN_FNAME)
+    return plan
+
+'''Write the shards into the event store in block order, events ordered by (block_number, log_index),
+   events already in the store (merged before an interruption or ingested earlier) are skipped
+'''
+def merge_shards(plan):
+    last_blocks = {}
+    for event_name in plan['event_names']:
+        last_block = event_store.get_last_block(event_name)
+        last_blocks[event_name] = last_block if last_block is not None else -1
+    tip_hash = cache_events.query_block_headers([plan['to_block']]).block_hash.values[0]
+    for b1, b2 in plan['shards']:
+        if b2 <= min(last_blocks.values()):
+            continue
+        frames = pd.read_pickle(get_shard_fname(b1, b2))
+        frames = {event_name: df[df.block_number > last_blocks[event_name]].sort_values(['block_number', 'log_index'])
+                  for event_name, df in frames.items()}
+        event_store.append_events({event_name: df.reset_index(drop=True) for event_name, df in frames.items()},
+                                  from_block=b1, to_block=b2, block_hash=tip_hash if b2 == plan['to_block'] else None)
+    '''unconfirmed blocks of an earlier update are confirmed history now'''
+    tier = event_store.load_unconfirmed()
+    event_store.save_unconfirmed(cache_events.truncate_unconfirmed(tier, 0))
+    shutil.rmtree(BACKFILL_FOLDER)
+
+'''Backfill the event store from its last block (or FIRST_BLOCK) to to_block, at most to the last confirmed block
+   ranges shorter than two shards are left to cache_events.update_cache
+'''
+def backfill(event_names=config.CACHED_EVENTS, to_block='latest', processes=config.BACKFILL_PROCESSES):
+    if os.path.exists(PLAN_FNAME):
+        plan = load_plan(event_names, None, None)
+    else:
+        last_blocks = [event_store.get_last_block(event_name) for event_name in event_names]
+        if any(block is None for block in last_blocks):
+            from_block = FIRST_BLOCK
+        else:
+            from_block = min(last_blocks) + 1
+        confirmed_block = block_range.resolve_block('latest') - config.REORG_CONFIRMATION_BLOCKS
+        to_block = min(block_range.resolve_block(to_block), confirmed_block)
+        if to_block - from_block + 1 < 2 * config.BACKFILL_SHARD_BLOCKS:
+            return
+        os.makedirs(BACKFILL_FOLDER, exist_ok=True)
+        plan = load_plan(event_names, from_block, to_block)
+
+    missing = [(b1, b2) for b1, b2 in plan['shards'] if not is_complete(b1, b2)]
+    print('Backfill [{}, {}]: {} of {} shards to fetch'.format(plan['from_block'], plan['to_block'],
+                                                              len(missing), len(plan['shards'])))
+    semaphore = multiprocessing.BoundedSemaphore(config.BACKFILL_RPC_CONCURRENCY)
+    with multiprocessing.Pool(processes, initializer=init_worker, initargs=(semaphore,)) as pool:
+        for i, _ in enumerate(pool.imap_unordered(_fetch_shard, [(plan['event_names'], b1, b2) for b1, b2 in missing])):
+            print('Backfill progress: {}/{} shards'.format(i + 1, len(missing)))
+    merge_shards(plan)
+
+
+if __name__ == '__main__':
+    backfill()
@@ -0,0 +1,153 @@
+import multiprocessing
+import numpy as np
+import pandas as pd
+import chainlink
+import event_store
+import cache_events
+import feed_registry
+import price_store
+import receipts
+import reserve_cache
+
+'''Vectorized liquidation backtest over the cached LiquidationCall history.
+   Both legs of every liquidation are priced in ETH at the liquidation block from the local
+   Chainlink price store (as-of join), token decimals come from the reserve cache and the gas cost
+   from the receipt cache, so the backtest itself runs without RPC calls:
+      profit = collateral collected * collateral price - debt covered * debt price - gas
+   latency is the number of blocks from the latest oracle update of the legs to the liquidation.
+   Block range partitions of the history are processed by worker processes.
+'''
+ORACLE_MAX_AGE = 1600
+
+BACKTEST_COLUMNS = ['block_number', 'transaction_hash', 'liquidator', 'user', 'collateralAsset', 'debtAsset',
+                    'collected_eth', 'paid_eth', 'gas_payed', 'profit', 'reward', 'blocks_from_oracle_update']
+
+
+def to_amount(values, decimals):
+    return np.array([int(v) for v in values], dtype=np.float64) / 10.0 ** np.asarray(decimals, dtype=np.float64)
+
+'''Per reserve (aggregator, direct, decimals) lookups, built once in the parent process'''
+def make_context(reserves, reserve_table):
+    feeds = {}
+    for asset in reserves:
+        direct, aggregator = feed_registry.get_reserve_feed(asset)
+        feeds[asset] = (aggregator, direct)
+    decimals = dict(zip(reserve_table.addr, reserve_table.decimals))
+    eth = [asset for asset in reserves if feed_registry.to_denomination(asset) == chainlink.ETH_addr]
+    return {'feeds': feeds, 'decimals': decimals, 'eth': eth}
+
+'''ETH price of the asset leg at the liquidation block, WETH is priced 1.0, NaN if there is no feed'''
+def price_leg(events, asset_column, context, prefix):
+    feeds = context['feeds']
+    aggregator = events[asset_column].map(lambda asset: feeds.get(asset, (None, None))[0])
+    direct = events[asset_column].map(lambda asset: feeds.get(asset, (None, True))[1]).astype(bool)
+    df = pd.DataFrame({'block_number': events.block_number.values, 'aggregator': aggregator.values})
+    df = price_store.merge_as_of(df, 'aggregator', prefix=prefix, max_age=ORACLE_MAX_AGE)
+    price = df[prefix + 'price'].values
+    price = np.where(direct.values, price, 1.0 / price)
+    no_feed = aggregator.isna().values
+    price[no_feed] = np.nan
+    price[events[asset_column].isin(context['eth']).values] = 1.0
+    price_block = df[prefix + 'price_block'].values.astype(np.float64)
+    price_block[no_feed] = np.nan
+    return price, price_block
+
+'''Backtest a partition of LiquidationCall events (with gas_payed column)'''
+def run_partition(events, context):
+    events = events.reset_index(drop=True)
+    decimals = context['decimals']
+    col_amount = to_amount(events.liquidatedCollateralAmount, events.collateralAsset.map(decimals))
+    debt_amount = to_amount(events.debtToCover, events.debtAsset.map(decimals))
+    col_price, col_price_block = price_leg(events, 'collateralAsset', context, 'col_')
+    debt_price, debt_price_block = price_leg(events, 'debtAsset', context, 'debt_')
+
+    df = pd.DataFrame({'block_number': events.block_number.values,
+                       'transaction_hash': events.transaction_hash.values,
+                       'liquidator': events.liquidator.values,
+                       'user': events.user.values,
+                       'collateralAsset': events.collateralAsset.values,
+                       'debtAsset': events.debtAsset.values})
+    df['collected_eth'] = col_amount * col_price
+    df['paid_eth'] = debt_amount * debt_price
+    df['gas_payed'] = events.gas_payed.values
+    df['profit'] = df.collected_eth - df.paid_eth
+    df['reward'] = df.profit - df.gas_payed
+    oracle_block = np.fmax(col_price_block, debt_price_block)
+    df['blocks_from_oracle_update'] = df.block_number.values - oracle_block
+    return df[BACKTEST_COLUMNS]
+
+
+def _run_partition(args):
+    return run_partition(*args)
+
+'''Split events into n_partitions block ranges'''
+def make_partitions(events, n_partitions):
+    events = events.sort_values(['block_number', 'log_index'])
+    edges = np.linspace(0, len(events), n_partitions + 1).astype(int)
+    return [events.iloc[edges[i]:edges[i + 1]] for i in range(n_partitions) if edges[i + 1] > edges[i]]
+
+'''Per-liquidation backtest frame of the events (BACKTEST_COLUMNS), empty frame if there are no events
+   @events - LiquidationCall frame (event_store / cache_events.query_liquidation_call_event)
+   @processes - number of worker processes, 1 runs in process
+'''
+def backtest(events, processes=None, n_partitions=None):
+    if events is None or len(events) == 0:
+        return pd.DataFrame(columns=BACKTEST_COLUMNS)
+    processes = processes or multiprocessing.cpu_count()
+    n_partitions = n_partitions or processes
+    reserves, reserve_table = reserve_cache.get_reserves(refresh=False)
+    context = make_context(reserves, reserve_table)
+
+    '''Local stores are filled in the parent, workers only read them'''
+    aggregators = [aggregator for aggregator, _ in context['feeds'].values() if aggregator is not None]
+    price_store.update(set(aggregators), from_block=int(events.block_number.min()) - ORACLE_MAX_AGE,
+                       to_block=int(events.block_number.max()))
+    events = events.copy()
+    receipts.add_gas_cost(events, tx_column='transaction_hash', block_column='block_number')
+
+    partitions = make_partitions(events, n_partitions)
+    if processes == 1:
+        frames = [run_partition(partition, context) for partition in partitions]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            frames = pool.map(_run_partition, [(partition, context) for partition in partitions])
+    return pd.concat(frames, ignore_index=True)
+
+'''Aggregate profit, latency and counts'''
+def summary(df):
+    return pd.Series({'liquidations': len(df),
+                      'profit': df.profit.sum(),
+                      'gas_payed': df.gas_payed.sum(),
+                      'reward': df.reward.sum(),
+                      'profitable': (df.reward > 0).mean() if len(df) > 0 else np.nan,
+                      'median_blocks_from_oracle_update': df.blocks_from_oracle_update.median()})
+
+'''Liquidators sorted by total reward'''
+def leaderboard(df):
+    board = df.groupby('liquidator').agg({'reward': ['size', 'sum'], 'profit': 'sum', 'gas_payed': 'sum',
+                                          'blocks_from_oracle_update': 'median'})
+    board.columns = ['_'.join(column) for column in board.columns]
+    board = board.rename(columns={'reward_size': 'liquidations', 'reward_sum': 'reward', 'profit_sum': 'profit',
+                                  'gas_payed_sum': 'gas_payed',
+                                  'blocks_from_oracle_update_median': 'median_blocks_from_oracle_update'})
+    board = board[['liquidations', 'reward', 'profit', 'gas_payed', 'median_blocks_from_oracle_update']]
+    return board.sort_values('reward', ascending=False)
+
+'''Backtest of the cached LiquidationCall events in [from_block, to_block],
+   fetched from the node if there are no cached LiquidationCall events
+'''
+def backtest_cached(from_block=None, to_block=None, processes=None):
+    events = event_store.read_events('LiquidationCall', from_block=from_block, to_block=to_block)
+    if len(events) == 0:
+        events = cache_events.query_liquidation_call_event(from_block=from_block or 0,
+                                                           to_block=to_block if to_block is not None else 'latest')
+    if events is None or len(events) == 0:
+        print('No LiquidationCall events in [{}, {}]'.format(from_block, to_block))
+        return pd.DataFrame(columns=BACKTEST_COLUMNS)
+    return backtest(events, processes=processes)
+
+
+if __name__ == '__main__':
+    df = backtest_cached()
+    print(summary(df))
+    print(leaderboard(df).head(20))
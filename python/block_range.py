@@ -0,0 +1,136 @@
+import os
+import json
+import config
+import cache_manifest
+import web3_client
+from config import CACHE_FOLDER
+
+'''Adaptive block range planner for eth_getLogs.
+   The window is split in halves when the node rejects the result size,
+   grown after sparse responses, and the observed logs per block density is
+   kept per key on disk so the next run starts with a well sized window.
+'''
+DENSITY_FNAME = '{}/get_logs_density.json'.format(CACHE_FOLDER)
+
+TOO_MANY_RESULTS_ERRORS = ('query returned more than',
+                           'response size exceeded',
+                           'response size should not',
+                           'block range is too wide',
+                           'exceed maximum block range',
+                           'query exceeds max results',
+                           'log limit exceeded',
+                           'logs limit exceeded',
+                           'too many results')
+
+'''rate limit errors share some wording (i.e. 'limit exceeded'), splitting the window does not help them'''
+RATE_LIMIT_ERRORS = ('rate limit',
+                     'request limit',
+                     'daily request',
+                     'too many requests')
+
+
+def is_too_many_results(e):
+    message = str(e).lower()
+    for pattern in RATE_LIMIT_ERRORS:
+        if pattern in message:
+            return False
+    for pattern in TOO_MANY_RESULTS_ERRORS:
+        if pattern in message:
+            return True
+    return False
+
+
+def load_densities():
+    if os.path.exists(DENSITY_FNAME):
+        return json.load(open(DENSITY_FNAME))
+    return {}
+
+
+def save_densities(densities):
+    cache_manifest.dump_json(densities, DENSITY_FNAME)
+
+
+def resolve_block(block):
+    if block == 'latest':
+        return web3_client.get_web3().eth.block_number
+    return block
+
+
+class BlockRangePlanner:
+    def __init__(self, key, target_results=config.GET_LOGS_TARGET_RESULTS,
+                 min_window=1, max_window=config.GET_LOGS_MAX_WINDOW):
+        self.key = key
+        self.target_results = target_results
+        self.min_window = min_window
+        self.max_window = max_window
+        self.density = load_densities().get(key)
+
+    def initial_window(self):
+        if self.density is None or self.density <= 0:
+            return config.GET_LOGS_INITIAL_WINDOW
+        return self.clamp(self.target_results / self.density)
+
+    def clamp(self, window):
+        return int(max(self.min_window, min(self.max_window, window)))
+
+    '''exponential moving average, a short tail window has proportionally less weight'''
+    def update_density(self, n_logs, n_blocks, window):
+        observed = n_logs / n_blocks
+        if self.density is None:
+            self.density = observed
+        else:
+            alpha = 0.3 * min(1.0, n_blocks / window)
+            self.density = (1 - alpha) * self.density + alpha * observed
+
+    def save(self):
+        densities = load_densities()
+        densities[self.key] = self.density
+        save_densities(densities)
+
+    '''Walk [from_block, to_block] (both inclusive) in adaptive windows,
+       @fetch_logs - function(b1, b2) returns logs of the window, raises on node errors
+       @count_logs - number of logs in fetch_logs result
+       yields (b1, b2, logs)
+    '''
+    def iter_ranges(self, fetch_logs, from_block, to_block, count_logs=len):
+        window = self.initial_window()
+        b1 = from_block
+        try:
+            while b1 <= to_block:
+                b2 = min(b1 + window - 1, to_block)
+                try:
+                    logs = fetch_logs(b1, b2)
+                except Exception as e:
+                    if not is_too_many_results(e) or b2 == b1:
+                        raise
+                    window = self.clamp((b2 - b1 + 1) // 2)
+                    self.density = max(self.density or 0.0, 2.0 * self.target_results / (b2 - b1 + 1))
+                    print('Too many results in [{}, {}], split window to {} blocks'.format(b1, b2, window))
+                    continue
+
+                yield b1, b2, logs
+                n_logs = count_logs(logs)
+                self.update_density(n_logs, b2 - b1 + 1, window)
+                if n_logs < self.target_results / 4:
+                    window = self.clamp(min(window * 2, self.target_results / max(self.density, 1e-9)))
+                elif n_logs > self.target_results:
+                    window = self.clamp(window // 2)
+                b1 = b2 + 1
+        finally:
+            if self.density is not None:
+                self.save()
+
+
+def get_planner(event):
+    return BlockRangePlanner(key='{}:{}'.format(event.address, event.event_name))
+
+'''All logs of the contract event in [from_block, to_block] fetched in adaptive windows
+   @make_filter_params - function(event, b1, b2) returns eth_getLogs filter params
+'''
+def get_event_logs(event, make_filter_params, from_block, to_block='latest'):
+    planner = get_planner(event)
+    logs = []
+    fetch_logs = lambda b1, b2: event.web3.eth.getLogs(make_filter_params(event, b1, b2))
+    for _, _, window_logs in planner.iter_ranges(fetch_logs, from_block, resolve_block(to_block)):
+        logs += window_logs
+    return logs
@@ -1,9 +1,17 @@
 import pandas as pd
 import numpy as np
+import backfill
+import block_range
 import cache_events
+import cache_manifest
+import health_engine
+import reserve_cache
+import feed_registry
+import liquidation_planner
+from liquidation_price_index import LiquidationPriceIndex
+import event_store
 import datetime
 import time
-import datetime
 import chainlink
 import config
 import pickle
@@ -12,13 +20,12 @@ from config import CACHE_FOLDER
 from  reserve_asset import convert_crypto_asset_to_addr
 
 def update_cache_reserve_config():
-    reseve_list = cache_events.wrapper_getReservesList()
-    reserve_config = cache_events.wrapper_getReserveData(reseve_list)
+    reseve_list, reserve_config = reserve_cache.get_reserves()
     fname = "{}/reserve_cached.bin".format(CACHE_FOLDER)
     S = {}
     S['reseve_list'] = reseve_list
     S['reserve_config'] = reserve_config
-    pickle.dump(S, open(fname, "wb"))
+    cache_manifest.dump_pickle(S, fname)
     pass
 
 def load_reserve_from_cache():
@@ -26,15 +33,20 @@ def load_reserve_from_cache():
     S = pickle.load(open(fname, "rb"))
     return S['reseve_list'], S['reserve_config']
 
-"""Collect borrow,repay,swap events for AAVE users"""
+"""Collect borrow,repay,swap events for AAVE users, a long missing history is backfilled in parallel first"""
 def update_cached_events():
+    backfill.backfill()
     cache_events.update_cache()
 
-"""Cache all active users health factor"""
-def check_and_cache_user_health_factor():
-    """Load cached events"""
-    cached_data, last_cached_block = cache_events.load_events_from_cache()
-    borrow = cached_data['Borrow']
+"""Cache all active users health factor, use_async - scan users concurrently
+   incremental - re-query only users touched by events since they were verified,
+   not verified for FULL_SWEEP_INTERVAL_BLOCKS and new borrowers, other accounts are kept in the state store as is
+   full_sweep - re-query all alive accounts even in incremental mode
+"""
+def check_and_cache_user_health_factor(use_async=False, incremental=False, full_sweep=False):
+    """Load borrowers from cached events"""
+    last_cached_block = event_store.get_last_block()
+    borrow = cache_events.read_event_columns('Borrow', columns=['user'])
     new_cached_user_address = borrow.user.unique()
 
     """Read latest user cached health factor data"""
@@ -45,38 +57,86 @@ def check_and_cache_user_health_factor():
     alive_borrowed_accounts = cached_borrowed_accounts[I]
     alive_cached_borrowed_accounts = list(alive_borrowed_accounts.user)
 
-    cached_user_account_diff = list(set(new_cached_user_address).difference(cached_borrowed_accounts.user))
+    """nothing to refresh incrementally on an empty cache, all borrowers are queried"""
+    if incremental and not full_sweep and len(cached_borrowed_accounts) > 0:
+        cached_user_account_diff = list(set(new_cached_user_address).difference(cached_borrowed_accounts.user))
+        verified_blocks = cached_borrowed_accounts.groupby('user').verified_block.max()
+        touched_users = cache_events.query_touched_users(verified_blocks,
+                                                         from_block=int(cached_borrowed_accounts.verified_block.min()) + 1,
+                                                         alive_users=alive_cached_borrowed_accounts)
+        I = alive_borrowed_accounts.verified_block < last_cached_block - config.FULL_SWEEP_INTERVAL_BLOCKS
+        expired_users = list(alive_borrowed_accounts.user[I])
+        """alive accounts whose getUserConfiguration changed since the previous snapshot (i.e. missed events)"""
+        kept_users = list(set(alive_cached_borrowed_accounts).difference(touched_users).difference(expired_users))
+        changed_users = cache_events.query_user_configuration_and_cache(kept_users) if len(kept_users) > 0 else []
+        """touched users can be new, liquidated or closed accounts as well"""
+        all_user_acounts = list(set(touched_users).union(expired_users).union(cached_user_account_diff).union(changed_users))
+        print('Incremental refresh: query {} users, keep {} users'.format(len(all_user_acounts),
+                                                                      len(cached_borrowed_accounts) - len(all_user_acounts)))
+    else:
+        """all user accounts to check for health factor are alive cached and new or returning borrowers"""
+        cached_user_account_diff = list(set(new_cached_user_address).difference(alive_cached_borrowed_accounts))
+        all_user_acounts = alive_cached_borrowed_accounts + cached_user_account_diff
 
-    """all user accounts to check for health factor are alive cached and new borrowed"""
-    all_user_acounts = alive_cached_borrowed_accounts + cached_user_account_diff
-    cache_events.query_user_health_factor_and_cache(user_address=all_user_acounts, last_cached_block=last_cached_block)
+    cache_events.query_user_health_factor_and_cache(user_address=all_user_acounts, last_cached_block=last_cached_block,
+                                                    use_async=use_async)
     pass
 
-def get_users_for_monitor(threshold=1.06):
+_monitor_index = None
+_monitor_event_block = None
+
+"""Liquidation price index of the alive cached borrowers kept across calls, built on first use.
+   Later calls reload only users touched by events after the last update and new alive accounts,
+   and apply only the changed oracle prices
+"""
+def update_monitor_index(block_identifier='latest'):
+    global _monitor_index, _monitor_event_block
+    block = block_range.resolve_block(block_identifier)
+    alive_accounts, from_cached_block, date, time_of_cache = cache_events.load_latest_health_factor_from_cache(alive=True)
+    event_block = event_store.get_head_block()
+    if _monitor_index is None:
+        engine = health_engine.build_engine(list(alive_accounts.user), block_identifier=block)
+        _monitor_index = LiquidationPriceIndex(engine)
+        _monitor_event_block = event_block
+        return _monitor_index
+
+    engine = _monitor_index.engine
+    touched_users = []
+    if event_block is not None and _monitor_event_block is not None and event_block > _monitor_event_block:
+        verified_blocks = pd.Series(_monitor_event_block, index=engine.users)
+        touched_users = cache_events.query_touched_users(verified_blocks, from_block=_monitor_event_block + 1,
+                                                         alive_users=engine.users)
+    new_users = set(alive_accounts.user).difference(engine.user_index)
+    users = list(new_users.union(touched_users))
+    if len(users) > 0:
+        users = engine.load_balances(users, block_identifier=block)
+        _monitor_index.update_users(users)
+    prices = health_engine.query_asset_prices(engine.reserves, block_identifier=block)
+    changed = np.flatnonzero(prices != engine.prices)
+    for k in changed:
+        _monitor_index.update_price(engine.reserves[k], prices[k])
+    engine.block = block
+    _monitor_event_block = event_block
+    print('Monitor index: {} users reloaded, {} prices changed'.format(len(users), len(changed)))
+    return _monitor_index
+
+"""Users to monitor: users liquidated by a price move of any reserve within 1 - 1 / threshold,
+   from the liquidation price index of the alive cached borrowers (update_monitor_index() if index is None)
+"""
+def get_users_for_monitor(threshold=1.06, index=None):
     deciamls = chainlink.get_decimals(address=chainlink.CHAIN_LINK_ADDR['ETH']['USD'])
     _, eth_to_usd_price, _, _, _ = chainlink.get_price(address=chainlink.CHAIN_LINK_ADDR['ETH']['USD'], decimals=deciamls)
-    """Read latest user cached health factor data"""
-    cached_borrowed_accounts, from_cached_block, date, time_of_cache = cache_events.load_latest_health_factor_from_cache()
-    I = (cached_borrowed_accounts.healthFactor < threshold) & (cached_borrowed_accounts.healthFactor > 1.0)
-    cached_borrowed_accounts = cached_borrowed_accounts[I]
-    debt_in_usd = cached_borrowed_accounts.debt * eth_to_usd_price
+    if index is None:
+        index = update_monitor_index()
+
+    users = index.near_liquidation(margin=1.0 - 1.0 / threshold)
+    accounts = index.engine.to_frame(users)
+    debt_in_usd = accounts.debt * eth_to_usd_price
     I = debt_in_usd > 1500
-    cached_borrowed_accounts = cached_borrowed_accounts[I]
-    return list(cached_borrowed_accounts.user)
+    return list(accounts.user[I])
 
 def asset_to_chainlink_aggregator(asset, quote=chainlink.ETH_addr):
-    if asset == '0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2':
-        asset = '0xEeeeeEeeeEeEeeEeEeEeeEEEeeeeEeeeeeeeEEeE'
-
-    if asset == '0x2260FAC5E5542a773Aa44fBCfeDf7C193bc2C599':
-        asset = '0xbBbBBBBbbBBBbbbBbbBbbbbBBbBbbbbBbBbbBBbB'
-
-
-    if asset != quote:
-        direct, aggregator = chainlink.find_pair_aggregator(base=asset, quote=quote)
-        return direct, aggregator
-    else:
-        return None, None
+    return feed_registry.get_reserve_feed(asset, quote=quote)
 
 """Comvert AAVE reserve to chainlink aggregator pair(AAVE reserve to ETH_
 """
@@ -86,11 +146,12 @@ def update_chainlink_aggregators(date):
     D = []
     Dec = []
     N = []
+    feed_registry.build(reserve_list)
     for r in reserve_list:
         if r != '0xEeeeeEeeeEeEeeEeEeEeeEEEeeeeEeeeeeeeEEeE':
             direct, aggregator = asset_to_chainlink_aggregator(asset=r)
             if direct is not None:
-                decimals = chainlink.get_decimals_from_aggregator(aggregator)
+                decimals = feed_registry.get_decimals(aggregator)
                 A.append(aggregator)
                 D.append(int(direct))
                 Dec.append(decimals)
@@ -111,8 +172,8 @@ def get_user_config_short(users, date):
     U = []
     B = []
     C = []
-    for user in users:
-        collateral_type, borrowed_type = cache_events.wrapper_getUserConfiguration(user=user, reserve_to_index=reserve_list)
+    user_configs = cache_events.batch_getUserConfiguration(users, reserve_list)
+    for user, (collateral_type, borrowed_type) in user_configs.items():
         assets_involved = set(collateral_type).union(borrowed_type)
         D1 = assets_involved.difference(['USDC', 'USDT'])
         D2 = assets_involved.difference(['USDC', 'DAI'])
@@ -140,60 +201,48 @@ def get_user_config(users):
     Health_factor = []
     User = []
     chainlink_feed_config = {} #feed address from eth to other asset, direct or inverse!
-    is_direct, address = chainlink.get_feed_address(from_asset='ETH', to_asset='USD')
-    decimals = chainlink.get_decimals(address)
-    chainlink_feed_config['USD'] = [is_direct, address, decimals]
-    for user in users:
-        user_account = cache_events.wrapper_getUserAccountData([user])
-        collateral_type, borrowed_type = cache_events.wrapper_getUserConfiguration(user=user, reserve_to_index=reserve_list)
-        if len(borrowed_type) == 1 and len(collateral_type) == 1:
-            b_name = borrowed_type[0]
-            c_name = collateral_type[0]
-            bonus = reserve_config[reserve_config.name == c_name].liq_bonus.values[0]
-            max_liquidatable_debt = user_account.debt / 2
-            liquidated_reward = max_liquidatable_debt * bonus
-            profit_in_eth = liquidated_reward - max_liquidatable_debt
-            ratio = get_chainlink_ratio_from_eth(chainlink_feed_config, to_asset='USD')
-            profit_in_usd = profit_in_eth * ratio
-
-            if c_name != 'WETH':
-                if c_name == 'WBTC':
-                    c_name = 'BTC'
-                is_direct, address = chainlink.get_feed_address(from_asset='ETH', to_asset=c_name)
-                decimals = chainlink.get_decimals(address)
-                chainlink_feed_config[c_name] = [is_direct, address, decimals]
-                ratio = get_chainlink_ratio_from_eth(chainlink_feed_config, to_asset=c_name)
-                col_amount = user_account.debt * ratio  # convert to naitive asset from ETH
-            else:
-                col_amount = user_account.debt
-
-            if b_name != 'WETH':
-                if b_name == 'WBTC':
-                    b_name = 'BTC'
-                is_direct, address = chainlink.get_feed_address(from_asset='ETH', to_asset=b_name)
-                decimals = chainlink.get_decimals(address)
-                chainlink_feed_config[b_name] = [is_direct, address, decimals]
-                ratio = get_chainlink_ratio_from_eth(chainlink_feed_config, to_asset=b_name)
-                borrow_amount = user_account.debt * ratio #convert to naitive asset from ETH
-            else:
-                borrow_amount = user_account.debt
-
-            print(is_direct, ratio, borrow_amount, 'eth/{}'.format(b_name))
-
-            #my_health_factor = user_account.liquidation_threshold * user_account.col / user_account.debt
-
-            Liquidated_reward.append(liquidated_reward)
-
-            Bonus.append(bonus)
-            Col_Type.append(c_name)
-            Col_amount.append(col_amount.values[0])
-            Borrow_Type.append(b_name)
-            Borrow_amount.append(borrow_amount)
-            Liq_threshold.append(user_account.liquidation_threshold[0]/100.0)
-            Health_factor.append(user_account.healthFactor.values[0])
-            User.append(user)
-        else:
-            print('Skip user due to multiple assets possession!')
+    chainlink_feed_config['USD'] = list(feed_registry.get_ens_feed(from_asset='ETH', to_asset='USD'))
+    user_accounts = cache_events.batch_getUserAccountData(users).set_index('user')
+    '''Best (collateral, debt) pair and debt to cover of every user, multi-asset positions included'''
+    engine = health_engine.build_engine(list(user_accounts.index))
+    plans = liquidation_planner.plan_from_reserve_table(engine, reserve_config, hf_threshold=np.inf).set_index('user')
+    for user, user_account in user_accounts.iterrows():
+        if user not in plans.index:
+            continue
+        plan = plans.loc[user]
+        b_name = plan.debt_name
+        c_name = plan.collateral_name
+        bonus = reserve_config[reserve_config.name == c_name].liq_bonus.values[0]
+        max_liquidatable_debt = plan.debt_to_cover_eth
+        liquidated_reward = max_liquidatable_debt * plan.bonus
+        profit_in_eth = plan.profit_eth
+        ratio = get_chainlink_ratio_from_eth(chainlink_feed_config, to_asset='USD')
+        profit_in_usd = profit_in_eth * ratio
+
+        if c_name != 'WETH':
+            if c_name == 'WBTC':
+                c_name = 'BTC'
+            chainlink_feed_config[c_name] = list(feed_registry.get_ens_feed(from_asset='ETH', to_asset=c_name))
+        col_amount = plan.collateral_received
+
+        if b_name != 'WETH':
+            if b_name == 'WBTC':
+                b_name = 'BTC'
+            chainlink_feed_config[b_name] = list(feed_registry.get_ens_feed(from_asset='ETH', to_asset=b_name))
+        borrow_amount = plan.debt_to_cover
+
+        print(user, borrow_amount, 'eth/{}'.format(b_name), profit_in_usd)
+
+        Liquidated_reward.append(liquidated_reward)
+
+        Bonus.append(bonus)
+        Col_Type.append(c_name)
+        Col_amount.append(col_amount)
+        Borrow_Type.append(b_name)
+        Borrow_amount.append(borrow_amount)
+        Liq_threshold.append(user_account.liquidation_threshold/100.0)
+        Health_factor.append(user_account.healthFactor)
+        User.append(user)
 
     df = pd.DataFrame({'bonus':Bonus,'col_type':Col_Type,'col_amount':Col_amount,
                        'borrow_type':Borrow_Type, 'borrow_amount':Borrow_amount,
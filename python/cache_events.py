@@ -1,21 +1,29 @@
-import os
 import datetime
 import numpy as np
 import pandas as pd
-import pickle
 import glob
 from web3 import Web3
-from web3._utils.abi import get_constructor_abi, merge_args_and_kwargs
-from web3._utils.events import get_event_data
 from web3._utils.filters import construct_event_filter_params
+from eth_utils import event_abi_to_log_topic
 
 from reserve_asset import convert_addr_in_crypto_asset
 from reserve_asset import split_user_loan_deposit_bitmask
+from reserve_asset import decode_user_config_bitmasks
 from reserve_asset import split_asset_config_bitmask
+from reserve_asset import is_borrowing
 
 import config
 from config import CACHE_FOLDER
 import aave_events
+import multicall
+import rpc_batch
+import web3_client
+import block_range
+import event_decoder
+import event_store
+import state_store
+import mmap_snapshot
+from record_builder import ColumnarRecordBuilder
 
 
 def make_event_handler(event, from_block, to_block):
@@ -37,52 +45,95 @@ def make_event_handler(event, from_block, to_block):
     return event_filter_params, abi, abi_codec
 
 
+def make_filter_params(event, from_block, to_block):
+    event_filter_params, _, _ = make_event_handler(event=event, from_block=from_block, to_block=to_block)
+    return event_filter_params
+
+
+'''Decode all logs of the event at once, convert them by the aave_events handler
+   and append the columns to the builder
+'''
+def collect_events(builder, abi, logs, event_handler):
+    columns = event_decoder.get_decoder(abi).decode(logs)
+    d = event_handler(event_data=columns)
+    for name, _ in aave_events.EVENT_META_SCHEMA:
+        d[name] = columns[name]
+    builder.extend(d)
+
+
+def make_event_frame(abi, logs, event_handler):
+    builder = ColumnarRecordBuilder(aave_events.EVENT_SCHEMAS[abi['name']], capacity=len(logs))
+    collect_events(builder, abi, logs, event_handler)
+    return builder.to_frame()
+
+
 def get_latest_block_meta():
-    web3 = Web3(Web3.HTTPProvider(config.Infura_EndPoint))
+    web3 = web3_client.get_web3()
     latest_block_meta = web3.eth.get_block('latest')
     return latest_block_meta
 
+'''All cached events from the event store, prefer event_store.read_events with column
+   projection and block range when only part of the history is needed
+'''
 def load_events_from_cache():
-    cached_block_to_fname = {}
-    for fname in glob.glob('{}/cached_events_*.bin'.format(CACHE_FOLDER)):
-        block = int(fname.split('_')[-1].split('.')[0])
-        cached_block_to_fname[block] = fname
-
-    if len(cached_block_to_fname) > 0:
-        cached_blocks = sorted(cached_block_to_fname.keys())
-        last_cached_block = cached_blocks[-1]
-        print('Load cached data from:{}'.format(cached_block_to_fname[last_cached_block]))
-        cached_data = pickle.load(open(cached_block_to_fname[last_cached_block],'rb'))
-    else:
-        cached_data = None, None
-
+    last_cached_block = event_store.get_last_block()
+    if last_cached_block is None:
+        return None, None
+    cached_data = {event_name: event_store.read_events(event_name) for event_name in event_store.list_events()}
     return cached_data, last_cached_block
 
+ACCOUNT_DATA_SCHEMA = [('col', np.float64), ('debt', np.float64), ('available', np.float64),
+                       ('liquidation_threshold', np.float64), ('ltv', np.float64),
+                       ('healthFactor', np.float64), ('user', object), ('verified_block', np.int64)]
+
+def make_user_account_frame(user_address, ret, verified_block):
+    builder = ColumnarRecordBuilder(ACCOUNT_DATA_SCHEMA, capacity=len(user_address))
+    for user, r in zip(user_address, ret):
+        if r is None:
+            continue
+        builder.append(col=r[0] / 1e18, debt=r[1] / 1e18, available=r[2] / 1e18,
+                       liquidation_threshold=r[3] / 100.0, ltv=r[4] / 100.0,
+                       healthFactor=r[5] / 1e18, user=user, verified_block=verified_block)
+    if len(builder) < len(user_address):
+        print('getUserAccountData failed for {} users'.format(len(user_address) - len(builder)))
+    return builder.to_frame()
+
+'''Collect getUserAccountData for all users, calls are batched via Multicall,
+   users with failed call are skipped and will be queried on the next run.
+   All calls are done at the same block, it is kept in verified_block column
+'''
+def batch_getUserAccountData(user_address, batch_size=config.MULTICALL_BATCH_SIZE, block_identifier='latest'):
+    contract = web3_client.get_lending_pool()
+    block = block_range.resolve_block(block_identifier)
+    ret = multicall.call_function_batch(contract, 'getUserAccountData',
+                                        [[user] for user in user_address], batch_size=batch_size,
+                                        block_identifier=block)
+    return make_user_account_frame(user_address, ret, block)
+
+'''Same as batch_getUserAccountData, Multicall batches are sent concurrently,
+   @on_frame - optional callback, gets account data frame of every batch as soon as it arrives
+'''
+def async_getUserAccountData(user_address, on_frame=None, block_identifier='latest'):
+    contract = web3_client.get_lending_pool()
+    block = block_range.resolve_block(block_identifier)
+    '''aiohttp is needed by the async scanner only'''
+    import async_scanner
+    on_batch = None
+    if on_frame is not None:
+        on_batch = lambda args_list, ret: on_frame(make_user_account_frame([args[0] for args in args_list], ret, block))
+
+    ret = async_scanner.scan_function_batch(contract, 'getUserAccountData',
+                                            [[user] for user in user_address], on_batch=on_batch,
+                                            block_identifier=block)
+    return make_user_account_frame(user_address, ret, block)
+
 def wrapper_getUserAccountData(user_address):
-    web3 = Web3(Web3.HTTPProvider(config.Infura_EndPoint))
-    contract = web3.eth.contract(address=config.Lending_Pool_V2_Address,
-                                 abi=config.Lending_Pool_V2_ABI)
-    user_account = []
-    for user in user_address:
-        S = {}
-        ret = contract.functions.getUserAccountData(user).call()
-        S['col'] = [ret[0] / 1e18]
-        S['debt'] = ret[1] / 1e18
-        S['availableBorrow'] = ret[2] / 1e18
-        S['liquidation_threshold'] = ret[3] / 100.0
-        S['ltv'] = ret[4] / 100.0
-        S['healthFactor'] = ret[5] / 1e18
-        S['user'] = user
-        df = pd.DataFrame(S)
-        user_account.append(df)
-
-    df = pd.concat(user_account)
-    return df
+    df = batch_getUserAccountData(user_address)
+    return df.rename(columns={'available': 'availableBorrow'})
 
 '''Get assets index'''
 def wrapper_getReservesList():
-    web3 = Web3(Web3.HTTPProvider(config.Infura_EndPoint))
-    contract = web3.eth.contract(address=config.Lending_Pool_V2_Address, abi=config.Lending_Pool_V2_ABI)
+    contract = web3_client.get_lending_pool()
     reserve_to_index = []
     ret = contract.functions.getReservesList().call()
     for i in range(len(ret)):
@@ -90,54 +141,42 @@ def wrapper_getReservesList():
         reserve_to_index.append(ret[i])
 
     return reserve_to_index
+
+RESERVE_CONFIG_SCHEMA = [('name', object), ('addr', object), ('ltv', np.float64), ('liq_threshold', np.float64),
+                         ('liq_bonus', np.float64), ('decimals', np.int64)]
+RESERVE_DATA_SCHEMA = RESERVE_CONFIG_SCHEMA + [('variable_rate', np.float64), ('stable_rate', np.float64)]
+
 '''Call getConfiguration, input args:
    @reserve_to_index - list of the AAVE reserve asset from getReservesList() function!
    Returns reserve asset configuratios
 '''
 def wrapper_getConfiguration(reserve_to_index):
-    web3 = Web3(Web3.HTTPProvider(config.Infura_EndPoint))
-    contract = web3.eth.contract(address=config.Lending_Pool_V2_Address, abi=config.Lending_Pool_V2_ABI)
-    S = {}
-    c = []
-    for asset_addr in reserve_to_index:
-        ret = contract.functions.getConfiguration(asset_addr).call()
+    contract = web3_client.get_lending_pool()
+    transport = rpc_batch.BatchTransport()
+    futures = [transport.eth_call(contract, 'getConfiguration', [asset_addr]) for asset_addr in reserve_to_index]
+    builder = ColumnarRecordBuilder(RESERVE_CONFIG_SCHEMA, capacity=len(reserve_to_index))
+    for asset_addr, ret in zip(reserve_to_index, transport.gather(futures)):
         print("asset:{}, config:{}".format(convert_addr_in_crypto_asset(asset_addr), ret[0]))
         ltv, liq_threshold, liq_bonus, decimals = split_asset_config_bitmask(ret[0])
         asset_name = convert_addr_in_crypto_asset(asset_addr)
-        S['name'] = [asset_name]
-        S['addr'] = [asset_addr]
-        S['ltv'] = [ltv]
-        S['liq_threshold'] = [liq_threshold]
-        S['liq_bonus'] = [liq_bonus]
-        S['decimals'] = [decimals]
-        df = pd.DataFrame(S)
-        c.append(df)
-    c = pd.concat(c)
-    return c
+        builder.append(name=asset_name, addr=asset_addr, ltv=ltv, liq_threshold=liq_threshold,
+                       liq_bonus=liq_bonus, decimals=decimals)
+    return builder.to_frame()
 
 '''18447685934079306374476'''
 def wrapper_getReserveData(reserve_to_index):
-    web3 = Web3(Web3.HTTPProvider(config.Infura_EndPoint))
-    contract = web3.eth.contract(address=config.Lending_Pool_V2_Address, abi=config.Lending_Pool_V2_ABI)
-    S = {}
-    c = []
-    for asset_addr in reserve_to_index:
-        ret = contract.functions.getReserveData(asset_addr).call()
+    contract = web3_client.get_lending_pool()
+    transport = rpc_batch.BatchTransport()
+    futures = [transport.eth_call(contract, 'getReserveData', [asset_addr]) for asset_addr in reserve_to_index]
+    builder = ColumnarRecordBuilder(RESERVE_DATA_SCHEMA, capacity=len(reserve_to_index))
+    for asset_addr, ret in zip(reserve_to_index, transport.gather(futures)):
         print("asset:{}, config:{}".format(convert_addr_in_crypto_asset(asset_addr), ret[0][0]))
         ltv, liq_threshold, liq_bonus, decimals = split_asset_config_bitmask(ret[0][0])
         asset_name = convert_addr_in_crypto_asset(asset_addr)
-        S['name'] = [asset_name]
-        S['addr'] = [asset_addr]
-        S['ltv'] = [ltv]
-        S['liq_threshold'] = [liq_threshold]
-        S['liq_bonus'] = [liq_bonus]
-        S['decimals'] = [decimals]
-        S['variable_rate'] = ret[4]/1e27
-        S['stable_rate'] = ret[5] / 1e27
-        df = pd.DataFrame(S)
-        c.append(df)
-    c = pd.concat(c)
-    return c
+        builder.append(name=asset_name, addr=asset_addr, ltv=ltv, liq_threshold=liq_threshold,
+                       liq_bonus=liq_bonus, decimals=decimals,
+                       variable_rate=ret[4] / 1e27, stable_rate=ret[5] / 1e27)
+    return builder.to_frame()
 
 
 ''' Call getUserConfiguration, input args:
@@ -150,8 +189,7 @@ def wrapper_getUserConfiguration(user, reserve_to_index):
     '''Get user asset config'''
     borrowed = []
     collateral = []
-    web3 = Web3(Web3.HTTPProvider(config.Infura_EndPoint))
-    contract = web3.eth.contract(address=config.Lending_Pool_V2_Address, abi=config.Lending_Pool_V2_ABI)
+    contract = web3_client.get_lending_pool()
     ret = contract.functions.getUserConfiguration(user).call()
     if ret[0] > 0:
         s = split_user_loan_deposit_bitmask(ret[0])
@@ -166,28 +204,76 @@ def wrapper_getUserConfiguration(user, reserve_to_index):
 
     return collateral, borrowed
 
+USER_CONFIG_SCHEMA = [('user', object), ('bitmask', object), ('verified_block', np.int64)]
+
+''' Bulk getUserConfiguration, calls are batched via Multicall and done at the same block
+    Returns frame of user, bitmask (int), verified_block, users with failed call are skipped
+'''
+def batch_getUserConfigurationBitmask(user_address, batch_size=config.MULTICALL_BATCH_SIZE, block_identifier='latest'):
+    contract = web3_client.get_lending_pool()
+    block = block_range.resolve_block(block_identifier)
+    ret = multicall.call_function_batch(contract, 'getUserConfiguration',
+                                        [[user] for user in user_address], batch_size=batch_size,
+                                        block_identifier=block)
+    builder = ColumnarRecordBuilder(USER_CONFIG_SCHEMA, capacity=len(user_address))
+    for user, r in zip(user_address, ret):
+        if r is not None:
+            builder.append(user=user, bitmask=r[0][0], verified_block=block)
+    return builder.to_frame()
+
+''' Users x reserves (getReservesList order) collateral and borrowed bool matrices
+    @user_config - frame of batch_getUserConfigurationBitmask
+'''
+def user_configuration_matrix(user_config, reserve_to_index):
+    return decode_user_config_bitmasks(user_config.bitmask.values, len(reserve_to_index))
+
+''' Users with changed (or new) configuration in user_config compared to prev_user_config'''
+def changed_user_configuration(prev_user_config, user_config):
+    prev_bitmask = prev_user_config.set_index('user').bitmask
+    bitmask = user_config.set_index('user').bitmask
+    prev_bitmask = prev_bitmask.reindex(bitmask.index)
+    I = prev_bitmask.isna().values | (prev_bitmask.values != bitmask.values)
+    return list(bitmask.index[I])
+
+''' Bulk version of wrapper_getUserConfiguration
+    Returns dict user -> (collateral, borrowed), users with failed call are skipped
+'''
+def batch_getUserConfiguration(user_address, reserve_to_index, batch_size=config.MULTICALL_BATCH_SIZE):
+    user_config = batch_getUserConfigurationBitmask(user_address, batch_size=batch_size)
+    collateral, borrowed = user_configuration_matrix(user_config, reserve_to_index)
+    asset_names = np.array([convert_addr_in_crypto_asset(addr) for addr in reserve_to_index], dtype=object)
+    S = {}
+    for i, user in enumerate(user_config.user):
+        S[user] = (list(asset_names[collateral[i]]), list(asset_names[borrowed[i]]))
+    return S
+
+'''getUserConfiguration bitmask of the users upserted into the state store,
+   Returns users whose bitmask changed compared to the previous snapshot in the state store,
+   users without a previous bitmask are only recorded
+'''
+def query_user_configuration_and_cache(user_address):
+    prev_user_config = state_store.load_user_configuration(users=user_address)
+    user_config = batch_getUserConfigurationBitmask(user_address)
+    state_store.upsert_user_configuration(user_config)
+    prev_users = set(prev_user_config.user)
+    return [user for user in changed_user_configuration(prev_user_config, user_config) if user in prev_users]
+
+'''Current getUserConfiguration of all users in the state store, None if there is no one'''
+def load_latest_user_configuration_from_cache():
+    df = state_store.load_user_configuration()
+    if len(df) == 0:
+        return None
+    return df
+
 def query_liquidation_call_event(from_block, to_block='latest'):
-    web3 = Web3(Web3.HTTPProvider(config.Infura_EndPoint))
-    contract = web3.eth.contract(address=config.Lending_Pool_V2_Address, abi=config.Lending_Pool_V2_ABI)
+    contract = web3_client.get_lending_pool()
     event_name = 'LiquidationCall'
     event_handler = aave_events.handle_liquidation_call
     event = getattr(contract.events, event_name)
-    event_filter_params, abi, abi_codec = make_event_handler(event=event,
-        from_block=from_block, to_block=to_block)
-    logs = contract.events.Borrow.web3.eth.getLogs(event_filter_params)
-    collected_events = []
-    for entry in logs:
-        data = dict(get_event_data(abi_codec, abi, entry))
-        block_number = data['blockNumber']
-        transaction_hash = data['transactionHash'].hex()
-        d = event_handler(event_data=dict(data['args']))
-        d['block_number'] = [block_number]
-        d['transaction_hash'] = [transaction_hash]
-        df = pd.DataFrame(d)
-        collected_events.append(df)
-
-    if len(collected_events) > 0:
-        collected_events = pd.concat(collected_events)
+    abi = event._get_event_abi()
+    logs = block_range.get_event_logs(event, make_filter_params, from_block=from_block, to_block=to_block)
+    if len(logs) > 0:
+        collected_events = make_event_frame(abi, logs, event_handler)
     else:
         collected_events = None
 
@@ -195,112 +281,385 @@ def query_liquidation_call_event(from_block, to_block='latest'):
 
 
 
-def query_user_health_factor_and_cache(user_address, last_cached_block):
-    web3 = Web3(Web3.HTTPProvider(config.Infura_EndPoint))
-    contract = web3.eth.contract(address=config.Lending_Pool_V2_Address,
-                                 abi=config.Lending_Pool_V2_ABI)
-    user_account = []
+'''getUserAccountData of the users upserted into the state store, accounts of other users are kept as is
+   @use_async - scan users concurrently, every batch is upserted as it arrives
+'''
+def query_user_health_factor_and_cache(user_address, last_cached_block, use_async=False):
     t1 = datetime.datetime.now()
-    for user in user_address:
-        S = {}
-        ret = contract.functions.getUserAccountData(user).call()
-        S['col'] = [ret[0]/1e18]
-        S['debt'] = [ret[1]/1e18]
-        S['available'] = [ret[2]/1e18]
-        S['liquidation_threshold'] = [ret[3]/100.0]
-        S['ltv'] = [ret[4]/100.0]
-        S['healthFactor'] = [ret[5]/1e18]
-        S['user'] = [user]
-
-        df = pd.DataFrame(S)
-        user_account.append(df)
-
-        if len(user_account) % 100 == 0:
-            print('Collected health factor for {}/{} users'.format(len(user_account),len(user_address)))
-
+    if use_async:
+        def on_frame(df):
+            state_store.upsert_accounts(df, last_cached_block)
+        async_getUserAccountData(user_address, on_frame=on_frame)
+    else:
+        state_store.upsert_accounts(batch_getUserAccountData(user_address), last_cached_block)
+    export_accounts_snapshot(last_cached_block)
     t2 = datetime.datetime.now()
     print('time:{}'.format((t2 - t1).total_seconds()))
-    user_account = pd.concat(user_account)
-    now = datetime.datetime.now()
-    user_account.to_hdf('{}/user_data_{}_{}.h5'.format(CACHE_FOLDER, now.strftime("%Y%m%d_%H%M%S"), last_cached_block),
-                        key='user_account')
     pass
 
-''' Cached health factor over all cached borrowd accounts
-    date and time is when getUserAccountData() called,
-    latest_cached_block is when account list is created!
+'''Users touched by LendingPool events after the block they were verified at
+   @verified_blocks - Series user -> verified block
+   @alive_users - users kept even if they do not borrow anymore (to refresh closed positions)
+   Returns list of touched users, users not in verified_blocks are touched by any event after from_block,
+   users without borrowing bits in getUserConfiguration are skipped
+'''
+def query_touched_users(verified_blocks, from_block, event_names=config.INCREMENTAL_REFRESH_EVENTS, alive_users=None):
+    touched = []
+    for event_name in event_names:
+        for field in aave_events.EVENT_USER_FIELDS[event_name]:
+            events = read_event_columns(event_name, columns=[field, 'block_number'], from_block=from_block)
+            if len(events) == 0:
+                continue
+            last_event_block = events.groupby(field).block_number.max()
+            verified = verified_blocks.reindex(last_event_block.index).fillna(-1)
+            touched += list(last_event_block.index[last_event_block.values > verified.values])
+    return filter_borrowers(list(set(touched)), keep=alive_users)
+
+'''Users borrowing any reserve, getUserConfiguration of the users not in keep is queried and upserted into the
+   state store, users with failed call are kept
 '''
-def load_latest_health_factor_from_cache():
+def filter_borrowers(users, keep=None):
+    keep = set(keep) if keep is not None else set()
+    candidates = [user for user in users if user not in keep]
+    if len(candidates) == 0:
+        return users
+    user_config = batch_getUserConfigurationBitmask(candidates)
+    state_store.upsert_user_configuration(user_config)
+    non_borrowers = set(user_config.user[~user_config.bitmask.map(is_borrowing).values.astype(bool)])
+    print('Touched users: {}, skip {} without borrowing'.format(len(users), len(non_borrowers)))
+    return [user for user in users if user not in non_borrowers]
+
+'''Import the latest timestamped user_data_<date>_<time>_<block>.h5 snapshot into an empty state store'''
+def import_legacy_health_factor_snapshot():
     S = {}
     for fname in glob.glob('{}/user_data_*.h5'.format(CACHE_FOLDER)):
-        date = int(fname.split('_')[-3])
-        time = int(fname.split('_')[-2])
         block = int(fname.split('_')[-1].split('.')[0])
-        S[block] = (fname, date, time)
-
+        S[block] = fname
+    if len(S) == 0:
+        return
     latest_cached_block = sorted(S.keys())[-1]
-    fname = S[latest_cached_block][0]
-    date = S[latest_cached_block][1]
-    time = S[latest_cached_block][2]
-    df = pd.read_hdf(fname, key='user_account')
+    df = pd.read_hdf(S[latest_cached_block], key='user_account')
+    if 'verified_block' not in df.columns:
+        df['verified_block'] = latest_cached_block
+    print('Import {} accounts from {}'.format(len(df), S[latest_cached_block]))
+    state_store.upsert_accounts(df, latest_cached_block)
+
+'''Memory-mapped snapshot of the events if it is consistent with the event store, else None'''
+def load_events_snapshot(event_name):
+    snapshot = mmap_snapshot.load_events(event_name)
+    if snapshot is None or snapshot.block is None:
+        return None
+    last_block = event_store.get_last_block(event_name)
+    if last_block is None or snapshot.block > last_block:
+        return None
+    return snapshot
+
+'''Columns of the cached events, events up to the snapshot block from the memory-mapped snapshot,
+   later ones (and all if there is no snapshot) from the event store
+'''
+def read_event_columns(event_name, columns, from_block=None):
+    snapshot = load_events_snapshot(event_name)
+    if snapshot is None:
+        return event_store.read_events(event_name, columns=columns, from_block=from_block)
+    rows = None
+    if from_block is not None:
+        rows = np.flatnonzero(snapshot.column('block_number') >= from_block)
+    df = snapshot.to_frame(columns, rows=rows)
+    tail = event_store.read_events(event_name, columns=columns,
+                                   from_block=max(snapshot.block + 1, from_block if from_block is not None else 0))
+    if len(tail) == 0:
+        return df
+    return pd.concat([df, tail], ignore_index=True)
+
+'''Export the events snapshots of event_names with at least SNAPSHOT_EXPORT_MIN_ROWS confirmed events after the
+   snapshot (or without a snapshot)
+'''
+def export_events_snapshots(event_names):
+    for event_name in event_names:
+        last_block = event_store.get_last_block(event_name)
+        if last_block is None:
+            continue
+        snapshot = load_events_snapshot(event_name)
+        if snapshot is not None:
+            if snapshot.block == last_block:
+                continue
+            new = event_store.read_events(event_name, columns=['block_number'], from_block=snapshot.block + 1,
+                                          unconfirmed=False)
+            if len(new) < config.SNAPSHOT_EXPORT_MIN_ROWS:
+                continue
+        events = event_store.read_events(event_name, to_block=last_block, unconfirmed=False)
+        if len(events) > 0:
+            mmap_snapshot.export_events(event_name, events, last_block)
+
+'''Export the accounts snapshot if there is no one or at least SNAPSHOT_EXPORT_MIN_ROWS accounts were verified
+   after it
+'''
+def export_accounts_snapshot(last_cached_block):
+    snapshot = mmap_snapshot.load_snapshot(mmap_snapshot.ACCOUNTS_SNAPSHOT)
+    verified_block = snapshot.meta.get('verified_block') if snapshot is not None else None
+    if verified_block is not None and \
+            state_store.count_accounts(verified_from=verified_block) < config.SNAPSHOT_EXPORT_MIN_ROWS:
+        return
+    mmap_snapshot.export_accounts(state_store.load_accounts(), last_cached_block, state_store.get_meta()['updated_at'])
+
+'''Accounts filtered as the state store query'''
+def filter_accounts(df, alive=False, hf_max=None):
+    I = np.ones(len(df), dtype=bool)
+    if alive:
+        I &= (df.col.values > 0) & (df.debt.values > 0)
+    if hf_max is not None:
+        I &= df.healthFactor.values < hf_max
+    return df[I]
+
+''' Cached health factor of the accounts in the state store
+    date and time is when getUserAccountData() was stored,
+    latest_cached_block is when account list is created!
+    @alive - only accounts with collateral and debt, @hf_max - only accounts with health factor below
+    Accounts of the memory-mapped snapshot are merged with the accounts verified after it
+    Returns empty frame (state_store.ACCOUNT_COLUMNS) and None block, date and time if no account is cached,
+    latest_cached_block is None if accounts were stored without it
+'''
+def load_latest_health_factor_from_cache(alive=False, hf_max=None):
+    if state_store.count_accounts() == 0:
+        import_legacy_health_factor_snapshot()
+    meta = state_store.get_meta()
+    if state_store.count_accounts() == 0 or 'updated_at' not in meta:
+        print('No cached account data in {}'.format(state_store.STATE_STORE_FNAME))
+        return pd.DataFrame(columns=state_store.ACCOUNT_COLUMNS), None, None, None
+    latest_cached_block = int(meta['last_cached_block']) if 'last_cached_block' in meta else None
+    date, time = [int(s) for s in meta['updated_at'].split('_')]
+    df, verified_block = mmap_snapshot.load_accounts(alive=alive, hf_max=hf_max)
+    if df is None:
+        df = state_store.load_accounts(alive=alive, hf_max=hf_max)
+    else:
+        changed = state_store.load_accounts(verified_from=verified_block)
+        df = pd.concat([df[~df.user.isin(changed.user)], filter_accounts(changed, alive=alive, hf_max=hf_max)],
+                       ignore_index=True)
     return df, latest_cached_block, date, time
 
 
 
-def update_cache():
-    event_handlers = {'Borrow': aave_events.handle_borrow,
-                      'Repay': aave_events.handle_repay,
-                      'Swap':  aave_events.handle_swap}
-    event_cache, from_block = load_events_from_cache()
-    if from_block is None:
-        from_block = 11363357 #Dec-01-2020 12:17:34
-        event_cache = {}
-        print('Empty cache!')
+'''topic0 (event signature hash) to (event name, event abi, handler) of the contract events'''
+def make_topic0_table(contract, event_handlers):
+    topic0_table = {}
+    for event_name, handler in event_handlers.items():
+        abi = getattr(contract.events, event_name)._get_event_abi()
+        topic0 = Web3.toHex(event_abi_to_log_topic(abi))
+        topic0_table[topic0] = (event_name, abi, handler)
+    return topic0_table
 
+'''Single getLogs filter matching any of the topic0 (OR of the event signatures)'''
+def make_multi_event_filter_params(contract, topic0_table, from_block, to_block):
+    return {'address': contract.address,
+            'topics': [sorted(topic0_table.keys())],
+            'fromBlock': from_block,
+            'toBlock': to_block}
+
+'''Split logs by topic0 to event name, unknown topics are dropped'''
+def dispatch_logs(logs, topic0_table):
+    S = {}
+    for entry in logs:
+        topic0 = Web3.toHex(entry['topics'][0])
+        if topic0 in topic0_table:
+            event_name = topic0_table[topic0][0]
+            S.setdefault(event_name, []).append(entry)
+    return S
+
+
+'''Headers of the blocks in one JSON-RPC batch, frame of event_store.BLOCK_COLUMNS'''
+def query_block_headers(blocks):
+    transport = rpc_batch.BatchTransport()
+    headers = transport.gather([transport.eth_getBlockByNumber(int(block)) for block in blocks])
+    return pd.DataFrame({'block_number': np.array([h['number'] for h in headers], dtype=np.int64),
+                         'block_hash': [Web3.toHex(h['hash']) for h in headers],
+                         'parent_hash': [Web3.toHex(h['parentHash']) for h in headers]},
+                        columns=event_store.BLOCK_COLUMNS)
+
+'''First stored block whose hash or parent hash differs from the canonical header, None if there is no one'''
+def find_reorg_block(blocks, headers):
+    canonical = headers.set_index('block_number').reindex(blocks.block_number)
+    I = (canonical.block_hash.values != blocks.block_hash.values) | \
+        (canonical.parent_hash.values != blocks.parent_hash.values)
+    if not I.any():
+        return None
+    return int(blocks.block_number.values[I].min())
+
+'''Unconfirmed tier without the blocks from block on'''
+def truncate_unconfirmed(tier, block):
+    return {'blocks': tier['blocks'][tier['blocks'].block_number < block].reset_index(drop=True),
+            'events': {event_name: df[df.block_number < block].reset_index(drop=True)
+                       for event_name, df in tier['events'].items()}}
+
+'''Roll back the blocks of the unconfirmed tier replaced by a reorg, the canonical headers of the confirmed tip
+   and of the tier blocks are fetched in one batch, Returns the valid part of the tier.
+   If the confirmed tip itself was replaced (reorg deeper than REORG_CONFIRMATION_BLOCKS) the last
+   DEEP_REORG_REFETCH_BLOCKS confirmed blocks are dropped from the event store, fetched again by update_cache,
+   and the whole tier is dropped
+'''
+def rollback_unconfirmed(tier):
+    blocks = tier['blocks']
+    manifest = event_store.load_manifest()
+    check_tip = manifest['last_block'] is not None and manifest.get('last_block_hash') is not None
+    if not check_tip and len(blocks) == 0:
+        return tier
+    headers = query_block_headers(([manifest['last_block']] if check_tip else []) + list(blocks.block_number))
+    if check_tip:
+        if headers.block_hash.values[0] != manifest['last_block_hash']:
+            from_block = max(manifest['last_block'] - config.DEEP_REORG_REFETCH_BLOCKS + 1, 0)
+            print('Reorg deeper than {} blocks at confirmed block {}, fetch again from block {}'.
+                  format(config.REORG_CONFIRMATION_BLOCKS, manifest['last_block'], from_block))
+            event_store.truncate_events(from_block)
+            return truncate_unconfirmed(tier, 0)
+        headers = headers.iloc[1:]
+    if len(blocks) == 0:
+        return tier
+    reorg_block = find_reorg_block(blocks, headers)
+    if reorg_block is None:
+        return tier
+    print('Reorg: roll back blocks {} - {}'.format(reorg_block, int(blocks.block_number.max())))
+    return truncate_unconfirmed(tier, reorg_block)
+
+'''Move the tier blocks up to confirmed_block into event store partitions, Returns the rest of the tier
+   the tier is dropped (and fetched again) if it does not continue the confirmed history of all events
+'''
+def promote_unconfirmed(tier, confirmed_block, event_names):
+    blocks = tier['blocks']
+    if len(blocks) == 0:
+        return tier
+    last_block = event_store.get_last_block()
+    if set(event_store.get_last_block(event_name) for event_name in event_names) != {last_block} or \
+            int(blocks.block_number.min()) != last_block + 1:
+        print('Unconfirmed tier does not continue the event store, fetch it again')
+        return truncate_unconfirmed(tier, 0)
+    promoted = blocks[blocks.block_number <= confirmed_block]
+    if len(promoted) == 0:
+        return tier
+    to_block = int(promoted.block_number.max())
+    frames = {event_name: df[df.block_number <= to_block] for event_name, df in tier['events'].items()}
+    event_store.append_events({event_name: frames.get(event_name) for event_name in event_names},
+                              from_block=last_block + 1, to_block=to_block, block_hash=promoted.block_hash.values[-1])
+    return {'blocks': blocks[blocks.block_number > to_block].reset_index(drop=True),
+            'events': {event_name: df[df.block_number > to_block].reset_index(drop=True)
+                       for event_name, df in tier['events'].items()}}
+
+'''Fetch (from_block, latest_block] into the unconfirmed tier, events are kept only for blocks whose logs
+   carry the hash of the fetched header and the headers chain to the tier head
+'''
+def extend_unconfirmed(tier, from_block, latest_block, fetch_logs, event_abis, event_handlers):
+    if from_block > latest_block:
+        return tier
+    headers = query_block_headers(range(from_block, latest_block + 1))
+    window_logs = fetch_logs(from_block, latest_block)
+    frames = {event_name: make_event_frame(event_abis[event_name], logs, event_handlers[event_name])
+              for event_name, logs in window_logs.items() if len(logs) > 0}
+
+    hashes = headers.set_index('block_number').block_hash
+    valid_to = latest_block
+    for df in frames.values():
+        I = hashes.reindex(df.block_number).values != df.block_hash.values
+        if I.any():
+            valid_to = min(valid_to, int(df.block_number.values[I].min()) - 1)
+    parent_hashes = headers.parent_hash.values[1:] != headers.block_hash.values[:-1]
+    if parent_hashes.any():
+        valid_to = min(valid_to, int(headers.block_number.values[1:][parent_hashes].min()) - 1)
+    if len(tier['blocks']) > 0:
+        head_hash = tier['blocks'].block_hash.values[-1]
+    else:
+        head_hash = event_store.load_manifest().get('last_block_hash')
+    if head_hash is not None and headers.parent_hash.values[0] != head_hash:
+        print('Head moved during refresh at block {}, rolled back on the next update'.format(from_block))
+        return tier
+    if valid_to < latest_block:
+        print('Reorg during refresh, unconfirmed tier ends at block {}'.format(valid_to))
+
+    blocks = pd.concat([tier['blocks'], headers[headers.block_number <= valid_to]], ignore_index=True)
+    events = dict(tier['events'])
+    for event_name, df in frames.items():
+        df = df[df.block_number <= valid_to]
+        events[event_name] = pd.concat([events[event_name], df], ignore_index=True) if event_name in events else df
+    return {'blocks': blocks, 'events': events}
+
+
+'''Fetch again the events of the partitions missing or failing the checksum and rewrite them'''
+def repair_partitions(fetch_logs, event_abis, event_handlers):
+    planner = block_range.BlockRangePlanner(key='update_cache')
+    for event_name, b1, b2, fname in event_store.verify_partitions():
+        if event_name not in event_handlers:
+            print('Partition {} of {} is corrupted, {} is not collected'.format(fname, event_name, event_name))
+            continue
+        print('Partition {} of {} is missing or corrupted, fetch [{}, {}] again'.format(fname, event_name, b1, b2))
+        builder = ColumnarRecordBuilder(aave_events.EVENT_SCHEMAS[event_name])
+        for _, _, window_logs in planner.iter_ranges(fetch_logs, b1, b2,
+                                                     count_logs=lambda d: sum(len(l) for l in d.values())):
+            logs = window_logs.get(event_name, [])
+            if len(logs) > 0:
+                collect_events(builder, event_abis[event_name], logs, event_handlers[event_name])
+        event_store.rewrite_partition(event_name, builder.to_frame(), b1, b2)
+
+
+'''Ingest LendingPool events: blocks up to latest - REORG_CONFIRMATION_BLOCKS are confirmed and appended to
+   event store partitions, later blocks are kept in the unconfirmed tier. On every update blocks of the tier
+   replaced by a reorg are rolled back and fetched again, blocks that became confirmed are promoted.
+   Corrupted partitions are fetched again first.
+'''
+def update_cache(event_names=config.CACHED_EVENTS):
+    event_handlers = {event_name: aave_events.EVENT_HANDLERS[event_name] for event_name in event_names}
     latest_block_meta = get_latest_block_meta()
     latest_block = latest_block_meta['number']
-    print('Collect event from: {} to {}'.format(from_block, latest_block))
-
-    web3 = Web3(Web3.HTTPProvider(config.Infura_EndPoint))
-    contract = web3.eth.contract(address=config.Lending_Pool_V2_Address, abi=config.Lending_Pool_V2_ABI)
-    blocks_for_query = list(range(from_block, latest_block, 100000))
-    blocks_for_query.append(latest_block)
-    for i in range(len(blocks_for_query)-1):
-        t1 = datetime.datetime.now()
-        b1 = blocks_for_query[i]
-        b2 = blocks_for_query[i+1]
-        for event_name in event_handlers.keys():
-            event = getattr(contract.events, event_name)
-            event_filter_params, abi, abi_codec = make_event_handler(event=event, from_block=b1, to_block=b2)
-            #logs = contract.events.Borrow.web3.eth.getLogs(event_filter_params)
-            logs = event.web3.eth.getLogs(event_filter_params)
-            collected_events = []
-            for entry in logs:
-                data = dict(get_event_data(abi_codec, abi, entry))
-                block_number = data['blockNumber']
-                transaction_hash = data['transactionHash'].hex()
-                d = event_handlers[event_name](event_data=dict(data['args']))
-                d['block_number'] = [block_number]
-                d['transaction_hash'] = [transaction_hash]
-                df = pd.DataFrame(d)
-                collected_events.append(df)
-
-            if len(collected_events) > 0:
-                collected_events = pd.concat(collected_events)
-                if event_name in event_cache:
-                    event_cache[event_name] = pd.concat([event_cache[event_name], collected_events], ignore_index=True)
-                else:
-                    event_cache[event_name] = df
-        t2 = datetime.datetime.now()
-        query_time = t2 - t1
-        print('query start:{}, stop:{}, time:{}'.format(b1, b2, query_time.total_seconds()))
-        fname = '{}/cached_events_{}_{}.bin'.format(CACHE_FOLDER, t2.strftime("%Y%m%d"), b2)
-        pickle.dump(event_cache, open(fname, 'wb'))
-
-
-    now = datetime.datetime.now()
-    fname = '{}/cached_events_{}_{}.bin'.format(CACHE_FOLDER, now.strftime("%Y%m%d"), latest_block)
-    pickle.dump(event_cache, open(fname, 'wb'))
+    confirmed_block = latest_block - config.REORG_CONFIRMATION_BLOCKS
+
+    contract = web3_client.get_lending_pool()
+    topic0_table = make_topic0_table(contract, event_handlers)
+    event_abis = {event_name: abi for event_name, abi, _ in topic0_table.values()}
+
+    '''all events of the window are requested by a single getLogs'''
+    def fetch_logs(b1, b2):
+        logs = contract.web3.eth.getLogs(make_multi_event_filter_params(contract, topic0_table, b1, b2))
+        return dispatch_logs(logs, topic0_table)
+
+    repair_partitions(fetch_logs, event_abis, event_handlers)
+    tier = rollback_unconfirmed(event_store.load_unconfirmed())
+    tier = promote_unconfirmed(tier, confirmed_block, event_names)
+
+    '''events added to CACHED_EVENTS later are backfilled from the start'''
+    last_cached_blocks = {}
+    for event_name in event_names:
+        last_cached_block = event_store.get_last_block(event_name)
+        last_cached_blocks[event_name] = last_cached_block if last_cached_block is not None else 11363356
+    from_block = min(last_cached_blocks.values()) + 1 #Dec-01-2020 12:17:34 on empty cache
+    print('Collect event from: {} to {}, unconfirmed after {}'.format(from_block, latest_block, confirmed_block))
+
+    planner = block_range.BlockRangePlanner(key='update_cache')
+    checkpoint_block = from_block
+    event_builders = {event_name: ColumnarRecordBuilder(aave_events.EVENT_SCHEMAS[event_name])
+                      for event_name in event_names}
+    t1 = datetime.datetime.now()
+    for b1, b2, window_logs in planner.iter_ranges(fetch_logs, from_block, confirmed_block,
+                                                   count_logs=lambda d: sum(len(l) for l in d.values())):
+        for event_name, logs in window_logs.items():
+            logs = [entry for entry in logs if entry['blockNumber'] > last_cached_blocks[event_name]]
+            if len(logs) > 0:
+                collect_events(event_builders[event_name], event_abis[event_name], logs, event_handlers[event_name])
+
+        '''new partition every GET_LOGS_INITIAL_WINDOW blocks'''
+        if b2 - checkpoint_block >= config.GET_LOGS_INITIAL_WINDOW or b2 == confirmed_block:
+            t2 = datetime.datetime.now()
+            print('query start:{}, stop:{}, time:{}'.format(checkpoint_block, b2, (t2 - t1).total_seconds()))
+            block_hash = query_block_headers([b2]).block_hash.values[0] if b2 == confirmed_block else None
+            event_store.append_events({event_name: builder.to_frame() for event_name, builder in event_builders.items()},
+                                      from_block=checkpoint_block, to_block=b2, block_hash=block_hash)
+            for builder in event_builders.values():
+                builder.clear()
+            checkpoint_block = b2 + 1
+            t1 = t2
+
+    '''near head blocks are refreshed in the unconfirmed tier only'''
+    tier_head = int(tier['blocks'].block_number.max()) if len(tier['blocks']) > 0 else event_store.get_last_block()
+    tier = extend_unconfirmed(tier, tier_head + 1, latest_block, fetch_logs, event_abis, event_handlers)
+    event_store.save_unconfirmed(tier)
+
+    '''memory-mapped snapshots of the confirmed events'''
+    export_events_snapshots(event_names)
     pass
 
 if __name__ == '__main__':
@@ -0,0 +1,145 @@
+import os
+import json
+import pickle
+import hashlib
+import datetime
+import contextlib
+try:
+    import fcntl
+except ImportError:
+    import msvcrt
+    fcntl = None
+from config import CACHE_FOLDER
+
+'''Crash-safe cache layer.
+   Every artifact is written to a temporary file in the same folder, flushed to disk and renamed over the
+   target (os.replace is atomic) and the folder is flushed after the rename, so a crash leaves either the old
+   or the new file, never a partial one.
+   The manifest keeps per dataset the latest artifact (file, sha256, size, last block, write time) and the
+   last fully ingested block, the latest artifact is a dict lookup instead of globbing and parsing file names.
+'''
+CACHE_MANIFEST_FNAME = '{}/cache_manifest.json'.format(CACHE_FOLDER)
+
+
+def fsync_file(fname):
+    with open(fname, 'rb') as f:
+        os.fsync(f.fileno())
+
+'''Flush the folder entries (i.e. a rename) to disk, folders can not be opened on Windows'''
+def fsync_folder(folder):
+    if os.name != 'posix':
+        return
+    fd = os.open(folder, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+'''Context manager, yields a temporary file name to write to, renamed to fname on success'''
+@contextlib.contextmanager
+def atomic_path(fname):
+    folder = os.path.dirname(os.path.abspath(fname))
+    os.makedirs(folder, exist_ok=True)
+    tmp_fname = '{}.tmp{}'.format(fname, os.getpid())
+    try:
+        yield tmp_fname
+        fsync_file(tmp_fname)
+        os.replace(tmp_fname, fname)
+        fsync_folder(folder)
+    finally:
+        if os.path.exists(tmp_fname):
+            os.remove(tmp_fname)
+
+'''Context manager, exclusive lock of fname (<fname>.lock) serializing writers of all processes'''
+@contextlib.contextmanager
+def file_lock(fname):
+    os.makedirs(os.path.dirname(os.path.abspath(fname)), exist_ok=True)
+    with open('{}.lock'.format(fname), 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def dump_json(obj, fname):
+    with atomic_path(fname) as tmp_fname:
+        with open(tmp_fname, 'w') as f:
+            json.dump(obj, f, indent=4)
+
+
+def dump_pickle(obj, fname):
+    with atomic_path(fname) as tmp_fname:
+        with open(tmp_fname, 'wb') as f:
+            pickle.dump(obj, f)
+
+
+def to_hdf(df, fname, **kwargs):
+    with atomic_path(fname) as tmp_fname:
+        df.to_hdf(tmp_fname, mode='w', **kwargs)
+
+
+def checksum(fname, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+'''True if the file exists and matches the sha256'''
+def verify(fname, sha256):
+    return os.path.exists(fname) and checksum(fname) == sha256
+
+
+def load(fname=CACHE_MANIFEST_FNAME):
+    if os.path.exists(fname):
+        return json.load(open(fname))
+    return {'datasets': {}}
+
+
+def save(manifest, fname=CACHE_MANIFEST_FNAME):
+    dump_json(manifest, fname)
+
+'''Record fname (already written) as the latest artifact of the dataset
+   @last_block - last block the artifact covers, also moves the last ingested block of the dataset
+'''
+def record(dataset, fname, last_block=None, **meta):
+    manifest = load()
+    S = manifest['datasets'].setdefault(dataset, {'last_block': None, 'latest': None})
+    S['latest'] = dict(meta, fname=os.path.relpath(fname, CACHE_FOLDER), sha256=checksum(fname),
+                       size=os.path.getsize(fname), last_block=last_block,
+                       created=datetime.datetime.now().strftime('%Y%m%d_%H%M%S'))
+    if last_block is not None:
+        S['last_block'] = last_block
+    save(manifest)
+    return S['latest']
+
+'''Latest artifact of the dataset (fname is absolute), None if there is no one or it fails the checksum'''
+def get_latest(dataset, check=True):
+    S = load()['datasets'].get(dataset)
+    if S is None or S['latest'] is None:
+        return None
+    latest = dict(S['latest'], fname=os.path.join(CACHE_FOLDER, S['latest']['fname']))
+    if check and not verify(latest['fname'], latest['sha256']):
+        print('Cache artifact {} of {} is missing or corrupted'.format(latest['fname'], dataset))
+        return None
+    return latest
+
+
+def set_last_block(dataset, block):
+    manifest = load()
+    manifest['datasets'].setdefault(dataset, {'last_block': None, 'latest': None})['last_block'] = block
+    save(manifest)
+
+'''Last fully ingested block of the dataset, None if nothing is ingested'''
+def get_last_block(dataset):
+    S = load()['datasets'].get(dataset)
+    return None if S is None else S['last_block']
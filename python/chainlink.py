@@ -1,4 +1,5 @@
-import config
+import rpc_batch
+import web3_client
 import pandas as pd
 import numpy as np
 from web3 import Web3
@@ -36,17 +37,16 @@ AccessControlledOffchainAggregator_Address ='0x37bC7498f4FF12C19678ee8fE19d713b8
 '''
 
 def get_price_from_aggregator(agg_addr):
-    web3 = Web3(Web3.HTTPProvider(config.Infura_EndPoint))
-    contract = web3.eth.contract(address=agg_addr, abi=AccessControlledOffchainAggregator_ABI)
+    contract = web3_client.get_contract(agg_addr, AccessControlledOffchainAggregator_ABI)
 
-    decimals = contract.functions.decimals().call()
-    ret = contract.functions.latestRoundData().call()
+    transport = rpc_batch.BatchTransport()
+    decimals, ret = transport.gather([transport.eth_call(contract, 'decimals'),
+                                      transport.eth_call(contract, 'latestRoundData')])
     round_id, price, started_at, timestamp, answered_in_round = ret
     return round_id, price / 10 ** decimals, started_at, timestamp, answered_in_round
 
 def get_decimals_from_aggregator(agg_addr):
-    web3 = Web3(Web3.HTTPProvider(config.Infura_EndPoint))
-    contract = web3.eth.contract(address=agg_addr, abi=AccessControlledOffchainAggregator_ABI)
+    contract = web3_client.get_contract(agg_addr, AccessControlledOffchainAggregator_ABI)
     decimals = contract.functions.decimals().call()
     return decimals
 
@@ -54,8 +54,7 @@ def get_decimals_from_aggregator(agg_addr):
 def get_aggregator(base, quote):
     abi = CHAIN_LINK_FEED_REG_ABI
     address = CHAIN_LINK_FEED_REG_ADDR
-    web3 = Web3(Web3.HTTPProvider(config.Infura_EndPoint))
-    contract = web3.eth.contract(address=address, abi=abi)
+    contract = web3_client.get_contract(address, abi)
     aggregator = contract.functions.getFeed(base=base, quote=quote).call()
     return aggregator
 
@@ -82,8 +81,7 @@ def find_pair_aggregator(base, quote):
 
 def get_feed_address(from_asset,to_asset):
 
-    web3 = Web3(Web3.HTTPProvider(config.Infura_EndPoint))
-    ns = ENS.fromWeb3(web3)
+    ns = ENS.fromWeb3(web3_client.get_web3())
     ens = "{}-{}.data.eth".format(from_asset.lower(), to_asset.lower())
     address = ns.address(ens)
     if address is not None:
@@ -102,8 +100,7 @@ def get_contract_addr_from_local_reg(base, quote):
     return CHAIN_LINK_ADDR[base][quote]
 
 def get_decimals(address):
-    web3 = Web3(Web3.HTTPProvider(config.Infura_EndPoint))
-    contract = web3.eth.contract(address=address, abi=CHAIN_LINK_ABI)
+    contract = web3_client.get_contract(address, CHAIN_LINK_ABI)
     decimals = contract.functions.decimals().call()
     return decimals
 
@@ -111,8 +108,7 @@ def get_decimals(address):
 '''
 def get_price(address, decimals):
 
-    web3 = Web3(Web3.HTTPProvider(config.Infura_EndPoint))
-    contract = web3.eth.contract(address=address, abi=CHAIN_LINK_ABI)
+    contract = web3_client.get_contract(address, CHAIN_LINK_ABI)
     ret = contract.functions.latestRoundData().call()
     round_id, price, started_at, timestamp, answered_in_round = ret
     return round_id, price/ 10**decimals, started_at, timestamp, answered_in_round
@@ -120,8 +116,7 @@ def get_price(address, decimals):
 '''See here: https://docs.chain.link/docs/get-the-latest-price/
 '''
 def get_price_from_reg(base, quote, decimals=None):
-    web3 = Web3(Web3.HTTPProvider(config.Infura_EndPoint))
-    contract = web3.eth.contract(address=CHAIN_LINK_FEED_REG_ADDR, abi=CHAIN_LINK_FEED_REG_ABI)
+    contract = web3_client.get_contract(CHAIN_LINK_FEED_REG_ADDR, CHAIN_LINK_FEED_REG_ABI)
     ret = contract.functions.latestRoundData(base, quote).call()
     round_id, price, started_at, timestamp, answered_in_round = ret
     if price is not None:
@@ -131,8 +126,7 @@ def get_price_from_reg(base, quote, decimals=None):
 
 
 def get_decimals_from_reg(base, quote):
-    web3 = Web3(Web3.HTTPProvider(config.Infura_EndPoint))
-    contract = web3.eth.contract(address=CHAIN_LINK_FEED_REG_ADDR, abi=CHAIN_LINK_FEED_REG_ABI)
+    contract = web3_client.get_contract(CHAIN_LINK_FEED_REG_ADDR, CHAIN_LINK_FEED_REG_ABI)
     decimals = contract.functions.decimals(base, quote).call()
     return decimals
 
@@ -1,4 +1,3 @@
-import config
 from config import CACHE_FOLDER
 import pandas as pd
 import numpy as np
@@ -8,10 +7,14 @@ import chainlink
 import aave_events
 import cache_events
 import bot_v1
-from web3 import Web3
+import block_range
+import feed_registry
+import price_store
+import receipts
+import event_decoder
+import web3_client
 from ens import ENS
 import matplotlib.pyplot as plt
-from web3._utils.events import get_event_data
 from web3._utils.filters import construct_event_filter_params
 
 
@@ -45,55 +48,49 @@ def handle_event(event_data, block, tx_hash, decimals):
     price = event_data['answer']/10**decimals
     return price
 
-def query_chainlink_event(aggregator_addr, from_block, to_block):
-    web3 = Web3(Web3.HTTPProvider(config.Infura_EndPoint))
-    contract = web3.eth.contract(address=aggregator_addr, abi=AccessControlledOffchainAggregator_ABI)
+"""Decoded NewTransmission (or AnswerUpdated) events of the aggregator
+   Returns dict of columns (see event_decoder), answer column is the price as int, and decimals
+"""
+def query_chainlink_event_columns(aggregator_addr, from_block, to_block, event_name='NewTransmission'):
+    contract = web3_client.get_contract(aggregator_addr, AccessControlledOffchainAggregator_ABI)
     decimals = contract.functions.decimals().call()
+    event = getattr(contract.events, event_name)
+    abi = event._get_event_abi()
+    abi_codec = event.web3.codec
+    logs = block_range.get_event_logs(event, cache_events.make_filter_params, from_block=from_block, to_block=to_block)
+    if len(logs) == 0:
+        return None, decimals
+    columns = event_decoder.get_decoder(abi, abi_codec).decode(logs)
+    if 'current' in columns:
+        columns['answer'] = columns['current']
+    return columns, decimals
+
+def query_chainlink_event(aggregator_addr, from_block, to_block):
     #event_name = 'AnswerUpdated'
     event_name = 'NewTransmission'
     event_handler = handle_event
-    event = getattr(contract.events, event_name)
-    event_filter_params, abi, abi_codec = make_event_handler(event=event,
-                                                             from_block=from_block,
-                                                             to_block=to_block)
-    logs = event.web3.eth.getLogs(event_filter_params)
-    if len(logs) > 0:
-        for entry in logs:
-            data = dict(get_event_data(abi_codec, abi, entry))
-            block_number = data['blockNumber']
-            tx_hash = data['transactionHash'].hex()
-            price = event_handler(block=block_number, tx_hash=tx_hash, event_data=dict(data['args']), decimals=decimals)
+    columns, decimals = query_chainlink_event_columns(aggregator_addr, from_block, to_block, event_name=event_name)
+    if columns is not None:
+        for i in range(len(columns['block_number'])):
+            block_number = columns['block_number'][i]
+            tx_hash = columns['transaction_hash'][i]
+            event_data = {name: column[i] for name, column in columns.items()}
+            price = event_handler(block=block_number, tx_hash=tx_hash, event_data=event_data, decimals=decimals)
         return block_number, price
     else:
         return None,None
 
 def query_aave_liquidation_event(from_block, to_block):
-    web3 = Web3(Web3.HTTPProvider(config.Infura_EndPoint))
-    contract = web3.eth.contract(address=config.Lending_Pool_V2_Address, abi=config.Lending_Pool_V2_ABI)
+    contract = web3_client.get_lending_pool()
     event = getattr(contract.events, 'LiquidationCall')
-    event_filter_params, abi, abi_codec = make_event_handler(event=event, from_block=from_block, to_block=to_block)
-    logs = event.web3.eth.getLogs(event_filter_params)
-    collected_events = []
-    for entry in logs:
-        data = dict(get_event_data(abi_codec, abi, entry))
-        block_number = data['blockNumber']
-        transaction_hash = data['transactionHash'].hex()
-        block_number = data['blockNumber']
-        transaction_hash = data['transactionHash'].hex()
-        d = aave_events.handle_liquidation_call(event_data=dict(data['args']))
-        d['block_number'] = [block_number]
-        d['transaction_hash'] = [transaction_hash]
-        df = pd.DataFrame(d)
-        collected_events.append(df)
-
-    collected_events = pd.concat(collected_events)
+    abi = event._get_event_abi()
+    logs = block_range.get_event_logs(event, cache_events.make_filter_params, from_block=from_block, to_block=to_block)
+    collected_events = cache_events.make_event_frame(abi, logs, aave_events.handle_liquidation_call)
     return collected_events
 
 
 def query_chainlink_state(aggregator_addr):
-    web3 = Web3(Web3.HTTPProvider(config.Infura_EndPoint))
-    contract = web3.eth.contract(address=aggregator_addr,
-                                 abi=AccessControlledOffchainAggregator_ABI)
+    contract = web3_client.get_contract(aggregator_addr, AccessControlledOffchainAggregator_ABI)
 
     ret = contract.functions.description().call()
     print(ret)
@@ -112,8 +109,7 @@ def query_chainlink_state(aggregator_addr):
 def get_aggregator(base, quote):
     abi = chainlink.CHAIN_LINK_FEED_REG_ABI
     address = chainlink.CHAIN_LINK_FEED_REG_ADDR
-    web3 = Web3(Web3.HTTPProvider(config.Infura_EndPoint))
-    contract = web3.eth.contract(address=address, abi=abi)
+    contract = web3_client.get_contract(address, abi)
     aggregator = contract.functions.getFeed(base=base, quote=quote).call()
     return aggregator
 
@@ -125,28 +121,15 @@ def test1():
     query_chainlink_event(aggregator_addr=aggregator, from_block=event_block-15, to_block=event_block+1)
 
 
+"""Gas payed in ETH for every transaction, receipts are requested in JSON-RPC batches
+"""
+def query_gas_payed(transactions, block_numbers=None):
+    return list(receipts.gas_cost(list(transactions), block_numbers))
+
 def query_historic_event_meta(from_block):
 
     def find_pair_aggregator(base, quote):
-        try:
-            aggregator = get_aggregator(base=base, quote=quote)
-            failed = False
-            direct = True
-        except:
-            failed = True
-
-        if failed:
-            try:
-                aggregator = get_aggregator(base=quote, quote=base)
-                failed = False
-                direct = False
-            except:
-                failed = True
-
-        if not failed:
-            return direct, aggregator
-        else:
-            return None, None
+        return feed_registry.get_reserve_feed(base, quote=quote)
 
     def convert_to_eth(ratio, is_direct, amount):
         if is_direct:
@@ -155,6 +138,7 @@ def query_historic_event_meta(from_block):
             return amount / ratio
 
     reserve_list, reserve_config = bot_v1.load_reserve_from_cache()
+    feed_registry.build(reserve_list)
     def reserve_name_to_add(name):
         return reserve_config[reserve_config.name == name].addr.values[0]
 
@@ -169,7 +153,7 @@ def query_historic_event_meta(from_block):
             direct, aggregator = find_pair_aggregator(base=asset_addr, quote=ETH_addr)
 
             if aggregator is not None:
-                block, _ = query_chainlink_event(aggregator_addr=aggregator,from_block=from_block,to_block=to_block)
+                block, _ = price_store.price_as_of(aggregator, to_block, max_age=to_block - from_block)
                 return block
             else:
                 return None
@@ -181,15 +165,24 @@ def query_historic_event_meta(from_block):
 
     liq_events = pd.read_csv('/home/yonic/junk/liq_events_{}.csv'.format(from_block))
 
+    """Backfill price history of all reserve feeds once, the loop below runs without oracle calls"""
+    aggregators = [find_pair_aggregator(base=r, quote=ETH_addr)[1] for r in reserve_list]
+    price_store.update([a for a in set(aggregators) if a is not None],
+                       from_block=int(liq_events.block_number.min()) - 1600,
+                       to_block=int(liq_events.block_number.max()))
+
     blocks_diff = []
     missed_index = []
     Profit = []
     Blocks = []
     Tx = []
 
+    user_configs = cache_events.batch_getUserConfiguration(list(liq_events.user.unique()), reserve_list)
     for n, g in liq_events.iterrows():
         print(n)
-        collateral, borrowed = cache_events.wrapper_getUserConfiguration(g.user, reserve_list)
+        if g.user not in user_configs:
+            continue
+        collateral, borrowed = user_configs[g.user]
         C = []
         B = []
         for c in collateral:
@@ -236,14 +229,12 @@ def query_historic_event_meta(from_block):
         chainlink_link_col_block = None
 
         if debt_to_eth[1] is not None:
-            chainlink_link_debt_block, debt_to_eth_price = query_chainlink_event(aggregator_addr=debt_to_eth[1],
-                                                                                 from_block=liq_block-1600,
-                                                                                 to_block=liq_block)
+            chainlink_link_debt_block, debt_to_eth_price = price_store.price_as_of(debt_to_eth[1], liq_block,
+                                                                                   max_age=1600)
 
         if col_to_eth[1] is not None:
-            chainlink_link_col_block, col_to_eth_price = query_chainlink_event(aggregator_addr=col_to_eth[1],
-                                                                               from_block=liq_block-1600,
-                                                                               to_block=liq_block)
+            chainlink_link_col_block, col_to_eth_price = price_store.price_as_of(col_to_eth[1], liq_block,
+                                                                                 max_age=1600)
 
         chainlink_link_latest_block = None
         if chainlink_link_debt_block is not None and chainlink_link_col_block is not None:
@@ -267,8 +258,8 @@ def query_historic_event_meta(from_block):
 
             blocks_diff.append(liq_block - chainlink_link_latest_block)
 
-            debt_decimals = chainlink.get_decimals(g.debtAsset)
-            col_decimals = chainlink.get_decimals(g.collateralAsset)
+            debt_decimals = feed_registry.get_decimals(g.debtAsset)
+            col_decimals = feed_registry.get_decimals(g.collateralAsset)
             debt_to_pay = int(g.debtToCover) / 10**debt_decimals
             col_collected = int(g.liquidatedCollateralAmount) / 10**col_decimals
 
@@ -285,14 +276,7 @@ def query_historic_event_meta(from_block):
 
     df = pd.DataFrame({'profit': Profit, 'blocks_from_oracle_update': Blocks, 'tx': Tx})
 
-    web3 = Web3(Web3.HTTPProvider(config.Infura_EndPoint))
-    Gas_payed = []
-    for n, g in df.iterrows():
-        tx = g.tx
-        tx_receipt = web3.eth.wait_for_transaction_receipt(tx)
-        gas_payed = tx_receipt['gasUsed'] * tx_receipt['effectiveGasPrice'] / 10 ** 18
-        Gas_payed.append(gas_payed)
-    df['gas_payed'] = Gas_payed
+    df['gas_payed'] = query_gas_payed(df.tx)
     df['reward'] = df.profit - df.gas_payed
     fname = "/home/yonic/junk/liq_events_profit_{}.csv".format(from_block)
     df.to_csv(fname)
@@ -301,15 +285,7 @@ def query_historic_event_meta(from_block):
 def test3():
     fname = "{}/liq_events_latency_multi_leg.csv".format(CACHE_FOLDER)
     df = pd.read_csv(fname, index_col=False)
-    tx = '0xb8962849cb82425248d1e3af10718439d15b71504031856af16d3dabef70c932'
-    web3 = Web3(Web3.HTTPProvider(config.Infura_EndPoint))
-    Gas_payed = []
-    for n, g in df.iterrows():
-        tx = g.tx
-        tx_receipt = web3.eth.wait_for_transaction_receipt(tx)
-        gas_payed = tx_receipt['gasUsed'] * tx_receipt['effectiveGasPrice'] / 10 ** 18
-        Gas_payed.append(gas_payed)
-    df['gas_payed'] = Gas_payed
+    df['gas_payed'] = query_gas_payed(df.tx)
     fname = "{}/liq_events_latency_multi_leg_with_gas.csv".format(CACHE_FOLDER)
     df.to_csv(fname)
     pass
@@ -11,4 +11,61 @@ Lending_Pool_V2_ABI = json.load(open('../abi/LendingPool_V2.json'))
 #this is my test free account in Infura, 100,000 Requests/Day
 Infura_EndPoint = 'https://mainnet.infura.io/v3/fd3ac79f46ba4500be8e92da9632b476'
 
-CACHE_FOLDER = '/mnt/ntfs/liquidator/cache'
\ No newline at end of file
+CACHE_FOLDER = '/mnt/ntfs/liquidator/cache'
+
+#number of calls packed into a single Multicall aggregate call
+MULTICALL_BATCH_SIZE = 500
+
+#max number of calls in a single JSON-RPC batch array, timeout in seconds
+RPC_MAX_BATCH_SIZE = 100
+RPC_TIMEOUT = 60
+
+#keep-alive connection pool of the shared Web3 client
+RPC_POOL_CONNECTIONS = 4
+RPC_POOL_SIZE = 16
+
+#asyncio health factor scanner: users per Multicall batch, max in-flight requests,
+#passes over the batches failed by network errors or rate limiting
+ASYNC_SCAN_BATCH_SIZE = 200
+ASYNC_SCAN_CONCURRENCY = 8
+ASYNC_SCAN_BATCH_RETRIES = 1
+#retries of rate limited requests, backoff delay is RPC_BACKOFF_BASE * 2^attempt seconds
+RPC_MAX_RETRIES = 6
+RPC_BACKOFF_BASE = 0.5
+
+#eth_getLogs adaptive block range: initial window (blocks), max window, target number of logs per call
+GET_LOGS_INITIAL_WINDOW = 100000
+GET_LOGS_MAX_WINDOW = 1000000
+GET_LOGS_TARGET_RESULTS = 5000
+
+#LendingPool events collected by cache_events.update_cache in a single getLogs pass,
+#any event from aave_events.EVENT_HANDLERS can be added
+CACHED_EVENTS = ['Borrow', 'Repay', 'Swap', 'Deposit', 'Withdraw', 'LiquidationCall',
+                 'ReserveUsedAsCollateralEnabled', 'ReserveUsedAsCollateralDisabled']
+
+#incremental health factor refresh: events that change user position,
+#accounts not verified for FULL_SWEEP_INTERVAL_BLOCKS are re-queried anyway (~7 days of 6646 blocks)
+INCREMENTAL_REFRESH_EVENTS = ['Borrow', 'Repay', 'Swap', 'Deposit', 'Withdraw', 'LiquidationCall',
+                              'ReserveUsedAsCollateralEnabled', 'ReserveUsedAsCollateralDisabled']
+FULL_SWEEP_INTERVAL_BLOCKS = 7 * 6646
+
+#transaction receipts: block level eth_getBlockReceipts is used for blocks with at least this number of
+#requested transactions, others are fetched by eth_getTransactionReceipt in JSON-RPC batches
+RECEIPTS_BLOCK_FETCH_MIN_TXS = 2
+
+#parallel historical backfill (backfill.py): blocks per shard, worker processes,
+#max concurrent eth_getLogs calls over all workers
+BACKFILL_SHARD_BLOCKS = 200000
+BACKFILL_PROCESSES = 8
+BACKFILL_RPC_CONCURRENCY = 4
+
+#blocks near the head kept in the unconfirmed tier of the event store, rolled back and fetched again on reorgs
+REORG_CONFIRMATION_BLOCKS = 64
+
+#confirmed blocks dropped from the event store and fetched again when the confirmed tip was replaced by a reorg
+#deeper than REORG_CONFIRMATION_BLOCKS
+DEEP_REORG_REFETCH_BLOCKS = 1000
+
+#memory-mapped snapshots (mmap_snapshot.py) are exported again only when this number of events or accounts
+#changed after the snapshot, the changes are read from the event store / state store until then
+SNAPSHOT_EXPORT_MIN_ROWS = 100000
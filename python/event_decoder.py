@@ -0,0 +1,136 @@
+import numpy as np
+from web3 import Web3
+from eth_utils import event_abi_to_log_topic
+from eth_utils import to_checksum_address
+
+'''Event decoder compiled once per event ABI.
+   A whole getLogs response is decoded at once: indexed topics and the fixed width
+   32 bytes data words are sliced from a (logs x words x 32) byte array into columns.
+   Events with dynamic (string, bytes, array) data arguments fall back to abi codec per log.
+   See https://docs.soliditylang.org/en/latest/abi-spec.html#events
+'''
+
+_checksum_cache = {}
+_decoders = {}
+
+
+def checksum_address(hex_addr):
+    addr = _checksum_cache.get(hex_addr)
+    if addr is None:
+        addr = to_checksum_address(hex_addr)
+        _checksum_cache[hex_addr] = addr
+    return addr
+
+
+def to_hex(value):
+    if isinstance(value, str):
+        return value
+    return Web3.toHex(value)
+
+
+def object_column(values):
+    column = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        column[i] = value
+    return column
+
+
+def is_static_type(abi_type):
+    return abi_type not in ('string', 'bytes') and not abi_type.endswith(']') and not abi_type.startswith('(')
+
+
+def to_uint_object(words):
+    '''(n x 32) bytes to Python ints, 4 uint64 limbs are combined in object arrays'''
+    limbs = np.ascontiguousarray(words).view('>u8').reshape(-1, 4)
+    if not limbs[:, :3].any():
+        return limbs[:, 3].astype(object)
+    values = limbs[:, 0].astype(object)
+    for k in range(1, 4):
+        values = (values << 64) | limbs[:, k].astype(object)
+    return values
+
+
+def decode_words(words, abi_type):
+    n = words.shape[0]
+    if abi_type == 'address':
+        hex_block = np.ascontiguousarray(words[:, 12:]).tobytes().hex()
+        return object_column([checksum_address('0x' + hex_block[40 * i:40 * (i + 1)]) for i in range(n)])
+    if abi_type == 'bool':
+        return words[:, 31] != 0
+    if abi_type.startswith('uint'):
+        bits = int(abi_type[4:] or 256)
+        if bits <= 64:
+            values = np.ascontiguousarray(words[:, 24:]).view('>u8').reshape(-1)
+            return values.astype(np.int64) if bits < 64 else values.astype(np.uint64)
+        return to_uint_object(words)
+    if abi_type.startswith('int'):
+        bits = int(abi_type[3:] or 256)
+        if bits <= 64:
+            return np.ascontiguousarray(words[:, 24:]).view('>i8').reshape(-1).astype(np.int64)
+        values = to_uint_object(words)
+        negative = words[:, 0] >= 0x80
+        values[negative] = values[negative] - (1 << 256)
+        return values
+    '''bytes32 and hashes of the indexed dynamic types'''
+    return object_column([bytes(w) for w in words])
+
+
+class CompiledEventDecoder:
+    def __init__(self, event_abi, abi_codec=None):
+        self.name = event_abi['name']
+        self.topic0 = Web3.toHex(event_abi_to_log_topic(event_abi))
+        self.abi_codec = abi_codec
+        self.indexed = []
+        self.data = []
+        topic_position = 1
+        for arg in event_abi['inputs']:
+            if arg['indexed']:
+                abi_type = arg['type'] if is_static_type(arg['type']) else 'bytes32'
+                self.indexed.append((arg['name'], abi_type, topic_position))
+                topic_position += 1
+            else:
+                self.data.append((arg['name'], arg['type']))
+        self.data_types = [abi_type for _, abi_type in self.data]
+        self.is_static = all(is_static_type(abi_type) for abi_type in self.data_types)
+        self.n_words = len(self.data)
+
+    '''Decode list of raw log entries of this event
+       Returns dict of columns, event arguments by ABI name plus
+       block_number, transaction_hash, log_index and block_hash
+    '''
+    def decode(self, logs):
+        n = len(logs)
+        S = {}
+        for name, abi_type, position in self.indexed:
+            words = np.frombuffer(b''.join(bytes(entry['topics'][position]) for entry in logs),
+                                  dtype=np.uint8).reshape(n, 32)
+            S[name] = decode_words(words, abi_type)
+
+        if self.is_static:
+            data = bytes.fromhex(''.join(to_hex(entry['data'])[2:] for entry in logs))
+            words = np.frombuffer(data, dtype=np.uint8).reshape(n, self.n_words, 32)
+            for k, (name, abi_type) in enumerate(self.data):
+                S[name] = decode_words(words[:, k, :], abi_type)
+        else:
+            rows = [self.abi_codec.decode_abi(self.data_types, Web3.toBytes(hexstr=to_hex(entry['data'])))
+                    for entry in logs]
+            for k, (name, _) in enumerate(self.data):
+                S[name] = object_column([row[k] for row in rows])
+
+        S['block_number'] = np.array([entry['blockNumber'] for entry in logs], dtype=np.int64)
+        S['transaction_hash'] = object_column([to_hex(entry['transactionHash']) for entry in logs])
+        S['log_index'] = np.array([entry['logIndex'] for entry in logs], dtype=np.int64)
+        S['block_hash'] = object_column([to_hex(entry['blockHash']) for entry in logs])
+        return S
+
+
+'''Decoder of the event abi memoized by topic0, indexed flags of the inputs (events with the same signature
+   can differ in indexed arguments, i.e. ERC20 and ERC721 Transfer) and the codec, the cached decoder keeps
+   the codec alive so its id is not reused
+'''
+def get_decoder(event_abi, abi_codec=None):
+    key = (Web3.toHex(event_abi_to_log_topic(event_abi)), tuple(bool(i['indexed']) for i in event_abi['inputs']),
+           id(abi_codec))
+    if key not in _decoders:
+        _decoders[key] = CompiledEventDecoder(event_abi, abi_codec)
+    return _decoders[key]
@@ -1,9 +1,8 @@
 import pandas as pd
 import numpy as np
 import cache_events
-import datetime
+import feed_registry
 import time
-import datetime
 import chainlink
 import chainlink_events
 import config
@@ -34,8 +33,8 @@ def main():
         return
         users = list(events.user)
         for n,e in events.iterrows():
-            debt_decimals = chainlink.get_decimals(e.debtAsset)
-            col_decimals = chainlink.get_decimals(e.collateralAsset)
+            debt_decimals = feed_registry.get_decimals(e.debtAsset)
+            col_decimals = feed_registry.get_decimals(e.collateralAsset)
             debt_to_pay = int(e.debtToCover) / 10 ** debt_decimals
             col_collected = int(e.liquidatedCollateralAmount) / 10 ** col_decimals
 
@@ -1,9 +1,7 @@
 import json
 import datetime
 import pandas as pd
-from web3 import Web3
 from web3._utils.abi import get_constructor_abi, merge_args_and_kwargs
-from web3._utils.events import get_event_data
 from web3._utils.filters import construct_event_filter_params
 from web3._utils.contracts import encode_abi
 
@@ -14,6 +12,10 @@ from reserve_asset import CRYPTO_ASSET_ADDRESS_TO_NAME
 from reserve_asset import convert_addr_in_crypto_asset
 from crypto_utils import convert_wei_to_eth
 from crypto_utils import convert_decimal_to_float
+import receipts
+import web3_client
+import block_range
+import event_decoder
 
 from config import *
 
@@ -110,13 +112,12 @@ def handle_liqudation_call_event_V2(event_data, err_handler):
 '''Based on: https://github.com/aave/protocol-v2/blob/ice/mainnet-deployment-03-12-2020/contracts/interfaces/ILendingPool.sol
 '''
 def fetch_events(type):
-    web3 = Web3(Web3.HTTPProvider(Infura_EndPoint))
     from_block = START_BLOCK_FOR_EVENT_FETCHING
     to_block = 'latest'
     address = None
     topics = None
 
-    contract = web3.eth.contract(address=Lending_Pool_V2_Address, abi=Lending_Pool_V2_ABI)
+    contract = web3_client.get_lending_pool()
     if type == 'Borrow':
         event = contract.events.Borrow
     elif type == 'LiquidationCall':
@@ -134,19 +135,21 @@ def fetch_events(type):
     argument_filters = dict()
     _filters = dict(**argument_filters)
 
-    data_filter_set, event_filter_params = construct_event_filter_params(
-        abi,
-        abi_codec,
-        contract_address=event.address,
-        argument_filters=_filters,
-        fromBlock=from_block,
-        toBlock=to_block,
-        address=address,
-        topics=topics,
-    )
-
-    # Call node over JSON-RPC API
-    logs = event.web3.eth.getLogs(event_filter_params)
+    def make_filter_params(event, b1, b2):
+        data_filter_set, event_filter_params = construct_event_filter_params(
+            abi,
+            abi_codec,
+            contract_address=event.address,
+            argument_filters=_filters,
+            fromBlock=b1,
+            toBlock=b2,
+            address=address,
+            topics=topics,
+        )
+        return event_filter_params
+
+    # Call node over JSON-RPC API, the range is split in adaptive windows
+    logs = block_range.get_event_logs(event, make_filter_params, from_block=from_block, to_block=to_block)
 
     # Convert raw binary event data to easily manipulable Python objects
     err_handler = {}
@@ -160,12 +163,13 @@ def fetch_events(type):
     ColAmountCollected = []
     User = []
     Block = []
-    for entry in logs:
-        data = dict(get_event_data(abi_codec, abi, entry))
+    columns = event_decoder.get_decoder(abi, abi_codec).decode(logs)
+    for i in range(len(logs)):
+        args = {name: column[i] for name, column in columns.items()}
+        data = {'args': args, 'event': type}
 
-        block_number = data['blockNumber']
-        address = data['address'] #Lending Pool Contract address
-        transaction_hash = data['transactionHash'].hex()
+        block_number = int(columns['block_number'][i])
+        transaction_hash = columns['transaction_hash'][i]
 
         '''Avoid having handle transaction multiple times'''
         if transaction_hash not in transactions:
@@ -189,8 +193,6 @@ def fetch_events(type):
                 DebtAmountCovered.append(amount)
 
                 Transaction.append(transaction_hash)
-                tx_receipt = web3.eth.wait_for_transaction_receipt(transaction_hash)
-                print(tx_receipt)
 
                 '''Without Gas fee!'''
                 Balance.append(received - paid)
@@ -211,6 +213,9 @@ def fetch_events(type):
                            'debt_asset': DebtAsset,
                            'debt_covered': DebtAmountCovered,
                            'block':Block})
+        # Receipts of the liquidation transactions are fetched in bulk and cached
+        receipts.add_gas_cost(df, tx_column='transaction', block_column='block')
+        print(df[['transaction', 'gas_payed']])
 
     if type == 'FlashLoan':
         df = pd.DataFrame({'transaction': Transaction, 'block':Block})
@@ -223,8 +228,7 @@ def fetch_events(type):
 
 
 def call_getUserAccountData_V2(account='0x8d30e4b4C8D461d99Ee3FD67B3f7f0Ddaf9d3dD6'):
-    web3 = Web3(Web3.HTTPProvider(Infura_EndPoint))
-    contract = web3.eth.contract(address=Lending_Pool_V2_Address, abi=Lending_Pool_V2_ABI)
+    contract = web3_client.get_lending_pool()
 
     '''Get assets index'''
     reserve_to_index = []
@@ -0,0 +1,216 @@
+import os
+import json
+import pandas as pd
+import cache_manifest
+from config import CACHE_FOLDER
+
+'''Append-only event store, partitioned by event type and block range:
+   <EVENT_STORE_FOLDER>/<event name>/<from block>_<to block>.h5
+   Every partition is an HDF5 table (columnar, block_number is indexed) written once.
+   The manifest keeps the partitions of every event and the highest ingested block,
+   reading prunes partitions by block range and pushes down the block predicate and
+   the column projection to HDF5.
+   uint256 values (Python ints) are stored as strings and converted back on read.
+   Partitions and the manifest are written atomically (cache_manifest), the manifest is written after
+   the partitions and keeps their sha256, an interrupted ingestion resumes from the last block of the manifest.
+   Partitions hold confirmed history only. The last blocks near the head are kept in a small unconfirmed
+   tier (events and block_number, block_hash, parent_hash of every block), it is rewritten on every refresh
+   and rolled back on reorgs, blocks leaving it are promoted to partitions.
+'''
+EVENT_STORE_FOLDER = '{}/events'.format(CACHE_FOLDER)
+MANIFEST_FNAME = '{}/manifest.json'.format(EVENT_STORE_FOLDER)
+UNCONFIRMED_FNAME = '{}/unconfirmed.bin'.format(EVENT_STORE_FOLDER)
+HDF_KEY = 'events'
+BLOCK_COLUMNS = ['block_number', 'block_hash', 'parent_hash']
+
+
+def load_manifest():
+    if os.path.exists(MANIFEST_FNAME):
+        return json.load(open(MANIFEST_FNAME))
+    return {'last_block': None, 'last_block_hash': None, 'events': {}}
+
+
+def save_manifest(manifest):
+    cache_manifest.dump_json(manifest, MANIFEST_FNAME)
+
+
+'''Highest ingested block of the event or of the whole store, None when nothing is ingested'''
+def get_last_block(event_name=None):
+    manifest = load_manifest()
+    if event_name is None:
+        return manifest['last_block']
+    if event_name not in manifest['events']:
+        return None
+    return manifest['events'][event_name].get('last_block')
+
+
+def get_int_columns(df):
+    int_columns = []
+    for column in df.columns:
+        if df[column].dtype == object and len(df) > 0 and isinstance(df[column].iloc[0], int):
+            int_columns.append(column)
+    return int_columns
+
+'''Write events of [from_block, to_block] as new partitions and move last ingested block to to_block
+   @event_frames - dict event name -> DataFrame (None or empty if there are no events in the range)
+   @block_hash - hash of to_block, the parent of the first unconfirmed block
+'''
+def append_events(event_frames, from_block, to_block, block_hash=None):
+    manifest = load_manifest()
+    for event_name, df in event_frames.items():
+        meta = manifest['events'].setdefault(event_name, {'partitions': [], 'int_columns': []})
+        meta['last_block'] = to_block
+        if df is None or len(df) == 0:
+            continue
+        meta['partitions'].append(write_partition(meta, event_name, df, from_block, to_block))
+
+    manifest['last_block'] = to_block
+    manifest['last_block_hash'] = block_hash
+    save_manifest(manifest)
+
+'''Write the partition file of the events of [from_block, to_block], Returns its manifest entry
+   [from_block, to_block, file name, number of events, sha256]
+'''
+def write_partition(meta, event_name, df, from_block, to_block):
+    folder = '{}/{}'.format(EVENT_STORE_FOLDER, event_name)
+    os.makedirs(folder, exist_ok=True)
+    int_columns = get_int_columns(df)
+    df = df.reset_index(drop=True)
+    for column in int_columns:
+        df[column] = df[column].astype(str)
+    meta['int_columns'] = sorted(set(meta['int_columns']).union(int_columns))
+
+    fname = '{}/{}_{}.h5'.format(folder, from_block, to_block)
+    cache_manifest.to_hdf(df, fname, key=HDF_KEY, format='table', data_columns=['block_number'])
+    return [from_block, to_block, os.path.basename(fname), len(df), cache_manifest.checksum(fname)]
+
+'''Replace the partition of [from_block, to_block] with the events fetched again, i.e. after verify_partitions,
+   the partition is dropped if there are no events
+'''
+def rewrite_partition(event_name, df, from_block, to_block):
+    manifest = load_manifest()
+    meta = manifest['events'][event_name]
+    partitions = [p for p in meta['partitions'] if (p[0], p[1]) != (from_block, to_block)]
+    if df is not None and len(df) > 0:
+        partitions.append(write_partition(meta, event_name, df, from_block, to_block))
+    else:
+        fname = '{}/{}/{}_{}.h5'.format(EVENT_STORE_FOLDER, event_name, from_block, to_block)
+        if os.path.exists(fname):
+            os.remove(fname)
+    meta['partitions'] = sorted(partitions, key=lambda p: p[0])
+    save_manifest(manifest)
+
+'''Drop the confirmed events from from_block on, i.e. after a reorg deeper than the unconfirmed tier,
+   partitions crossing from_block are cut at from_block - 1 and ingestion resumes at from_block
+'''
+def truncate_events(from_block):
+    manifest = load_manifest()
+    removed = []
+    for event_name, meta in manifest['events'].items():
+        partitions = []
+        for partition in meta['partitions']:
+            b1, b2, fname = partition[:3]
+            if b2 < from_block:
+                partitions.append(partition)
+                continue
+            fname = '{}/{}/{}'.format(EVENT_STORE_FOLDER, event_name, fname)
+            if b1 < from_block:
+                df = pd.read_hdf(fname, key=HDF_KEY, where='block_number < {}'.format(from_block))
+                if len(df) > 0:
+                    partitions.append(write_partition(meta, event_name, df, b1, from_block - 1))
+            removed.append(fname)
+        meta['partitions'] = partitions
+        if meta.get('last_block') is not None:
+            meta['last_block'] = min(meta['last_block'], from_block - 1)
+
+    if manifest['last_block'] is not None:
+        manifest['last_block'] = min(manifest['last_block'], from_block - 1)
+    manifest['last_block_hash'] = None
+    save_manifest(manifest)
+    '''files are removed after the manifest stops referencing them'''
+    for fname in removed:
+        if os.path.exists(fname):
+            os.remove(fname)
+
+'''Read events of event_name
+   @columns - list of columns to read, all if None
+   @from_block, @to_block - block range (inclusive), partitions outside are not opened
+   @unconfirmed - include events of the unconfirmed tier
+'''
+def read_events(event_name, columns=None, from_block=None, to_block=None, unconfirmed=True):
+    manifest = load_manifest()
+    tier_events = None
+    if unconfirmed:
+        tier_events = load_unconfirmed()['events'].get(event_name)
+        if tier_events is not None:
+            I = tier_events.block_number >= (from_block if from_block is not None else 0)
+            if to_block is not None:
+                I &= tier_events.block_number <= to_block
+            tier_events = tier_events[I]
+            tier_events = tier_events[columns] if columns is not None else tier_events
+    if event_name not in manifest['events']:
+        return tier_events.reset_index(drop=True) if tier_events is not None else pd.DataFrame(columns=columns)
+
+    meta = manifest['events'][event_name]
+    where = []
+    if from_block is not None:
+        where.append('block_number >= {}'.format(from_block))
+    if to_block is not None:
+        where.append('block_number <= {}'.format(to_block))
+
+    frames = []
+    for b1, b2, fname, *_ in meta['partitions']:
+        if from_block is not None and b2 < from_block:
+            continue
+        if to_block is not None and b1 > to_block:
+            continue
+        fname = '{}/{}/{}'.format(EVENT_STORE_FOLDER, event_name, fname)
+        frames.append(pd.read_hdf(fname, key=HDF_KEY, columns=columns,
+                                  where=' & '.join(where) if len(where) > 0 else None))
+
+    if len(frames) == 0 and tier_events is None:
+        return pd.DataFrame(columns=columns)
+
+    df = pd.concat(frames, ignore_index=True) if len(frames) > 0 else pd.DataFrame(columns=tier_events.columns)
+    for column in meta['int_columns']:
+        if column in df.columns:
+            df[column] = df[column].map(int)
+    if tier_events is not None and len(tier_events) > 0:
+        df = pd.concat([df, tier_events], ignore_index=True)
+    return df
+
+'''Unconfirmed tier: blocks - frame of BLOCK_COLUMNS, events - dict event name -> frame'''
+def load_unconfirmed():
+    if os.path.exists(UNCONFIRMED_FNAME):
+        return pd.read_pickle(UNCONFIRMED_FNAME)
+    return {'blocks': pd.DataFrame(columns=BLOCK_COLUMNS), 'events': {}}
+
+
+def save_unconfirmed(tier):
+    cache_manifest.dump_pickle(tier, UNCONFIRMED_FNAME)
+
+'''Last block of the unconfirmed tier, the last confirmed block if the tier is empty'''
+def get_head_block():
+    blocks = load_unconfirmed()['blocks']
+    if len(blocks) > 0:
+        return int(blocks.block_number.max())
+    return get_last_block()
+
+
+def list_events():
+    return sorted(load_manifest()['events'].keys())
+
+'''Partitions (event name, from block, to block, file name) missing or failing the checksum'''
+def verify_partitions():
+    bad = []
+    for event_name, meta in load_manifest()['events'].items():
+        for partition in meta['partitions']:
+            fname = '{}/{}/{}'.format(EVENT_STORE_FOLDER, event_name, partition[2])
+            if len(partition) > 4 and not cache_manifest.verify(fname, partition[4]):
+                bad.append((event_name, partition[0], partition[1], partition[2]))
+    return bad
+
+'''One time migration of the cached_events_<date>_<block>.bin pickle'''
+def import_pickle_cache(fname, last_block):
+    event_cache = pd.read_pickle(fname)
+    append_events(event_cache, 0, last_block)
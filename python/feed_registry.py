@@ -0,0 +1,176 @@
+import os
+import json
+import multicall
+import cache_manifest
+import web3_client
+import block_range
+import cache_events
+import chainlink
+from config import CACHE_FOLDER
+
+'''Persistent Chainlink feed resolution registry.
+   (base, quote) -> (aggregator, direct, decimals), direct is False when only the inverse pair
+   (quote, base) has a feed, None when there is no feed in either direction.
+   Pairs are resolved in bulk via Multicall on the Feed Registry (failed getFeed calls replace the
+   try/except probing), memoized in-process and stored on disk. The registry is refreshed only by
+   Feed Registry FeedConfirmed events after the block it was built at.
+   ENS feed names (eth-usd.data.eth) and token decimals are memoized the same way.
+'''
+FEED_REGISTRY_FNAME = '{}/chainlink_feed_registry.json'.format(CACHE_FOLDER)
+
+'''Chainlink denominations of wrapped reserves'''
+DENOMINATIONS = {
+    '0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2': chainlink.ETH_addr,  # WETH
+    '0x2260FAC5E5542a773Aa44fBCfeDf7C193bc2C599': '0xbBbBBBBbbBBBbbbBbbBbbbbBBbBbbbbBbBbbBBbB',  # WBTC
+}
+
+_registry = None
+
+
+def to_denomination(asset):
+    return DENOMINATIONS.get(asset, asset)
+
+
+def pair_key(base, quote):
+    return '{}:{}'.format(base, quote)
+
+
+def get_feed_registry_contract():
+    return web3_client.get_contract(chainlink.CHAIN_LINK_FEED_REG_ADDR, chainlink.CHAIN_LINK_FEED_REG_ABI)
+
+
+class FeedRegistry:
+    def __init__(self, S=None):
+        S = S if S is not None else {}
+        self.last_block = S.get('last_block')
+        self.feeds = S.get('feeds', {})
+        self.ens = S.get('ens', {})
+        self.decimals = S.get('decimals', {})
+
+    @classmethod
+    def load(cls, fname=FEED_REGISTRY_FNAME):
+        if not os.path.exists(fname):
+            return cls()
+        return cls(json.load(open(fname)))
+
+    def save(self, fname=FEED_REGISTRY_FNAME):
+        S = {'last_block': self.last_block, 'feeds': self.feeds, 'ens': self.ens, 'decimals': self.decimals}
+        cache_manifest.dump_json(S, fname)
+
+    '''Resolve all pairs not in the registry, getFeed in both directions and decimals in two Multicalls.
+       A pair is stored as None (no feed) only if getFeed was executed in both directions and returned the zero
+       address or reverted, pairs of failed aggregate calls are left unresolved and tried again later.
+    '''
+    def resolve_pairs(self, pairs, block_identifier='latest'):
+        pairs = [(base, quote) for base, quote in dict.fromkeys(pairs) if pair_key(base, quote) not in self.feeds]
+        if len(pairs) == 0:
+            return
+        contract = get_feed_registry_contract()
+        block = block_range.resolve_block(block_identifier)
+        args_list = [[base, quote] for base, quote in pairs] + [[quote, base] for base, quote in pairs]
+        feed_results = multicall.try_aggregate(multicall.encode_calls(contract, 'getFeed', args_list),
+                                               block_identifier=block)
+        decimal_results = multicall.try_aggregate(multicall.encode_calls(contract, 'decimals', args_list),
+                                                  block_identifier=block)
+        feeds = multicall.decode_results(contract, 'getFeed', feed_results)
+        decimals = multicall.decode_results(contract, 'decimals', decimal_results)
+        executed = [return_data is not None for _, return_data in feed_results]
+        n = len(pairs)
+        unresolved = 0
+        for i, (base, quote) in enumerate(pairs):
+            for j, direct in ((i, True), (n + i, False)):
+                if feeds[j] is not None and int(feeds[j][0], 16) != 0:
+                    if decimals[j] is None and decimal_results[j][1] is None:
+                        unresolved += 1
+                    else:
+                        self.feeds[pair_key(base, quote)] = [feeds[j][0], direct,
+                                                             decimals[j][0] if decimals[j] else None]
+                    break
+                if not executed[j]:
+                    unresolved += 1
+                    break
+            else:
+                self.feeds[pair_key(base, quote)] = None
+        if unresolved > 0:
+            print('Feed Registry: {} pairs unresolved after failed calls'.format(unresolved))
+        if self.last_block is None:
+            self.last_block = block
+
+    '''Returns (aggregator, direct, decimals) or None'''
+    def get_feed(self, base, quote):
+        key = pair_key(base, quote)
+        if key not in self.feeds:
+            self.resolve_pairs([(base, quote)])
+            self.save()
+        return self.feeds.get(key)
+
+    '''ENS resolution of <from>-<to>.data.eth, Returns (direct, address, decimals), (None, None, None) if missing'''
+    def get_ens_feed(self, from_asset, to_asset):
+        key = '{}-{}'.format(from_asset.lower(), to_asset.lower())
+        if key not in self.ens:
+            direct, address = chainlink.get_feed_address(from_asset=from_asset, to_asset=to_asset)
+            decimals = chainlink.get_decimals(address) if address is not None else None
+            self.ens[key] = [direct, address, decimals]
+            self.save()
+        return tuple(self.ens[key])
+
+    '''decimals() of an aggregator or a token'''
+    def get_decimals(self, address):
+        if address not in self.decimals:
+            self.decimals[address] = chainlink.get_decimals(address)
+            self.save()
+        return self.decimals[address]
+
+    '''Apply FeedConfirmed events after the registry block, only the confirmed pairs are resolved again'''
+    def refresh(self, to_block='latest'):
+        to_block = block_range.resolve_block(to_block)
+        if self.last_block is None or to_block <= self.last_block:
+            return
+        event = get_feed_registry_contract().events.FeedConfirmed
+        logs = block_range.get_event_logs(event, cache_events.make_filter_params,
+                                          from_block=self.last_block + 1, to_block=to_block)
+        changed = []
+        for entry in logs:
+            args = event().processLog(entry)['args']
+            changed += [(args['asset'], args['denomination']), (args['denomination'], args['asset'])]
+        for base, quote in changed:
+            self.feeds.pop(pair_key(base, quote), None)
+        if len(changed) > 0:
+            print('Feed Registry: {} feeds confirmed'.format(len(changed) // 2))
+            self.resolve_pairs(changed, block_identifier=to_block)
+        self.last_block = to_block
+        self.save()
+
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        _registry = FeedRegistry.load()
+    return _registry
+
+'''Resolve the feeds of all reserves to the quote (ETH by default) in bulk and refresh the registry'''
+def build(reserves, quote=chainlink.ETH_addr):
+    registry = get_registry()
+    registry.refresh()
+    registry.resolve_pairs([(to_denomination(asset), quote) for asset in reserves if to_denomination(asset) != quote])
+    registry.save()
+    return registry
+
+'''Aave reserve to Chainlink (direct, aggregator), (None, None) for the quote itself or if there is no feed'''
+def get_reserve_feed(asset, quote=chainlink.ETH_addr):
+    asset = to_denomination(asset)
+    if asset == quote:
+        return None, None
+    feed = get_registry().get_feed(asset, quote)
+    if feed is None:
+        return None, None
+    aggregator, direct, _ = feed
+    return direct, aggregator
+
+
+def get_ens_feed(from_asset, to_asset):
+    return get_registry().get_ens_feed(from_asset, to_asset)
+
+
+def get_decimals(address):
+    return get_registry().get_decimals(address)
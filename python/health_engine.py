@@ -0,0 +1,161 @@
+import numpy as np
+import pandas as pd
+import config
+import multicall
+import web3_client
+import block_range
+
+'''Off-chain health factor engine.
+   Collateral and debt balances of every user in every reserve are kept in users x reserves arrays
+   (asset units), combined with the reserve liquidation thresholds and the oracle prices (ETH)
+   the health factor of all users is computed in one NumPy pass:
+      HF = sum(collateral * price * liq_threshold) / sum(debt * price)
+   see https://docs.aave.com/risk/asset-risk/risk-parameters#health-factor
+   Balances are changed by LendingPool events and by interest accrual only, so after a price tick
+   the balances are reused and only the prices are updated.
+'''
+PROTOCOL_DATA_PROVIDER_ADDRESS = '0x057835Ad21a177dbdd3090bB1CAE03EaCF78Fc6d'
+PROTOCOL_DATA_PROVIDER_ABI = '[{"inputs":[{"internalType":"address","name":"asset","type":"address"},{"internalType":"address","name":"user","type":"address"}],"name":"getUserReserveData","outputs":[{"internalType":"uint256","name":"currentATokenBalance","type":"uint256"},{"internalType":"uint256","name":"currentStableDebt","type":"uint256"},{"internalType":"uint256","name":"currentVariableDebt","type":"uint256"},{"internalType":"uint256","name":"principalStableDebt","type":"uint256"},{"internalType":"uint256","name":"scaledVariableDebt","type":"uint256"},{"internalType":"uint256","name":"stableBorrowRate","type":"uint256"},{"internalType":"uint256","name":"liquidityRate","type":"uint256"},{"internalType":"uint40","name":"stableRateLastUpdated","type":"uint40"},{"internalType":"bool","name":"usageAsCollateralEnabled","type":"bool"}],"stateMutability":"view","type":"function"}]'
+
+AAVE_ORACLE_ADDRESS = '0xA50ba011c48153De246E5192C8f9258A2ba79Ca9'
+AAVE_ORACLE_ABI = '[{"inputs":[{"internalType":"address[]","name":"assets","type":"address[]"}],"name":"getAssetsPrices","outputs":[{"internalType":"uint256[]","name":"","type":"uint256[]"}],"stateMutability":"view","type":"function"}]'
+
+
+def get_protocol_data_provider():
+    return web3_client.get_contract(PROTOCOL_DATA_PROVIDER_ADDRESS, PROTOCOL_DATA_PROVIDER_ABI)
+
+
+def get_aave_oracle():
+    return web3_client.get_contract(AAVE_ORACLE_ADDRESS, AAVE_ORACLE_ABI)
+
+'''Oracle prices of the reserves in ETH, a single call for all reserves'''
+def query_asset_prices(reserves, block_identifier='latest'):
+    ret = get_aave_oracle().functions.getAssetsPrices(list(reserves)).call(block_identifier=block_identifier)
+    return np.array(ret, dtype=np.float64) / 1e18
+
+
+class HealthFactorEngine:
+    '''@reserves - list of reserve addresses (getReservesList order)
+       @liq_threshold - liquidation threshold of the reserves in percent (as in wrapper_getReserveData)
+       @decimals - decimals of the reserves
+    '''
+    def __init__(self, reserves, liq_threshold, decimals):
+        self.reserves = list(reserves)
+        self.reserve_index = {addr: k for k, addr in enumerate(self.reserves)}
+        self.liq_threshold = np.asarray(liq_threshold, dtype=np.float64) / 100.0
+        self.decimals = np.asarray(decimals, dtype=np.int64)
+        self.prices = np.full(len(self.reserves), np.nan)
+        self.users = []
+        self.user_index = {}
+        self.collateral = np.zeros((0, len(self.reserves)))
+        self.debt = np.zeros((0, len(self.reserves)))
+        self.block = None
+
+    '''Engine for the reserves of wrapper_getReserveData frame (with addr column)'''
+    @classmethod
+    def from_reserve_data(cls, reserve_data):
+        return cls(reserve_data.addr.values, reserve_data.liq_threshold.values, reserve_data.decimals.values)
+
+    def __len__(self):
+        return len(self.users)
+
+    def add_users(self, users):
+        new_users = [user for user in dict.fromkeys(users) if user not in self.user_index]
+        if len(new_users) == 0:
+            return
+        for user in new_users:
+            self.user_index[user] = len(self.users)
+            self.users.append(user)
+        padding = np.zeros((len(new_users), len(self.reserves)))
+        self.collateral = np.vstack([self.collateral, padding])
+        self.debt = np.vstack([self.debt, padding])
+
+    def rows(self, users):
+        return np.array([self.user_index[user] for user in users], dtype=np.int64)
+
+    '''Set balances of the users, collateral balance must be zero for reserves not used as collateral
+       @collateral, @debt - (len(users) x reserves) arrays in asset units
+    '''
+    def set_balances(self, users, collateral, debt):
+        self.add_users(users)
+        rows = self.rows(users)
+        self.collateral[rows] = collateral
+        self.debt[rows] = debt
+
+    '''Query balances of the users in all reserves from ProtocolDataProvider via Multicall,
+       all calls are done at the same block. Users with a failed call keep their previous balances.
+    '''
+    def load_balances(self, users, batch_size=config.MULTICALL_BATCH_SIZE, block_identifier='latest'):
+        users = list(dict.fromkeys(users))
+        block = block_range.resolve_block(block_identifier)
+        args_list = [[asset, user] for user in users for asset in self.reserves]
+        ret = multicall.call_function_batch(get_protocol_data_provider(), 'getUserReserveData', args_list,
+                                            batch_size=batch_size, block_identifier=block)
+        n_reserves = len(self.reserves)
+        collateral = np.zeros((len(users), n_reserves))
+        debt = np.zeros((len(users), n_reserves))
+        failed = np.zeros(len(users), dtype=bool)
+        scale = 10.0 ** self.decimals
+        for i, r in enumerate(ret):
+            u, k = divmod(i, n_reserves)
+            if r is None:
+                failed[u] = True
+                continue
+            if r[8]:
+                collateral[u, k] = r[0] / scale[k]
+            debt[u, k] = (r[1] + r[2]) / scale[k]
+
+        if failed.any():
+            print('getUserReserveData failed for {} users'.format(failed.sum()))
+        users = [user for user, f in zip(users, failed) if not f]
+        self.set_balances(users, collateral[~failed], debt[~failed])
+        self.block = block
+        return users
+
+    def set_prices(self, prices):
+        self.prices = np.asarray(prices, dtype=np.float64)
+
+    def load_prices(self, block_identifier='latest'):
+        self.set_prices(query_asset_prices(self.reserves, block_identifier=block_identifier))
+
+    '''Price tick of a single reserve, price in ETH'''
+    def update_price(self, asset, price):
+        self.prices[self.reserve_index[asset]] = price
+
+    '''Collateral (ETH), debt (ETH), weighted liquidation threshold and health factor of the users,
+       @rows - row subset (see rows()), all users if None
+    '''
+    def compute(self, rows=None):
+        collateral = self.collateral if rows is None else self.collateral[rows]
+        debt = self.debt if rows is None else self.debt[rows]
+        col_eth = collateral @ self.prices
+        threshold_eth = collateral @ (self.prices * self.liq_threshold)
+        debt_eth = debt @ self.prices
+        with np.errstate(divide='ignore', invalid='ignore'):
+            health_factor = np.where(debt_eth > 0, threshold_eth / debt_eth, np.inf)
+            liquidation_threshold = np.where(col_eth > 0, threshold_eth / col_eth, 0.0)
+        return col_eth, debt_eth, liquidation_threshold, health_factor
+
+    '''Same columns as getUserAccountData frame (col, debt, liquidation_threshold in percent, healthFactor, user)'''
+    def to_frame(self, users=None):
+        rows = None if users is None else self.rows(users)
+        col_eth, debt_eth, liquidation_threshold, health_factor = self.compute(rows)
+        return pd.DataFrame({'col': col_eth, 'debt': debt_eth,
+                             'liquidation_threshold': liquidation_threshold * 100.0,
+                             'healthFactor': health_factor,
+                             'user': self.users if users is None else list(users)})
+
+    '''Users with health factor below the threshold'''
+    def get_unhealthy_users(self, threshold=1.0):
+        _, _, _, health_factor = self.compute()
+        return [self.users[i] for i in np.flatnonzero(health_factor < threshold)]
+
+'''Engine of all reserves with balances and prices of the users loaded at the same block'''
+def build_engine(users, block_identifier='latest'):
+    import cache_events
+    reserves = cache_events.wrapper_getReservesList()
+    engine = HealthFactorEngine.from_reserve_data(cache_events.wrapper_getReserveData(reserves))
+    block = block_range.resolve_block(block_identifier)
+    engine.load_balances(users, block_identifier=block)
+    engine.load_prices(block_identifier=block)
+    return engine
@@ -1,9 +1,12 @@
 import pandas as pd
 import numpy as np
 import cache_events
+import cache_manifest
+import health_engine
+import liquidation_planner
+import reserve_cache
 import datetime
 import time
-import datetime
 import chainlink
 from config import CACHE_FOLDER
 from  reserve_asset import convert_crypto_asset_to_addr
@@ -11,11 +14,14 @@ import matplotlib.pyplot as plt
 
 
 def main():
-    reserves = cache_events.wrapper_getReservesList()
-    reserve_config = cache_events.wrapper_getConfiguration(reserves)
+    reserves, reserve_config = reserve_cache.get_reserves()
     reserve_config = reserve_config.set_index(reserve_config.addr).drop('addr', axis=1)
     pass
-    borrowed_accounts, from_cached_block, date, time = cache_events.load_latest_health_factor_from_cache()
+    not_healthy_accounts, from_cached_block, date, time = cache_events.load_latest_health_factor_from_cache(alive=True,
+                                                                                                         hf_max=1.0)
+    if from_cached_block is None:
+        print('Run bot_v1.check_and_cache_user_health_factor() first, the liquidation events are collected from its block')
+        return
     liquidated_events = cache_events.query_liquidation_call_event(from_block=from_cached_block,
                                                                   to_block='latest')
     liquidated_events = liquidated_events.set_index(liquidated_events.user)
@@ -23,12 +29,8 @@ def main():
     #liquidated_account = df.set_index(df.user).loc[liquidated_events.user]
     #liquidated_account_status = cache_events.wrapper_getUserAccountData(liquidated_account.user.values)
     ###
-    '''Remove liquidated accounts'''
-    I = (borrowed_accounts.col > 0) & (borrowed_accounts.debt > 0)
-    alive_borrowed_accounts = borrowed_accounts[I]
-    alive_borrowed_accounts = alive_borrowed_accounts.set_index(alive_borrowed_accounts.user).drop('user', axis=1)
-    '''List not healthy accounts'''
-    not_healthy_accounts = alive_borrowed_accounts[alive_borrowed_accounts.healthFactor < 1.0]
+    '''Not healthy accounts, liquidated accounts are removed'''
+    not_healthy_accounts = not_healthy_accounts.set_index(not_healthy_accounts.user).drop('user', axis=1)
     t1 = datetime.datetime.now()
     updated_not_healthy_accounts = cache_events.wrapper_getUserAccountData(list(not_healthy_accounts.index.values))
     t2 = datetime.datetime.now()
@@ -36,24 +38,18 @@ def main():
 
     updated_not_healthy_accounts = updated_not_healthy_accounts.set_index(updated_not_healthy_accounts.user).drop('user', axis=1)
 
-    '''Calculate liquidation reward'''
-    Liquidated_reward = []
-    for user, v in updated_not_healthy_accounts.iterrows():
-        collateral, borrowed = cache_events.wrapper_getUserConfiguration(user, reserves)
-        bonus = []
-        for c_name in collateral:
-            b = reserve_config[reserve_config.name == c_name].liq_bonus.values[0]
-            bonus.append(b)
-        print(user, bonus)
-        bonus = np.mean(bonus) / 100.0  # assuming qually weighted!
-        max_liquidatable_debt = v.debt / 2
-        liquidated_reward = max_liquidatable_debt * bonus
-        Liquidated_reward.append(liquidated_reward)
-
-    updated_not_healthy_accounts['liquidated_reward'] = Liquidated_reward
+    '''Calculate liquidation reward: the best (collateral, debt) pair and debt to cover of every user'''
+    engine = health_engine.build_engine(list(updated_not_healthy_accounts.index.values))
+    plans = liquidation_planner.plan_from_reserve_table(engine, reserve_config.reset_index())
+    plans = plans.set_index('user')[['collateral_name', 'debt_name', 'debt_to_cover_eth', 'profit_eth']]
+    updated_not_healthy_accounts = updated_not_healthy_accounts.join(plans, how='inner')
+    updated_not_healthy_accounts['liquidated_reward'] = (updated_not_healthy_accounts.debt_to_cover_eth +
+                                                         updated_not_healthy_accounts.profit_eth)
 
     now = datetime.datetime.now()
-    updated_not_healthy_accounts.to_hdf('{}/updated_not_healthy_accounts_{}.h5'.format(CACHE_FOLDER, now.strftime("%Y%m%d_%H%M%S")),key='account_health_data')
+    fname = '{}/updated_not_healthy_accounts_{}.h5'.format(CACHE_FOLDER, now.strftime("%Y%m%d_%H%M%S"))
+    cache_manifest.to_hdf(updated_not_healthy_accounts, fname, key='account_health_data')
+    cache_manifest.record('updated_not_healthy_accounts', fname, last_block=from_cached_block)
     pass
     '''
     healed_not_healthy_accounts = updated_not_healthy_accounts[updated_not_healthy_accounts.healthFactor > 1.0]
@@ -75,14 +71,16 @@ def main():
 def test1():
     fname = '{}/LiquidationCall_20211123_203253.csv'.format(CACHE_FOLDER,index_col=False)
     lliq_evnt = pd.read_csv(fname)
-    fname='{}/updated_not_healthy_accounts_20211123_192440.h5'.format(CACHE_FOLDER)
-    df = pd.read_hdf(fname, key='account_health_data')
+    latest = cache_manifest.get_latest('updated_not_healthy_accounts')
+    if latest is None:
+        print('No valid updated_not_healthy_accounts in the cache manifest')
+        return
+    df = pd.read_hdf(latest['fname'], key='account_health_data')
     pass
 
 def test2():
     user = '0x763bF487D386AFBf9c476e047D37B74636B9e831'
-    reserves = cache_events.wrapper_getReservesList()
-    reserve_config = cache_events.wrapper_getReserveData(reserves)
+    reserves, reserve_config = reserve_cache.get_reserves()
     reserve_config = reserve_config.set_index(reserve_config.addr).drop('addr', axis=1)
     collateral_type, borrowed_type = cache_events.wrapper_getUserConfiguration(user=user, reserve_to_index=reserves)
     user_account = cache_events.wrapper_getUserAccountData([user])
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+from reserve_asset import convert_addr_in_crypto_asset
+
+'''Vectorized liquidation planner.
+   For every unhealthy user the (collateral, debt) reserve pair and the debt to cover maximizing the
+   liquidation bonus profit, see LiquidationLogic.sol (Aave V2):
+      debt to cover <= close factor (50%) * user debt of the debt reserve
+      collateral received = debt to cover * debt price * bonus / collateral price <= collateral balance
+      profit (ETH) = debt to cover (ETH) * (bonus - 1)
+   All users x collateral x debt combinations are evaluated at once (in chunks of users)
+   on the health_engine.HealthFactorEngine balances and prices.
+'''
+CLOSE_FACTOR = 0.5
+CHUNK_SIZE = 4096
+
+PLAN_COLUMNS = ['user', 'collateral_asset', 'debt_asset', 'debt_to_cover', 'collateral_received',
+                'debt_to_cover_eth', 'profit_eth', 'bonus', 'health_factor']
+
+
+'''(users x collateral x debt) debt covered in ETH, limited by close factor and collateral balance'''
+def plan_chunk(collateral_eth, debt_eth, bonus, close_factor):
+    covered = np.minimum(close_factor * debt_eth[:, None, :], (collateral_eth / bonus)[:, :, None])
+    profit = covered * (bonus - 1.0)[None, :, None]
+    n_reserves = collateral_eth.shape[1]
+    best = np.argmax(profit.reshape(len(profit), -1), axis=1)
+    c, d = np.divmod(best, n_reserves)
+    rows = np.arange(len(profit))
+    return c, d, covered[rows, c, d], profit[rows, c, d]
+
+'''Best liquidation of the users with health factor below hf_threshold
+   @engine - health_engine.HealthFactorEngine
+   @liq_bonus - liquidation bonus of the engine reserves in percent (reserve table liq_bonus, i.e. 105.0)
+   @users - candidate users, all engine users if None
+   Returns frame of PLAN_COLUMNS sorted by profit, amounts in asset units
+'''
+def plan_liquidations(engine, liq_bonus, users=None, hf_threshold=1.0, close_factor=CLOSE_FACTOR):
+    rows = np.arange(len(engine)) if users is None else engine.rows(users)
+    _, _, _, health_factor = engine.compute(rows)
+    rows = rows[health_factor < hf_threshold]
+    health_factor = health_factor[health_factor < hf_threshold]
+    bonus = np.asarray(liq_bonus, dtype=np.float64) / 100.0
+    '''reserves with no bonus give no profit'''
+    bonus = np.where(bonus > 1.0, bonus, 1.0)
+
+    C, D, covered, profit = [], [], [], []
+    for i in range(0, len(rows), CHUNK_SIZE):
+        chunk = rows[i:i + CHUNK_SIZE]
+        c, d, cov, prof = plan_chunk(engine.collateral[chunk] * engine.prices, engine.debt[chunk] * engine.prices,
+                                     bonus, close_factor)
+        C.append(c)
+        D.append(d)
+        covered.append(cov)
+        profit.append(prof)
+    if len(rows) == 0:
+        return pd.DataFrame(columns=PLAN_COLUMNS)
+
+    C, D = np.concatenate(C), np.concatenate(D)
+    covered, profit = np.concatenate(covered), np.concatenate(profit)
+    reserves = np.array(engine.reserves, dtype=object)
+    df = pd.DataFrame({'user': [engine.users[i] for i in rows],
+                       'collateral_asset': reserves[C],
+                       'debt_asset': reserves[D],
+                       'debt_to_cover': covered / engine.prices[D],
+                       'collateral_received': covered * bonus[C] / engine.prices[C],
+                       'debt_to_cover_eth': covered,
+                       'profit_eth': profit,
+                       'bonus': bonus[C],
+                       'health_factor': health_factor}, columns=PLAN_COLUMNS)
+    df = df[df.profit_eth > 0]
+    return df.sort_values('profit_eth', ascending=False).reset_index(drop=True)
+
+'''plan_liquidations with bonus of the reserve table (reserve_cache / wrapper_getReserveData frame)
+   and asset names added
+'''
+def plan_from_reserve_table(engine, reserve_table, users=None, hf_threshold=1.0):
+    liq_bonus = reserve_table.set_index('addr').liq_bonus.reindex(engine.reserves).fillna(0.0).values
+    df = plan_liquidations(engine, liq_bonus, users=users, hf_threshold=hf_threshold)
+    df['collateral_name'] = df.collateral_asset.map(convert_addr_in_crypto_asset)
+    df['debt_name'] = df.debt_asset.map(convert_addr_in_crypto_asset)
+    return df
@@ -0,0 +1,138 @@
+import numpy as np
+
+'''Liquidation price index.
+   For every user and every reserve the user holds, the reserve price at which the health factor
+   crosses 1 with all other prices fixed:
+      HF(p) = (T + C_a * t_a * p) / (D + D_a * p) = 1  =>  p = (D - T) / (C_a * t_a - D_a)
+   T, D - threshold weighted collateral and debt (ETH) of the other reserves,
+   C_a, D_a - collateral and debt balance of the reserve, t_a - its liquidation threshold.
+   Net collateral exposure (C_a * t_a > D_a) is liquidated when the price falls below p,
+   net debt exposure when the price rises above p.
+   Critical prices of every reserve are kept sorted (fall and rise sides), so the users
+   liquidated by a price move are a range query (np.searchsorted) instead of a rescan.
+'''
+FALL = 1
+RISE = -1
+
+
+class LiquidationPriceIndex:
+    '''@engine - health_engine.HealthFactorEngine with balances and prices loaded'''
+    def __init__(self, engine):
+        self.engine = engine
+        n_reserves = len(engine.reserves)
+        self.critical = np.full((0, n_reserves), np.nan)
+        self.side = np.zeros((0, n_reserves), dtype=np.int8)
+        self.sorted = {}
+        self.rebuild()
+
+    '''Critical prices and sides of the engine rows'''
+    def compute(self, rows):
+        engine = self.engine
+        collateral = engine.collateral[rows]
+        debt = engine.debt[rows]
+        weighted = collateral * engine.liq_threshold
+        threshold_eth = weighted @ engine.prices
+        debt_eth = debt @ engine.prices
+        '''totals of the other reserves, per reserve'''
+        T = threshold_eth[:, None] - weighted * engine.prices
+        D = debt_eth[:, None] - debt * engine.prices
+        exposure = weighted - debt
+        with np.errstate(divide='ignore', invalid='ignore'):
+            critical = (D - T) / exposure
+        side = np.where(exposure > 0, FALL, np.where(exposure < 0, RISE, 0)).astype(np.int8)
+        '''no crossing for positive prices'''
+        side[~(critical > 0) | ~np.isfinite(critical)] = 0
+        critical[side == 0] = np.nan
+        return critical, side
+
+    def rebuild(self):
+        rows = np.arange(len(self.engine))
+        self.critical, self.side = self.compute(rows)
+        self.sorted.clear()
+
+    '''Recompute the rows of the users, i.e. after engine.set_balances/load_balances'''
+    def update_users(self, users):
+        n_users = len(self.engine)
+        if n_users > len(self.critical):
+            padding = n_users - len(self.critical)
+            self.critical = np.vstack([self.critical, np.full((padding, self.critical.shape[1]), np.nan)])
+            self.side = np.vstack([self.side, np.zeros((padding, self.side.shape[1]), dtype=np.int8)])
+        rows = self.engine.rows(users)
+        if len(rows) == 0:
+            return
+        self.set_rows(rows, *self.compute(rows))
+
+    '''Price tick, critical prices of the other reserves change only for users exposed to the asset
+       @rows - engine rows exposed to the asset if known (i.e. from oracle_monitor inverted index)
+    '''
+    def update_price(self, asset, price, rows=None):
+        self.engine.update_price(asset, price)
+        k = self.engine.reserve_index[asset]
+        if rows is None:
+            rows = np.flatnonzero((self.engine.collateral[:, k] > 0) | (self.engine.debt[:, k] > 0))
+        if len(rows) == 0:
+            return
+        self.set_rows(rows, *self.compute(rows))
+
+    '''Set critical prices and sides of the rows, sorted arrays already built are patched only for the
+       reserve sides the rows leave or enter: rows are removed and inserted again at their np.searchsorted position
+    '''
+    def set_rows(self, rows, critical, side):
+        old_side = self.side[rows]
+        self.critical[rows], self.side[rows] = critical, side
+        for (k, s), (prices, sorted_rows) in list(self.sorted.items()):
+            I = side[:, k] == s
+            if not (I.any() or (old_side[:, k] == s).any()):
+                continue
+            keep = ~np.isin(sorted_rows, rows)
+            prices, sorted_rows = prices[keep], sorted_rows[keep]
+            order = np.argsort(critical[I, k], kind='stable')
+            new_prices, new_rows = critical[I, k][order], rows[I][order]
+            positions = np.searchsorted(prices, new_prices, side='right')
+            self.sorted[k, s] = np.insert(prices, positions, new_prices), np.insert(sorted_rows, positions, new_rows)
+
+    '''(critical prices, rows) of the reserve side sorted by price, sorted on first use'''
+    def get_sorted(self, k, side):
+        key = k, side
+        if key not in self.sorted:
+            rows = np.flatnonzero(self.side[:, k] == side)
+            prices = self.critical[rows, k]
+            order = np.argsort(prices, kind='stable')
+            self.sorted[key] = prices[order], rows[order]
+        return self.sorted[key]
+
+    def to_users(self, rows):
+        return [self.engine.users[i] for i in np.unique(rows)]
+
+    '''Rows with critical price of the reserve within [low, high] (both sides)'''
+    def range_rows(self, k, side, low, high):
+        prices, rows = self.get_sorted(k, side)
+        i1 = np.searchsorted(prices, low, side='left')
+        i2 = np.searchsorted(prices, high, side='right')
+        return rows[i1:i2]
+
+    '''Users liquidated by the asset price move from old_price to new_price'''
+    def crossed(self, asset, old_price, new_price):
+        k = self.engine.reserve_index[asset]
+        if new_price < old_price:
+            rows = self.range_rows(k, FALL, new_price, old_price)
+            prices = self.critical[rows, k]
+            rows = rows[prices > new_price]
+        else:
+            rows = self.range_rows(k, RISE, old_price, new_price)
+            prices = self.critical[rows, k]
+            rows = rows[prices < new_price]
+        return self.to_users(rows)
+
+    '''Users liquidated by a move of any reserve price by at most margin (relative), i.e. 0.05'''
+    def near_liquidation(self, margin):
+        engine = self.engine
+        rows = []
+        for k, price in enumerate(engine.prices):
+            if not price > 0:
+                continue
+            rows.append(self.range_rows(k, FALL, price * (1.0 - margin), price))
+            rows.append(self.range_rows(k, RISE, price, price * (1.0 + margin)))
+        if len(rows) == 0:
+            return []
+        return self.to_users(np.concatenate(rows))
@@ -0,0 +1,219 @@
+import os
+import json
+import shutil
+import datetime
+import numpy as np
+import pandas as pd
+import cache_manifest
+from config import CACHE_FOLDER
+
+'''Memory-mapped columnar snapshots.
+   A snapshot is a folder of fixed-width .npy columns, opened with np.load(mmap_mode='r'): columns are
+   wrapped as NumPy arrays over the file pages without copying, processes loading the same snapshot share
+   the page cache and loading does not depend on the snapshot size.
+      <SNAPSHOT_FOLDER>/<name>/<version>/<column>.npy, columns.json
+   Addresses are interned to int32 ids of one append-only table (addresses.npy) shared by all snapshots,
+   other strings are fixed-width bytes and uint256 values are float64 (exact values stay in the event store).
+   Every export is a new version folder recorded in cache_manifest, the previous one is removed, columns.json
+   keeps the sha256 of every column file.
+   Snapshots are not rewritten on every update: readers take the rows changed after the snapshot from the
+   event store / state store and the snapshot is exported again after SNAPSHOT_EXPORT_MIN_ROWS changes.
+'''
+SNAPSHOT_FOLDER = '{}/snapshots'.format(CACHE_FOLDER)
+ADDRESS_TABLE_FNAME = '{}/addresses.npy'.format(SNAPSHOT_FOLDER)
+META_FNAME = 'columns.json'
+
+ACCOUNTS_SNAPSHOT = 'accounts'
+
+_verified = set()
+
+
+def is_address_column(values):
+    return len(values) > 0 and all(isinstance(v, str) and len(v) == 42 and v.startswith('0x') for v in values[:100])
+
+
+class AddressTable:
+    def __init__(self, fname=ADDRESS_TABLE_FNAME):
+        self.fname = fname
+        self.load()
+
+    def load(self):
+        self.addresses = np.load(self.fname, mmap_mode='r') if os.path.exists(self.fname) else np.zeros(0, dtype='S42')
+        self.ids = None
+
+    def get_ids(self):
+        if self.ids is None:
+            self.ids = {address: i for i, address in enumerate(self.addresses.astype(str))}
+        return self.ids
+
+    '''ids of the addresses, new addresses are appended to the table
+       writers are serialized by a file lock and the table is reloaded under it, so addresses appended by
+       another process keep their ids, the table is replaced by write-then-rename
+    '''
+    def intern(self, addresses):
+        ids = self.get_ids()
+        if any(address not in ids for address in addresses):
+            with cache_manifest.file_lock(self.fname):
+                self.load()
+                ids = self.get_ids()
+                new = [address for address in dict.fromkeys(addresses) if address not in ids]
+                if len(new) > 0:
+                    for address in new:
+                        ids[address] = len(ids)
+                    self.addresses = np.concatenate([np.asarray(self.addresses), np.array(new, dtype='S42')])
+                    save_array(self.addresses, self.fname)
+        return np.array([ids[address] for address in addresses], dtype=np.int32)
+
+    '''Addresses (str) of the ids'''
+    def lookup(self, ids):
+        return self.addresses[np.asarray(ids)].astype(str)
+
+
+def save_array(array, fname):
+    with cache_manifest.atomic_path(fname) as tmp_fname:
+        with open(tmp_fname, 'wb') as f:
+            np.save(f, array)
+
+'''Fixed-width column of a frame column, Returns (array, kind)
+   kind is address (int32 ids), uint256 (float64), bytes or the numpy dtype
+'''
+def to_fixed_width(values, address_table):
+    values = np.asarray(values)
+    if values.dtype != object:
+        return values, str(values.dtype)
+    if is_address_column(values):
+        return address_table.intern(list(values)), 'address'
+    if len(values) > 0 and isinstance(values[0], int) and not isinstance(values[0], bool):
+        return np.array([float(v) for v in values], dtype=np.float64), 'uint256'
+    if len(values) > 0 and isinstance(values[0], bool):
+        return values.astype(bool), 'bool'
+    return values.astype(str).astype(np.bytes_), 'bytes'
+
+'''Write the columns of the frame as a new version of the snapshot
+   @block - block the snapshot is valid at
+'''
+def write_snapshot(name, df, block=None, **meta):
+    address_table = AddressTable()
+    version = '{}_{}'.format(datetime.datetime.now().strftime('%Y%m%d_%H%M%S'), block)
+    folder = '{}/{}/{}'.format(SNAPSHOT_FOLDER, name, version)
+    os.makedirs(folder, exist_ok=True)
+    kinds = {}
+    checksums = {}
+    for column in df.columns:
+        array, kinds[column] = to_fixed_width(df[column].values, address_table)
+        fname = '{}/{}.npy'.format(folder, column)
+        save_array(array, fname)
+        checksums[column] = cache_manifest.checksum(fname)
+    meta_fname = '{}/{}'.format(folder, META_FNAME)
+    cache_manifest.dump_json(dict(meta, columns=list(df.columns), kinds=kinds, sha256=checksums, size=len(df),
+                                  block=block), meta_fname)
+
+    previous = cache_manifest.get_latest(snapshot_dataset(name), check=False)
+    cache_manifest.record(snapshot_dataset(name), meta_fname, last_block=block, version=version)
+    if previous is not None and os.path.dirname(previous['fname']) != folder:
+        '''load_snapshot maps every column, mapped pages stay valid for readers that still hold the previous version'''
+        shutil.rmtree(os.path.dirname(previous['fname']), ignore_errors=True)
+    return folder
+
+
+def snapshot_dataset(name):
+    return 'snapshot:{}'.format(name)
+
+
+class Snapshot:
+    def __init__(self, folder, meta):
+        self.folder = folder
+        self.meta = meta
+        self.block = meta['block']
+        self.kinds = meta['kinds']
+        self.columns = {}
+        self.address_table = None
+
+    def __len__(self):
+        return self.meta['size']
+
+    '''Memory-mapped column, address columns are int32 ids'''
+    def column(self, name):
+        if name not in self.columns:
+            self.columns[name] = np.load('{}/{}.npy'.format(self.folder, name), mmap_mode='r')
+        return self.columns[name]
+
+    '''Map every column, i.e. before the version folder can be removed by a new export'''
+    def map_columns(self):
+        for name in self.meta['columns']:
+            self.column(name)
+
+    def addresses(self, ids):
+        if self.address_table is None:
+            self.address_table = AddressTable()
+        return self.address_table.lookup(ids)
+
+    '''DataFrame of the rows (bool mask or indices, all if None), addresses decoded to str'''
+    def to_frame(self, columns=None, rows=None):
+        S = {}
+        for name in columns if columns is not None else self.meta['columns']:
+            values = self.column(name)
+            values = values[rows] if rows is not None else np.asarray(values)
+            if self.kinds[name] == 'address':
+                values = self.addresses(values)
+            elif self.kinds[name] == 'bytes':
+                values = values.astype(str)
+            S[name] = values
+        return pd.DataFrame(S)
+
+'''True if every column file of the snapshot version matches its checksum, checked once per process'''
+def verify_columns(folder, meta):
+    if folder not in _verified:
+        for column, sha256 in meta.get('sha256', {}).items():
+            if not cache_manifest.verify('{}/{}.npy'.format(folder, column), sha256):
+                print('Snapshot column {}/{}.npy is missing or corrupted'.format(folder, column))
+                return False
+        _verified.add(folder)
+    return True
+
+'''Latest version of the snapshot with all columns mapped, None if there is no one or a column fails the checksum'''
+def load_snapshot(name):
+    latest = cache_manifest.get_latest(snapshot_dataset(name))
+    if latest is None:
+        return None
+    folder = os.path.dirname(latest['fname'])
+    try:
+        meta = json.load(open(latest['fname']))
+        if not verify_columns(folder, meta):
+            return None
+        snapshot = Snapshot(folder, meta)
+        snapshot.map_columns()
+    except FileNotFoundError:
+        '''the version was replaced by a new export after the manifest was read'''
+        _verified.discard(folder)
+        return load_snapshot(name)
+    return snapshot
+
+'''Snapshot of the state store accounts
+   @verified_block - last verified block of the accounts, accounts verified from it on are read from the state store
+'''
+def export_accounts(df, block, updated_at):
+    verified_block = int(df.verified_block.max()) if len(df) > 0 else None
+    return write_snapshot(ACCOUNTS_SNAPSHOT, df, block=block, updated_at=updated_at, verified_block=verified_block)
+
+'''Accounts of the latest snapshot (state_store.ACCOUNT_COLUMNS) and its verified block, (None, None) if there is no one
+   @alive, @hf_max - filtered on the mapped columns, only matching rows are copied
+'''
+def load_accounts(alive=False, hf_max=None):
+    snapshot = load_snapshot(ACCOUNTS_SNAPSHOT)
+    if snapshot is None or snapshot.meta.get('verified_block') is None:
+        return None, None
+    I = np.ones(len(snapshot), dtype=bool)
+    if alive:
+        I &= (snapshot.column('col') > 0) & (snapshot.column('debt') > 0)
+    if hf_max is not None:
+        I &= snapshot.column('healthFactor') < hf_max
+    return snapshot.to_frame(rows=np.flatnonzero(I)), snapshot.meta['verified_block']
+
+'''Snapshot of the confirmed events of event_name, @block - last confirmed block of the events'''
+def export_events(event_name, df, block):
+    return write_snapshot('events_{}'.format(event_name), df, block=block)
+
+
+def load_events(event_name):
+    return load_snapshot('events_{}'.format(event_name))
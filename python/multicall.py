@@ -0,0 +1,64 @@
+import config
+import web3_client
+from web3._utils.abi import get_abi_output_types
+
+'''Multicall2 contract, aggregates many eth_call's into a single one, see:
+   https://github.com/makerdao/multicall
+'''
+MULTICALL2_ADDRESS = '0x5BA1e12693Dc8F9c48aAD8770482f4739bEeD696'
+MULTICALL2_ABI = '[{"inputs":[{"internalType":"bool","name":"requireSuccess","type":"bool"},{"components":[{"internalType":"address","name":"target","type":"address"},{"internalType":"bytes","name":"callData","type":"bytes"}],"internalType":"struct Multicall2.Call[]","name":"calls","type":"tuple[]"}],"name":"tryAggregate","outputs":[{"components":[{"internalType":"bool","name":"success","type":"bool"},{"internalType":"bytes","name":"returnData","type":"bytes"}],"internalType":"struct Multicall2.Result[]","name":"returnData","type":"tuple[]"}],"stateMutability":"nonpayable","type":"function"}]'
+
+
+def get_multicall_contract():
+    return web3_client.get_contract(MULTICALL2_ADDRESS, MULTICALL2_ABI)
+
+'''Call tryAggregate(false, calls), a failed call does not revert the whole batch.
+   If the aggregate call itself fails (i.e. out of gas, node limits) the batch is split
+   in two halves until the failing call is isolated, its result is (False, None).
+'''
+def try_aggregate_batch(multicall, calls, block_identifier='latest'):
+    try:
+        return multicall.functions.tryAggregate(False, calls).call(block_identifier=block_identifier)
+    except ValueError:
+        if len(calls) == 1:
+            return [(False, None)]
+        half = len(calls) // 2
+        return try_aggregate_batch(multicall, calls[:half], block_identifier) + \
+               try_aggregate_batch(multicall, calls[half:], block_identifier)
+
+'''Input args:
+   @calls - list of (target address, call data)
+   Returns list of (success, return data) in the same order as calls,
+   return data is None for the calls not executed because the aggregate call failed
+'''
+def try_aggregate(calls, batch_size=config.MULTICALL_BATCH_SIZE, block_identifier='latest'):
+    multicall = get_multicall_contract()
+    results = []
+    for i in range(0, len(calls), batch_size):
+        results += try_aggregate_batch(multicall, calls[i:i + batch_size], block_identifier)
+        if len(calls) > batch_size:
+            print('Collected {}/{} calls'.format(len(results), len(calls)))
+    return results
+
+def encode_calls(contract, fn_name, args_list):
+    return [(contract.address, contract.encodeABI(fn_name=fn_name, args=args)) for args in args_list]
+
+'''Decode (success, return data) list of tryAggregate, None for the failed calls'''
+def decode_results(contract, fn_name, results):
+    output_types = get_abi_output_types(contract.get_function_by_name(fn_name).abi)
+    decoded = []
+    for success, return_data in results:
+        if success and len(return_data) > 0:
+            decoded.append(contract.web3.codec.decode_abi(output_types, return_data))
+        else:
+            decoded.append(None)
+    return decoded
+
+'''Call contract function fn_name for every args in args_list via Multicall,
+   Returns list of decoded outputs, None for the failed calls
+'''
+def call_function_batch(contract, fn_name, args_list, batch_size=config.MULTICALL_BATCH_SIZE,
+                        block_identifier='latest'):
+    calls = encode_calls(contract, fn_name, args_list)
+    results = try_aggregate(calls, batch_size=batch_size, block_identifier=block_identifier)
+    return decode_results(contract, fn_name, results)
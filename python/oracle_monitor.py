@@ -0,0 +1,95 @@
+import time
+import numpy as np
+import chainlink_events
+import block_range
+
+'''Oracle update triggered re-evaluation.
+   Chainlink NewTransmission (or AnswerUpdated) events of the reserve feeds are ingested in block order,
+   an inverted index reserve -> engine rows holding it as collateral or debt keeps the work per update
+   proportional to the exposure to the asset, users not holding the asset are never touched.
+   Health factors are computed by health_engine.HealthFactorEngine, the liquidation price index
+   (if given) is updated on the same rows.
+'''
+
+
+class OracleMonitor:
+    '''@engine - health_engine.HealthFactorEngine with balances and prices loaded
+       @feeds - dict aggregator address -> (reserve address, direct), direct is False for ETH/asset feeds
+       @index - optional liquidation_price_index.LiquidationPriceIndex of the engine
+    '''
+    def __init__(self, engine, feeds, index=None, event_name='NewTransmission'):
+        self.engine = engine
+        self.feeds = feeds
+        self.index = index
+        self.event_name = event_name
+        self.exposed = {}
+        self.rebuild()
+
+    def rebuild(self):
+        held = (self.engine.collateral > 0) | (self.engine.debt > 0)
+        self.exposed = {k: set(np.flatnonzero(held[:, k])) for k in range(len(self.engine.reserves))}
+
+    '''Update inverted index after balances of the users are changed in the engine'''
+    def update_users(self, users):
+        rows = self.engine.rows(users)
+        held = (self.engine.collateral[rows] > 0) | (self.engine.debt[rows] > 0)
+        for k, exposed_rows in self.exposed.items():
+            exposed_rows.difference_update(rows)
+            exposed_rows.update(rows[held[:, k]])
+        if self.index is not None:
+            self.index.update_users(users)
+
+    def get_exposed_rows(self, asset):
+        return np.fromiter(self.exposed[self.engine.reserve_index[asset]], dtype=np.int64)
+
+    '''New price of the asset (ETH), only users exposed to the asset are re-evaluated
+       Returns frame of the exposed users health factors (see HealthFactorEngine.to_frame)
+    '''
+    def on_price(self, asset, price):
+        rows = self.get_exposed_rows(asset)
+        if self.index is not None:
+            self.index.update_price(asset, price, rows=rows)
+        else:
+            self.engine.update_price(asset, price)
+        return self.engine.to_frame([self.engine.users[i] for i in rows])
+
+    '''Price updates of all feeds in [from_block, to_block] sorted by (block_number, log_index)
+       Returns list of (block_number, log_index, asset, price in ETH)
+    '''
+    def query_updates(self, from_block, to_block):
+        updates = []
+        for aggregator, (asset, direct) in self.feeds.items():
+            columns, decimals = chainlink_events.query_chainlink_event_columns(aggregator, from_block, to_block,
+                                                                               event_name=self.event_name)
+            if columns is None:
+                continue
+            for block_number, log_index, answer in zip(columns['block_number'], columns['log_index'],
+                                                       columns['answer']):
+                price = answer / 10 ** decimals
+                updates.append((int(block_number), int(log_index), asset, price if direct else 1.0 / price))
+        updates.sort(key=lambda update: (update[0], update[1]))
+        return updates
+
+    '''Ingest feed updates of [from_block, to_block],
+       Returns list of (block_number, asset, liquidatable users) for updates leaving users with HF < 1
+    '''
+    def ingest(self, from_block, to_block, threshold=1.0):
+        liquidatable = []
+        for block_number, _, asset, price in self.query_updates(from_block, to_block):
+            accounts = self.on_price(asset, price)
+            I = accounts.healthFactor < threshold
+            if I.any():
+                liquidatable.append((block_number, asset, list(accounts.user[I])))
+        return liquidatable
+
+    '''Follow the chain head, on_liquidatable(block_number, asset, users) is called for every update
+       leaving users with HF < 1
+    '''
+    def run(self, from_block, on_liquidatable, poll_interval=15):
+        while True:
+            to_block = block_range.resolve_block('latest')
+            if to_block >= from_block:
+                for block_number, asset, users in self.ingest(from_block, to_block):
+                    on_liquidatable(block_number, asset, users)
+                from_block = to_block + 1
+            time.sleep(poll_interval)
@@ -0,0 +1,149 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import block_range
+import cache_manifest
+import cache_events
+import event_decoder
+import web3_client
+from config import CACHE_FOLDER
+
+'''Local Chainlink price history, one answer series per aggregator:
+   block_number, log_index, round, answer (scaled by decimals), timestamp
+   The series is built from AnswerUpdated events, the OCR aggregator emits it with every
+   NewTransmission (same round and answer) and it carries the round timestamp with static fields only.
+   Backfilled once per block range and appended incrementally, lookups are binary search
+   (np.searchsorted) on block_number, a whole frame of events is joined by pd.merge_asof.
+   Every fetched block range is a new partition file <aggregator>/<b1>_<b2>.h5 listed in the manifest,
+   written atomically (cache_manifest) and never rewritten. The manifest is saved after every
+   aggregator so an interrupted update resumes from the last stored block.
+'''
+PRICE_STORE_FOLDER = '{}/prices'.format(CACHE_FOLDER)
+MANIFEST_FNAME = '{}/manifest.json'.format(PRICE_STORE_FOLDER)
+HDF_KEY = 'answers'
+
+'''Minimal aggregator ABI: decimals and AnswerUpdated'''
+AGGREGATOR_ABI = '[{"inputs":[],"name":"decimals","outputs":[{"internalType":"uint8","name":"","type":"uint8"}],"stateMutability":"view","type":"function"},{"anonymous":false,"inputs":[{"indexed":true,"internalType":"int256","name":"current","type":"int256"},{"indexed":true,"internalType":"uint256","name":"roundId","type":"uint256"},{"indexed":false,"internalType":"uint256","name":"updatedAt","type":"uint256"}],"name":"AnswerUpdated","type":"event"}]'
+
+_series = {}
+
+
+def load_manifest():
+    if os.path.exists(MANIFEST_FNAME):
+        return json.load(open(MANIFEST_FNAME))
+    return {}
+
+
+def save_manifest(manifest):
+    cache_manifest.dump_json(manifest, MANIFEST_FNAME)
+
+
+def get_fname(aggregator):
+    return '{}/{}.h5'.format(PRICE_STORE_FOLDER, aggregator)
+
+
+def get_partition_fname(aggregator, b1, b2):
+    return '{}/{}/{}_{}.h5'.format(PRICE_STORE_FOLDER, aggregator, b1, b2)
+
+
+def query_answers(aggregator, decimals, from_block, to_block):
+    contract = web3_client.get_contract(aggregator, AGGREGATOR_ABI)
+    event = contract.events.AnswerUpdated
+    logs = block_range.get_event_logs(event, cache_events.make_filter_params, from_block=from_block, to_block=to_block)
+    if len(logs) == 0:
+        return None
+    columns = event_decoder.get_decoder(event._get_event_abi()).decode(logs)
+    return pd.DataFrame({'block_number': columns['block_number'],
+                         'log_index': columns['log_index'],
+                         'round': np.array([int(r) for r in columns['roundId']], dtype=np.int64),
+                         'answer': np.array([int(a) for a in columns['current']], dtype=np.float64) / 10 ** decimals,
+                         'timestamp': np.array([int(t) for t in columns['updatedAt']], dtype=np.int64)})
+
+'''Backfill [from_block, first stored block) and append (last stored block, to_block] of every aggregator'''
+def update(aggregators, from_block, to_block='latest'):
+    to_block = block_range.resolve_block(to_block)
+    manifest = load_manifest()
+    for aggregator in aggregators:
+        meta = manifest.get(aggregator)
+        if meta is None:
+            decimals = web3_client.get_contract(aggregator, AGGREGATOR_ABI).functions.decimals().call()
+            meta = {'decimals': decimals, 'first_block': from_block, 'last_block': from_block - 1}
+            manifest[aggregator] = meta
+            ranges = [(from_block, to_block)]
+        else:
+            ranges = []
+            if from_block < meta['first_block']:
+                ranges.append((from_block, meta['first_block'] - 1))
+            if to_block > meta['last_block']:
+                ranges.append((meta['last_block'] + 1, to_block))
+
+        for b1, b2 in ranges:
+            df = query_answers(aggregator, meta['decimals'], b1, b2)
+            if df is not None:
+                fname = get_partition_fname(aggregator, b1, b2)
+                cache_manifest.to_hdf(df, fname, key=HDF_KEY, format='table', data_columns=['block_number'])
+                meta.setdefault('partitions', []).append([b1, b2, os.path.relpath(fname, PRICE_STORE_FOLDER)])
+            meta['first_block'] = min(meta['first_block'], b1)
+            meta['last_block'] = max(meta['last_block'], b2)
+            _series.pop(aggregator, None)
+        save_manifest(manifest)
+
+'''Answer series of the aggregator sorted by (block_number, log_index), memoized in-process'''
+def load_series(aggregator):
+    if aggregator not in _series:
+        partitions = load_manifest().get(aggregator, {}).get('partitions', [])
+        fnames = ['{}/{}'.format(PRICE_STORE_FOLDER, fname) for _, _, fname in partitions]
+        '''series written before partitioning are a single file'''
+        if os.path.exists(get_fname(aggregator)):
+            fnames.insert(0, get_fname(aggregator))
+        if len(fnames) > 0:
+            df = pd.concat([pd.read_hdf(fname, key=HDF_KEY) for fname in fnames], ignore_index=True)
+            df = df.sort_values(['block_number', 'log_index']).drop_duplicates(['block_number', 'log_index'])
+        else:
+            df = pd.DataFrame({'block_number': np.zeros(0, dtype=np.int64), 'log_index': np.zeros(0, dtype=np.int64),
+                               'round': np.zeros(0, dtype=np.int64), 'answer': np.zeros(0),
+                               'timestamp': np.zeros(0, dtype=np.int64)})
+        _series[aggregator] = df.reset_index(drop=True)
+    return _series[aggregator]
+
+'''Last answer at or before the block, Returns (block_number, answer) or (None, None)
+   @max_age - ignore answers older than max_age blocks
+'''
+def price_as_of(aggregator, block, max_age=None):
+    series = load_series(aggregator)
+    i = np.searchsorted(series.block_number.values, block, side='right') - 1
+    if i < 0:
+        return None, None
+    block_number = int(series.block_number.values[i])
+    if max_age is not None and block - block_number > max_age:
+        return None, None
+    return block_number, series.answer.values[i]
+
+'''As-of join of the events with the answer series of their aggregators
+   @aggregator_column - column of events with the aggregator address
+   Adds <prefix>price and <prefix>price_block columns (NaN if there is no answer before the event)
+'''
+def merge_as_of(events, aggregator_column, block_column='block_number', prefix='', max_age=None):
+    series = []
+    for aggregator in events[aggregator_column].dropna().unique():
+        df = load_series(aggregator)[['block_number', 'answer']].copy()
+        df['_aggregator'] = aggregator
+        series.append(df)
+    events = events.copy()
+    events['_order'] = np.arange(len(events))
+    if len(series) == 0:
+        events[prefix + 'price'] = np.nan
+        events[prefix + 'price_block'] = np.nan
+        return events.drop('_order', axis=1)
+
+    series = pd.concat(series, ignore_index=True).rename(columns={'block_number': '_price_block',
+                                                                  'answer': prefix + 'price'})
+    series[prefix + 'price_block'] = series._price_block
+    left = events.sort_values(block_column, kind='stable')
+    left['_block'] = left[block_column].astype(np.int64)
+    merged = pd.merge_asof(left, series.sort_values('_price_block', kind='stable'), left_on='_block', right_on='_price_block',
+                           left_by=aggregator_column, right_by='_aggregator', direction='backward',
+                           tolerance=max_age)
+    merged = merged.sort_values('_order').drop(['_order', '_block', '_price_block', '_aggregator'], axis=1)
+    return merged.reset_index(drop=True)
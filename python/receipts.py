@@ -0,0 +1,154 @@
+import os
+import json
+import datetime
+import numpy as np
+import pandas as pd
+import config
+import cache_manifest
+import rpc_batch
+from web3 import Web3
+from config import CACHE_FOLDER
+
+'''Bulk transaction receipt service with an on-disk cache.
+   Mined receipts are immutable, so every receipt is fetched once and kept by transaction hash
+   (only the fields needed for gas cost analysis). Missing receipts are grouped by block:
+   blocks with many requested transactions use eth_getBlockReceipts, the rest are fetched by
+   eth_getTransactionReceipt in JSON-RPC batches.
+   Every fetch appends a partition file to RECEIPTS_FOLDER, listed in its manifest.
+'''
+RECEIPTS_FNAME = '{}/receipts.h5'.format(CACHE_FOLDER)
+RECEIPTS_FOLDER = '{}/receipts'.format(CACHE_FOLDER)
+RECEIPTS_MANIFEST_FNAME = '{}/manifest.json'.format(RECEIPTS_FOLDER)
+HDF_KEY = 'receipts'
+RECEIPT_COLUMNS = ['tx_hash', 'block_number', 'gas_used', 'effective_gas_price', 'status']
+
+'''JSON-RPC error code of not supported methods'''
+METHOD_NOT_FOUND = -32601
+
+_cache = None
+_block_receipts_supported = True
+
+
+def load_partitions():
+    if os.path.exists(RECEIPTS_MANIFEST_FNAME):
+        return json.load(open(RECEIPTS_MANIFEST_FNAME))['partitions']
+    return []
+
+
+def load_cache():
+    global _cache
+    if _cache is None:
+        frames = [pd.read_hdf('{}/{}'.format(RECEIPTS_FOLDER, fname), key=HDF_KEY) for fname in load_partitions()]
+        #receipts cached before partitioning are a single file, missing effectiveGasPrice was stored as 0
+        if os.path.exists(RECEIPTS_FNAME):
+            legacy = pd.read_hdf(RECEIPTS_FNAME, key=HDF_KEY)
+            legacy['effective_gas_price'] = legacy.effective_gas_price.replace(0, np.nan)
+            frames.insert(0, legacy)
+        if len(frames) > 0:
+            df = pd.concat(frames, ignore_index=True)
+            _cache = df.drop_duplicates('tx_hash').set_index('tx_hash')
+        else:
+            _cache = pd.DataFrame(columns=RECEIPT_COLUMNS).set_index('tx_hash')
+    return _cache
+
+'''Write the receipts as a new partition file and list it in the receipts manifest,
+   stored partitions are never rewritten
+'''
+def append_cache(df):
+    global _cache
+    if len(df) == 0:
+        return
+    partitions = load_partitions()
+    fname = '{}_{}.h5'.format(len(partitions), datetime.datetime.now().strftime('%Y%m%d_%H%M%S'))
+    cache_manifest.to_hdf(df, '{}/{}'.format(RECEIPTS_FOLDER, fname), key=HDF_KEY, format='table',
+                          min_itemsize={'tx_hash': 66})
+    cache_manifest.dump_json({'partitions': partitions + [fname]}, RECEIPTS_MANIFEST_FNAME)
+    _cache = pd.concat([load_cache(), df.set_index('tx_hash')])
+
+
+def to_tx_hash(tx_hash):
+    if isinstance(tx_hash, str):
+        return tx_hash.lower()
+    return Web3.toHex(tx_hash)
+
+
+def make_receipt_frame(receipts):
+    return pd.DataFrame({'tx_hash': [to_tx_hash(r['transactionHash']) for r in receipts],
+                         'block_number': np.array([r['blockNumber'] for r in receipts], dtype=np.int64),
+                         'gas_used': np.array([r['gasUsed'] for r in receipts], dtype=np.int64),
+                         'effective_gas_price': np.array([r.get('effectiveGasPrice', np.nan) for r in receipts],
+                                                         dtype=np.float64),
+                         'status': np.array([r.get('status', 1) for r in receipts], dtype=np.int64)},
+                        columns=RECEIPT_COLUMNS)
+
+'''Fetch receipts of the transactions, Returns list of formatted receipts (failed ones are skipped)
+   @block_numbers - block of every transaction if known, enables block level retrieval
+'''
+def fetch_receipts(tx_hashes, block_numbers=None):
+    global _block_receipts_supported
+    transport = rpc_batch.BatchTransport()
+    wanted = set(tx_hashes)
+    single = list(tx_hashes)
+    block_futures = {}
+    if block_numbers is not None and _block_receipts_supported:
+        by_block = pd.Series(list(tx_hashes)).groupby(np.asarray(block_numbers, dtype=np.int64))
+        single = []
+        for block, txs in by_block:
+            if len(txs) >= config.RECEIPTS_BLOCK_FETCH_MIN_TXS:
+                block_futures[int(block)] = (transport.eth_getBlockReceipts(int(block)), list(txs))
+            else:
+                single += list(txs)
+
+    tx_futures = {tx: transport.eth_getTransactionReceipt(tx) for tx in single}
+    transport.flush()
+
+    receipts = []
+    '''receipts missing from the block result (null result, i.e. pruned or unknown block) are fetched by transaction'''
+    for block, (future, txs) in block_futures.items():
+        try:
+            block_receipts = [r for r in future.result() or [] if to_tx_hash(r['transactionHash']) in wanted]
+        except rpc_batch.RpcError as e:
+            if e.code == METHOD_NOT_FOUND:
+                _block_receipts_supported = False
+            block_receipts = []
+        receipts += block_receipts
+        found = set(to_tx_hash(r['transactionHash']) for r in block_receipts)
+        tx_futures.update({tx: transport.eth_getTransactionReceipt(tx) for tx in txs if tx not in found})
+    transport.flush()
+
+    for tx, future in tx_futures.items():
+        try:
+            receipt = future.result()
+        except rpc_batch.RpcError as e:
+            print('Failed to get receipt for:{}, {}'.format(tx, e))
+            continue
+        if receipt is not None:
+            receipts.append(receipt)
+    return receipts
+
+'''Receipts of the transactions (tx_hash index, RECEIPT_COLUMNS), only missing ones are fetched'''
+def get_receipts(tx_hashes, block_numbers=None):
+    tx_hashes = [to_tx_hash(tx) for tx in tx_hashes]
+    cache = load_cache()
+    missing = ~pd.Index(tx_hashes).isin(cache.index)
+    if missing.any():
+        missing_txs = list(dict.fromkeys(np.array(tx_hashes, dtype=object)[missing]))
+        missing_blocks = None
+        if block_numbers is not None:
+            blocks = pd.Series(np.asarray(block_numbers)[missing], index=np.array(tx_hashes, dtype=object)[missing])
+            missing_blocks = blocks[~blocks.index.duplicated()].loc[missing_txs].values
+        append_cache(make_receipt_frame(fetch_receipts(missing_txs, missing_blocks)))
+    return load_cache().reindex(tx_hashes)
+
+'''Gas cost in ETH (gasUsed * effectiveGasPrice) of the transactions, NaN if the receipt or its effectiveGasPrice
+   (pre-London receipts of some nodes) is missing
+'''
+def gas_cost(tx_hashes, block_numbers=None):
+    df = get_receipts(tx_hashes, block_numbers)
+    return df.gas_used.values.astype(np.float64) * df.effective_gas_price.values.astype(np.float64) / 1e18
+
+'''Add gas cost column to a frame of transactions'''
+def add_gas_cost(df, tx_column, block_column=None, column='gas_payed'):
+    block_numbers = df[block_column].values if block_column is not None else None
+    df[column] = gas_cost(df[tx_column].values, block_numbers)
+    return df
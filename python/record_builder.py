@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+'''Typed columnar record builder, replaces building one-row DataFrames and pd.concat.
+   Every field of the schema is a preallocated numpy array, grown by doubling,
+   one DataFrame is built at the end.
+   @schema - list of (field name, numpy dtype), object dtype for addresses, uint256 and strings
+'''
+
+class ColumnarRecordBuilder:
+    def __init__(self, schema, capacity=1024):
+        self.schema = list(schema)
+        self.size = 0
+        self.capacity = max(capacity, 1)
+        self.arrays = {name: np.empty(self.capacity, dtype=dtype) for name, dtype in self.schema}
+
+    def __len__(self):
+        return self.size
+
+    def reserve(self, n):
+        if self.size + n <= self.capacity:
+            return
+        capacity = self.capacity
+        while capacity < self.size + n:
+            capacity *= 2
+        for name, dtype in self.schema:
+            array = np.empty(capacity, dtype=dtype)
+            array[:self.size] = self.arrays[name][:self.size]
+            self.arrays[name] = array
+        self.capacity = capacity
+
+    def append(self, **row):
+        self.reserve(1)
+        for name, _ in self.schema:
+            self.arrays[name][self.size] = row[name]
+        self.size += 1
+
+    '''Append whole columns, dict field name -> array like, all of the same length'''
+    def extend(self, columns):
+        n = len(columns[self.schema[0][0]])
+        self.reserve(n)
+        for name, _ in self.schema:
+            self.arrays[name][self.size:self.size + n] = columns[name]
+        self.size += n
+
+    def clear(self):
+        self.size = 0
+
+    def to_frame(self):
+        return pd.DataFrame({name: self.arrays[name][:self.size].copy() for name, _ in self.schema},
+                            columns=[name for name, _ in self.schema])
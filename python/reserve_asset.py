@@ -1,3 +1,5 @@
+import numpy as np
+
 '''
 Crypto assets addresses from:
 https://docs.aave.com/developers/v/1.0/deployed-contracts/deployed-contract-instances#reserves-assets
@@ -47,21 +49,36 @@ CRYPTO_ASSET_NAME_TO_ADDRESS = {value:key for key, value in CRYPTO_ASSET_ADDRESS
    https://docs.aave.com/developers/the-core-protocol/lendingpool#getconfiguration 
 '''
 def split_user_loan_deposit_bitmask(bitmask):
-    bitmask_ascii = str(bin(bitmask))
-    asset_index = 0
     S = {}
-    print(bitmask_ascii)
-    for i in range(len(bitmask_ascii)-1,2,-2):
-        is_borrowed = int(bitmask_ascii[i])
-        is_col = int(bitmask_ascii[i-1])
+    for asset_index in range((bitmask.bit_length() + 1) // 2):
+        is_borrowed = (bitmask >> (2 * asset_index)) & 1
+        is_col = (bitmask >> (2 * asset_index + 1)) & 1
         S[asset_index] = (is_col, is_borrowed)
-        asset_index += 1
-
-    if i-1 == 3:
-        is_borrowed = int(bitmask_ascii[2])
-        S[asset_index] = (0, is_borrowed)
     return S
 
+'''even bits of the getUserConfiguration bitmask, bit 2k is borrowing of the reserve k'''
+BORROWING_MASK = int('01' * 128, 2)
+
+'''True if the user borrows any reserve'''
+def is_borrowing(bitmask):
+    return (int(bitmask) & BORROWING_MASK) != 0
+
+'''Decode getUserConfiguration bitmasks of many users at once,
+   bit 2k is borrowing, bit 2k+1 is using as collateral of the reserve k (getReservesList order)
+   The 256 bit masks are split into uint64 words, the bits are extracted by shifts over the words.
+   Returns (collateral, borrowed) - bool matrices of (users x n_reserves)
+'''
+def decode_user_config_bitmasks(bitmasks, n_reserves):
+    n_words = (2 * n_reserves + 63) // 64
+    shifts = np.arange(0, 64, dtype=np.uint64)
+    bits = np.zeros((len(bitmasks), n_words * 64), dtype=bool)
+    for j in range(n_words):
+        words = np.array([(int(m) >> (64 * j)) & 0xFFFFFFFFFFFFFFFF for m in bitmasks], dtype=np.uint64)
+        bits[:, 64 * j:64 * (j + 1)] = ((words[:, None] >> shifts) & np.uint64(1)).astype(bool)
+    borrowed = bits[:, 0:2 * n_reserves:2]
+    collateral = bits[:, 1:2 * n_reserves:2]
+    return collateral, borrowed
+
 
 
 def merge_with_default_bitmask(ascii_bitmsak):
@@ -78,24 +95,25 @@ def merge_with_default_bitmask(ascii_bitmsak):
    chapter 4.4
 '''
 def split_asset_config_bitmask(bitmask):
-    bitmask_ascii = str(bin(bitmask))
-    ltv = int(bitmask_ascii[-15:], 2) / 100.0  # maximum ltv of the asset
-    print(ltv)
-    print(bitmask_ascii)
-    bitmask_ascii = merge_with_default_bitmask(bitmask_ascii)
-    ltv = int(bitmask_ascii[-15:], 2) / 100.0 #maximum ltv of the asset
-    print(ltv)
-    liq_threshold = int(bitmask_ascii[-31:-16], 2) / 100.0
-    liq_bonus = int(bitmask_ascii[-47:-32], 2) / 100.0
-    decimals = int(bitmask_ascii[-55:-48], 2)
-    is_active = int(bitmask_ascii[-56], 2)
-    is_freezed = int(bitmask_ascii[-57], 2)
-    is_borrowing_enabled = int(bitmask_ascii[-58], 2)
-    stable_borrowing_enabled = int(bitmask_ascii[-59], 2)
-    reserved = int(bitmask_ascii[-64:-60], 2)
-    reserved_factor = int(bitmask_ascii[-80:-65], 2)
+    ltv, liq_threshold, liq_bonus, decimals = decode_asset_config_bitmask(bitmask)[:4]
     return ltv, liq_threshold, liq_bonus, decimals
 
+'''All fields of the reserve config bitmask by shifts and masks, see ReserveConfiguration.sol:
+   bit 0-15 ltv, 16-31 liquidation threshold, 32-47 liquidation bonus, 48-55 decimals,
+   56 active, 57 frozen, 58 borrowing enabled, 59 stable borrowing enabled, 64-79 reserve factor
+'''
+def decode_asset_config_bitmask(bitmask):
+    ltv = (bitmask & 0xFFFF) / 100.0  # maximum ltv of the asset
+    liq_threshold = ((bitmask >> 16) & 0xFFFF) / 100.0
+    liq_bonus = ((bitmask >> 32) & 0xFFFF) / 100.0
+    decimals = (bitmask >> 48) & 0xFF
+    is_active = (bitmask >> 56) & 1
+    is_freezed = (bitmask >> 57) & 1
+    is_borrowing_enabled = (bitmask >> 58) & 1
+    stable_borrowing_enabled = (bitmask >> 59) & 1
+    reserved_factor = ((bitmask >> 64) & 0xFFFF) / 100.0
+    return ltv, liq_threshold, liq_bonus, decimals, is_active, is_freezed, is_borrowing_enabled, \
+           stable_borrowing_enabled, reserved_factor
 
 
 def convert_addr_in_crypto_asset(addr):
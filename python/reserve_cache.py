@@ -0,0 +1,187 @@
+import os
+import pickle
+import numpy as np
+import pandas as pd
+import rpc_batch
+import web3_client
+import block_range
+import cache_manifest
+import event_decoder
+from config import CACHE_FOLDER
+from eth_utils import event_abi_to_log_topic
+from web3 import Web3
+from reserve_asset import convert_addr_in_crypto_asset
+from reserve_asset import decode_asset_config_bitmask
+
+'''Reserve configuration cache tagged by the block it was read at.
+   A refresh reads only the events after the cached block:
+   - LendingPool ReserveDataUpdated carries the new rates and indexes, they are applied from the event
+   - any LendingPoolConfigurator event (collateral config, reserve factor, borrowing, freeze, init ...)
+     of a reserve invalidates it, only the touched reserves are read again via getReserveData
+   Config bitmasks are decoded by shifts and masks (reserve_asset.decode_asset_config_bitmask).
+   Table columns are a superset of cache_events.wrapper_getReserveData frame.
+'''
+RESERVE_CACHE_FNAME = '{}/reserve_config_cache.bin'.format(CACHE_FOLDER)
+
+LENDING_POOL_CONFIGURATOR_ADDRESS = '0x311Bb771e4F8952E6Da169b425E7e92d6Ac45756'
+'''Configurator events of a reserve, asset is the first indexed argument of all of them'''
+LENDING_POOL_CONFIGURATOR_EVENTS = [
+    'ReserveInitialized(address,address,address,address,address)',
+    'BorrowingEnabledOnReserve(address,bool)',
+    'BorrowingDisabledOnReserve(address)',
+    'CollateralConfigurationChanged(address,uint256,uint256,uint256)',
+    'StableRateEnabledOnReserve(address)',
+    'StableRateDisabledOnReserve(address)',
+    'ReserveActivated(address)',
+    'ReserveDeactivated(address)',
+    'ReserveFrozen(address)',
+    'ReserveUnfrozen(address)',
+    'ReserveFactorChanged(address,uint256)',
+    'ReserveDecimalsChanged(address,uint256)',
+    'ReserveInterestRateStrategyChanged(address,address)',
+]
+
+RESERVE_TABLE_COLUMNS = ['name', 'addr', 'ltv', 'liq_threshold', 'liq_bonus', 'decimals', 'variable_rate',
+                         'stable_rate', 'liquidity_rate', 'liquidity_index', 'variable_borrow_index',
+                         'is_active', 'is_frozen', 'borrowing_enabled', 'stable_borrowing_enabled',
+                         'reserve_factor']
+
+_cache = None
+
+
+def get_configurator_topics():
+    return [Web3.toHex(Web3.keccak(text=signature)) for signature in LENDING_POOL_CONFIGURATOR_EVENTS]
+
+
+def make_reserve_row(asset_addr, ret):
+    ltv, liq_threshold, liq_bonus, decimals, is_active, is_frozen, borrowing_enabled, \
+        stable_borrowing_enabled, reserve_factor = decode_asset_config_bitmask(ret[0][0])
+    return {'name': convert_addr_in_crypto_asset(asset_addr), 'addr': asset_addr, 'ltv': ltv,
+            'liq_threshold': liq_threshold, 'liq_bonus': liq_bonus, 'decimals': decimals,
+            'variable_rate': ret[4] / 1e27, 'stable_rate': ret[5] / 1e27, 'liquidity_rate': ret[3] / 1e27,
+            'liquidity_index': ret[1] / 1e27, 'variable_borrow_index': ret[2] / 1e27,
+            'is_active': bool(is_active), 'is_frozen': bool(is_frozen),
+            'borrowing_enabled': bool(borrowing_enabled),
+            'stable_borrowing_enabled': bool(stable_borrowing_enabled), 'reserve_factor': reserve_factor}
+
+'''getReserveData of the reserves in a single JSON-RPC batch at the block'''
+def query_reserves(reserve_to_index, block):
+    contract = web3_client.get_lending_pool()
+    transport = rpc_batch.BatchTransport()
+    futures = [transport.eth_call(contract, 'getReserveData', [asset_addr], block_identifier=block)
+               for asset_addr in reserve_to_index]
+    return [make_reserve_row(asset_addr, ret) for asset_addr, ret in zip(reserve_to_index, transport.gather(futures))]
+
+
+class ReserveCache:
+    def __init__(self, block=None, reserves=None, table=None):
+        self.block = block
+        self.reserves = reserves if reserves is not None else []
+        self.table = table if table is not None else pd.DataFrame(columns=RESERVE_TABLE_COLUMNS)
+
+    @classmethod
+    def load(cls, fname=RESERVE_CACHE_FNAME):
+        if not os.path.exists(fname):
+            return cls()
+        S = pickle.load(open(fname, 'rb'))
+        return cls(S['block'], S['reserves'], S['table'])
+
+    def save(self, fname=RESERVE_CACHE_FNAME):
+        S = {'block': self.block, 'reserves': self.reserves, 'table': self.table}
+        cache_manifest.dump_pickle(S, fname)
+
+    def query_all(self, block):
+        contract = web3_client.get_lending_pool()
+        self.reserves = list(contract.functions.getReservesList().call(block_identifier=block))
+        self.table = pd.DataFrame(query_reserves(self.reserves, block), columns=RESERVE_TABLE_COLUMNS)
+        self.block = block
+
+    '''Configurator events after the cached block, Returns set of touched reserves'''
+    def query_configurator_events(self, from_block, to_block):
+        planner = block_range.BlockRangePlanner(key='{}:configurator'.format(LENDING_POOL_CONFIGURATOR_ADDRESS))
+        w3 = web3_client.get_web3()
+        topics = get_configurator_topics()
+
+        def fetch_logs(b1, b2):
+            return w3.eth.getLogs({'address': LENDING_POOL_CONFIGURATOR_ADDRESS, 'topics': [topics],
+                                   'fromBlock': b1, 'toBlock': b2})
+
+        touched = set()
+        for _, _, logs in planner.iter_ranges(fetch_logs, from_block, to_block):
+            for entry in logs:
+                touched.add(event_decoder.checksum_address('0x' + bytes(entry['topics'][1])[12:].hex()))
+        return touched
+
+    '''Apply the latest ReserveDataUpdated event of every reserve after the cached block'''
+    def apply_reserve_data_updated(self, from_block, to_block):
+        contract = web3_client.get_lending_pool()
+        event = contract.events.ReserveDataUpdated
+        abi = event._get_event_abi()
+        topic0 = Web3.toHex(event_abi_to_log_topic(abi))
+        planner = block_range.get_planner(event)
+
+        def fetch_logs(b1, b2):
+            return event.web3.eth.getLogs({'address': contract.address, 'topics': [topic0],
+                                           'fromBlock': b1, 'toBlock': b2})
+
+        decoder = event_decoder.get_decoder(abi)
+        table = self.table.set_index('addr', drop=False)
+        for _, _, logs in planner.iter_ranges(fetch_logs, from_block, to_block):
+            if len(logs) == 0:
+                continue
+            columns = decoder.decode(logs)
+            df = pd.DataFrame({'reserve': columns['reserve'],
+                               'liquidity_rate': columns['liquidityRate'],
+                               'stable_rate': columns['stableBorrowRate'],
+                               'variable_rate': columns['variableBorrowRate'],
+                               'liquidity_index': columns['liquidityIndex'],
+                               'variable_borrow_index': columns['variableBorrowIndex']})
+            '''logs are in block order, keep the latest of every reserve'''
+            df = df.drop_duplicates('reserve', keep='last').set_index('reserve')
+            df = df[df.index.isin(table.index)]
+            for column in ['liquidity_rate', 'stable_rate', 'variable_rate', 'liquidity_index',
+                           'variable_borrow_index']:
+                table.loc[df.index, column] = np.array([int(v) for v in df[column]], dtype=np.float64) / 1e27
+        self.table = table.reset_index(drop=True)
+
+    '''Bring the cache to to_block, full read if cache is empty'''
+    def refresh(self, to_block='latest'):
+        to_block = block_range.resolve_block(to_block)
+        if self.block is None or len(self.table) == 0:
+            self.query_all(to_block)
+            return self
+        if to_block <= self.block:
+            return self
+
+        from_block = self.block + 1
+        touched = self.query_configurator_events(from_block, to_block)
+        contract = web3_client.get_lending_pool()
+        reserves = list(contract.functions.getReservesList().call(block_identifier=to_block))
+        '''new reserves, i.e. initialized by configurator'''
+        touched = touched.union(set(reserves).difference(self.reserves))
+        if len(touched) > 0:
+            print('Reserves invalidated by configurator events: {}'.format(len(touched)))
+
+        self.apply_reserve_data_updated(from_block, to_block)
+        if len(touched) > 0:
+            rows = {row['addr']: row for row in query_reserves([addr for addr in reserves if addr in touched], to_block)}
+            old_rows = {row['addr']: row for row in self.table.to_dict('records')}
+            old_rows.update(rows)
+            self.table = pd.DataFrame([old_rows[addr] for addr in reserves], columns=RESERVE_TABLE_COLUMNS)
+        self.reserves = reserves
+        self.block = to_block
+        return self
+
+'''Reserves list and reserve table, the process-wide cache is refreshed to the latest block
+   @refresh - False returns the cached table as is (no RPC if it was loaded before)
+'''
+def get_reserves(refresh=True, to_block='latest'):
+    global _cache
+    if _cache is None:
+        _cache = ReserveCache.load()
+    if refresh or _cache.block is None:
+        block = _cache.block
+        _cache.refresh(to_block)
+        if _cache.block != block:
+            _cache.save()
+    return _cache.reserves, _cache.table
@@ -0,0 +1,140 @@
+import itertools
+import requests
+import config
+import web3_client
+from web3 import Web3
+from web3._utils.abi import get_abi_output_types
+from web3._utils.method_formatters import log_entry_formatter
+from web3._utils.method_formatters import receipt_formatter
+from web3._utils.method_formatters import block_formatter
+
+'''JSON-RPC batch transport, independent calls are submitted as futures and sent
+   to the node as JSON-RPC batch arrays of up to max_batch_size calls, see:
+   https://www.jsonrpc.org/specification#batch
+'''
+
+class RpcError(Exception):
+    def __init__(self, error):
+        self.code = error.get('code')
+        self.message = error.get('message')
+        super().__init__('RPC error {}: {}'.format(self.code, self.message))
+
+
+class RpcFuture:
+    def __init__(self, transport, formatter=None):
+        self.transport = transport
+        self.formatter = formatter
+        self._done = False
+        self._result = None
+        self._error = None
+
+    def set_result(self, result):
+        self._result = result
+        self._done = True
+
+    def set_error(self, error):
+        self._error = error
+        self._done = True
+
+    def done(self):
+        return self._done
+
+    '''Flush the pending calls if needed, raise RpcError if this call failed'''
+    def result(self):
+        if not self._done:
+            self.transport.flush()
+        if self._error is not None:
+            raise self._error
+        if self.formatter is not None and self._result is not None:
+            return self.formatter(self._result)
+        return self._result
+
+
+def to_block_param(block):
+    if isinstance(block, int):
+        return hex(block)
+    return block
+
+
+class BatchTransport:
+    def __init__(self, endpoint=config.Infura_EndPoint, max_batch_size=config.RPC_MAX_BATCH_SIZE, session=None):
+        self.endpoint = endpoint
+        self.max_batch_size = max_batch_size
+        self.session = session if session is not None else web3_client.get_session(endpoint)
+        self.ids = itertools.count()
+        self.pending = []
+
+    def submit(self, method, params, formatter=None):
+        future = RpcFuture(self, formatter)
+        self.pending.append(({'jsonrpc': '2.0', 'id': next(self.ids), 'method': method, 'params': params}, future))
+        return future
+
+    '''Send all pending calls, an error inside a batch fails only the corresponding future'''
+    def flush(self):
+        pending, self.pending = self.pending, []
+        for i in range(0, len(pending), self.max_batch_size):
+            chunk = pending[i:i + self.max_batch_size]
+            futures = {request['id']: future for request, future in chunk}
+            try:
+                response = self.session.post(self.endpoint, json=[request for request, _ in chunk],
+                                             timeout=config.RPC_TIMEOUT)
+                response.raise_for_status()
+                replies = response.json()
+            except (requests.RequestException, ValueError) as e:
+                for future in futures.values():
+                    future.set_error(e)
+                continue
+
+            '''node returns single error object when the whole batch is rejected'''
+            if isinstance(replies, dict):
+                replies = [dict(replies, id=request_id) for request_id in futures.keys()]
+
+            for reply in replies:
+                future = futures.pop(reply.get('id'), None)
+                if future is None:
+                    continue
+                if 'error' in reply:
+                    future.set_error(RpcError(reply['error']))
+                else:
+                    future.set_result(reply.get('result'))
+
+            for future in futures.values():
+                future.set_error(RpcError({'code': None, 'message': 'missing reply in batch'}))
+
+    def gather(self, futures):
+        self.flush()
+        return [f.result() for f in futures]
+
+    '''Call contract function, the future returns the decoded outputs(unwrapped if single)'''
+    def eth_call(self, contract, fn_name, args=None, block_identifier='latest'):
+        fn_abi = contract.get_function_by_name(fn_name).abi
+        output_types = get_abi_output_types(fn_abi)
+        codec = contract.web3.codec
+        call_data = contract.encodeABI(fn_name=fn_name, args=args if args is not None else [])
+
+        def decode(result):
+            ret = codec.decode_abi(output_types, Web3.toBytes(hexstr=result))
+            return ret[0] if len(ret) == 1 else ret
+
+        return self.submit('eth_call', [{'to': contract.address, 'data': call_data},
+                                        to_block_param(block_identifier)], formatter=decode)
+
+    def eth_getLogs(self, filter_params):
+        params = dict(filter_params)
+        for key in ('fromBlock', 'toBlock'):
+            if key in params:
+                params[key] = to_block_param(params[key])
+        return self.submit('eth_getLogs', [params], formatter=lambda logs: [log_entry_formatter(l) for l in logs])
+
+    def eth_getTransactionReceipt(self, tx_hash):
+        if not isinstance(tx_hash, str):
+            tx_hash = Web3.toHex(tx_hash)
+        return self.submit('eth_getTransactionReceipt', [tx_hash], formatter=receipt_formatter)
+
+    def eth_getBlockByNumber(self, block, full_transactions=False):
+        return self.submit('eth_getBlockByNumber', [to_block_param(block), full_transactions], formatter=block_formatter)
+
+    '''All receipts of the block in one call (eth_getBlockReceipts, not supported by every node)'''
+    def eth_getBlockReceipts(self, block):
+        return self.submit('eth_getBlockReceipts', [to_block_param(block)],
+                           formatter=lambda receipts: [receipt_formatter(r) for r in receipts])
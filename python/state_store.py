@@ -0,0 +1,169 @@
+import sqlite3
+import contextlib
+import datetime
+import numpy as np
+import pandas as pd
+from config import CACHE_FOLDER
+
+'''Transactional local state store of the account snapshots (SQLite in WAL mode).
+   accounts - current state per user: getUserAccountData fields, getUserConfiguration bitmask and the
+              blocks they were verified at, indexed by user, health factor and verified block
+   deltas   - history, a row only when col, debt, liquidation threshold or the bitmask of a user changes
+   meta     - block of the events the latest snapshot is based on and time of the latest write
+   Every write is a single transaction (upsert of a batch), WAL lets readers run while a writer updates.
+   bitmasks are uint256, stored as str.
+'''
+STATE_STORE_FNAME = '{}/state.sqlite'.format(CACHE_FOLDER)
+
+ACCOUNT_COLUMNS = ['col', 'debt', 'available', 'liquidation_threshold', 'ltv', 'healthFactor', 'user',
+                   'verified_block']
+CONFIG_COLUMNS = ['user', 'bitmask', 'verified_block']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS accounts (
+    user TEXT PRIMARY KEY,
+    col REAL, debt REAL, available REAL, liquidation_threshold REAL, ltv REAL, healthFactor REAL,
+    verified_block INTEGER,
+    bitmask TEXT,
+    config_block INTEGER
+);
+CREATE INDEX IF NOT EXISTS accounts_health_factor ON accounts (healthFactor);
+CREATE INDEX IF NOT EXISTS accounts_verified_block ON accounts (verified_block);
+CREATE TABLE IF NOT EXISTS deltas (
+    user TEXT, block INTEGER,
+    col REAL, debt REAL, liquidation_threshold REAL, healthFactor REAL, bitmask TEXT
+);
+CREATE INDEX IF NOT EXISTS deltas_user_block ON deltas (user, block);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+'''
+
+'''Writers wait for the lock up to BUSY_TIMEOUT seconds'''
+BUSY_TIMEOUT = 60
+
+
+def connect(fname=STATE_STORE_FNAME):
+    conn = sqlite3.connect(fname, timeout=BUSY_TIMEOUT)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def set_meta(conn, **kwargs):
+    conn.executemany('INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value',
+                     [(key, str(value)) for key, value in kwargs.items()])
+
+
+def get_meta(fname=STATE_STORE_FNAME):
+    with contextlib.closing(connect(fname)) as conn:
+        return dict(conn.execute('SELECT key, value FROM meta').fetchall())
+
+'''Upsert a getUserAccountData frame (cache_events.ACCOUNT_DATA_SCHEMA) in one transaction,
+   deltas are recorded for new users and users with changed position
+   @last_cached_block - block of the events the user list is based on
+'''
+def upsert_accounts(df, last_cached_block=None, fname=STATE_STORE_FNAME):
+    if len(df) == 0:
+        return
+    rows = list(zip(df.user, df.col.astype(float), df.debt.astype(float), df.available.astype(float),
+                    df.liquidation_threshold.astype(float), df.ltv.astype(float), df.healthFactor.astype(float),
+                    df.verified_block.astype(int)))
+    with contextlib.closing(connect(fname)) as conn:
+        with conn:
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS incoming (user TEXT PRIMARY KEY, col REAL, debt REAL, '
+                         'available REAL, liquidation_threshold REAL, ltv REAL, healthFactor REAL, verified_block INTEGER)')
+            conn.execute('DELETE FROM incoming')
+            conn.executemany('INSERT OR REPLACE INTO incoming VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            conn.execute('''INSERT INTO deltas (user, block, col, debt, liquidation_threshold, healthFactor, bitmask)
+                            SELECT i.user, i.verified_block, i.col, i.debt, i.liquidation_threshold, i.healthFactor, a.bitmask
+                            FROM incoming i LEFT JOIN accounts a ON a.user = i.user
+                            WHERE a.user IS NULL OR a.col IS NOT i.col OR a.debt IS NOT i.debt
+                                  OR a.liquidation_threshold IS NOT i.liquidation_threshold''')
+            conn.execute('''INSERT INTO accounts (user, col, debt, available, liquidation_threshold, ltv, healthFactor,
+                                                  verified_block)
+                            SELECT * FROM incoming WHERE true
+                            ON CONFLICT(user) DO UPDATE SET col=excluded.col, debt=excluded.debt,
+                                available=excluded.available, liquidation_threshold=excluded.liquidation_threshold,
+                                ltv=excluded.ltv, healthFactor=excluded.healthFactor,
+                                verified_block=excluded.verified_block''')
+            meta = {'updated_at': datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}
+            if last_cached_block is not None:
+                meta['last_cached_block'] = last_cached_block
+            set_meta(conn, **meta)
+
+'''Upsert a getUserConfiguration frame (cache_events.USER_CONFIG_SCHEMA) in one transaction,
+   deltas are recorded for users with changed bitmask
+'''
+def upsert_user_configuration(df, fname=STATE_STORE_FNAME):
+    if len(df) == 0:
+        return
+    rows = list(zip(df.user, df.bitmask.astype(str), df.verified_block.astype(int)))
+    with contextlib.closing(connect(fname)) as conn:
+        with conn:
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS incoming_config (user TEXT PRIMARY KEY, bitmask TEXT, '
+                         'config_block INTEGER)')
+            conn.execute('DELETE FROM incoming_config')
+            conn.executemany('INSERT OR REPLACE INTO incoming_config VALUES (?, ?, ?)', rows)
+            conn.execute('''INSERT INTO deltas (user, block, col, debt, liquidation_threshold, healthFactor, bitmask)
+                            SELECT i.user, i.config_block, a.col, a.debt, a.liquidation_threshold, a.healthFactor, i.bitmask
+                            FROM incoming_config i LEFT JOIN accounts a ON a.user = i.user
+                            WHERE a.user IS NULL OR a.bitmask IS NOT i.bitmask''')
+            conn.execute('''INSERT INTO accounts (user, bitmask, config_block)
+                            SELECT * FROM incoming_config WHERE true
+                            ON CONFLICT(user) DO UPDATE SET bitmask=excluded.bitmask,
+                                config_block=excluded.config_block''')
+
+'''Current account data (ACCOUNT_COLUMNS) of the users
+   @users - list of users, all users if None
+   @hf_min, @hf_max - health factor range [hf_min, hf_max), no bound if None
+   @alive - only accounts with collateral and debt
+   @verified_from - only accounts verified at or after the block
+'''
+def load_accounts(users=None, hf_min=None, hf_max=None, alive=False, verified_from=None, fname=STATE_STORE_FNAME):
+    where = ['verified_block IS NOT NULL']
+    params = []
+    if verified_from is not None:
+        where.append('verified_block >= ?')
+        params.append(int(verified_from))
+    if hf_min is not None:
+        where.append('healthFactor >= ?')
+        params.append(hf_min)
+    if hf_max is not None:
+        where.append('healthFactor < ?')
+        params.append(hf_max)
+    if alive:
+        where.append('col > 0 AND debt > 0')
+    query = 'SELECT {} FROM accounts WHERE {}'.format(', '.join(ACCOUNT_COLUMNS), ' AND '.join(where))
+    with contextlib.closing(connect(fname)) as conn:
+        if users is None:
+            df = pd.read_sql_query(query, conn, params=params)
+        else:
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS wanted (user TEXT PRIMARY KEY)')
+            conn.execute('DELETE FROM wanted')
+            conn.executemany('INSERT OR IGNORE INTO wanted VALUES (?)', [(user,) for user in users])
+            df = pd.read_sql_query(query + ' AND user IN (SELECT user FROM wanted)', conn, params=params)
+    df['verified_block'] = df.verified_block.astype(np.int64)
+    return df
+
+'''Current getUserConfiguration of the users (CONFIG_COLUMNS, bitmask as int), all users if None'''
+def load_user_configuration(users=None, fname=STATE_STORE_FNAME):
+    with contextlib.closing(connect(fname)) as conn:
+        df = pd.read_sql_query('SELECT user, bitmask, config_block AS verified_block FROM accounts '
+                               'WHERE bitmask IS NOT NULL', conn)
+    if users is not None:
+        df = df[df.user.isin(users)].reset_index(drop=True)
+    df['bitmask'] = df.bitmask.map(int)
+    return df
+
+'''Number of users with account data, @verified_from - only accounts verified at or after the block'''
+def count_accounts(verified_from=None, fname=STATE_STORE_FNAME):
+    with contextlib.closing(connect(fname)) as conn:
+        if verified_from is not None:
+            return conn.execute('SELECT COUNT(*) FROM accounts WHERE verified_block >= ?',
+                                (int(verified_from),)).fetchone()[0]
+        return conn.execute('SELECT COUNT(*) FROM accounts WHERE verified_block IS NOT NULL').fetchone()[0]
+
+'''Recorded changes of the user position sorted by block'''
+def load_history(user, fname=STATE_STORE_FNAME):
+    with contextlib.closing(connect(fname)) as conn:
+        return pd.read_sql_query('SELECT * FROM deltas WHERE user = ? ORDER BY block, rowid', conn, params=[user])
@@ -0,0 +1,41 @@
+import os
+import sys
+import tempfile
+import numpy as np
+import pytest
+
+'''Tests run from python/ (config reads ../abi relative to it) with the cache folder in a temporary
+   folder of the session, config is patched before any module builds its file names from CACHE_FOLDER.
+'''
+PYTHON_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(PYTHON_FOLDER)
+if PYTHON_FOLDER not in sys.path:
+    sys.path.insert(0, PYTHON_FOLDER)
+
+import config
+config.CACHE_FOLDER = tempfile.mkdtemp(prefix='liquidator_cache_')
+
+
+'''Random health_engine.HealthFactorEngine of n_users x n_reserves with balances and prices set directly (no RPC),
+   about half of the balances are zero
+'''
+def random_engine(rng, n_users=200, n_reserves=5):
+    health_engine = pytest.importorskip('health_engine')
+    reserves = ['0x{:040x}'.format(k + 1) for k in range(n_reserves)]
+    engine = health_engine.HealthFactorEngine(reserves, rng.uniform(50, 90, n_reserves), np.full(n_reserves, 18))
+    users = ['0x{:040x}'.format(0x1000 + i) for i in range(n_users)]
+    collateral = rng.uniform(0, 10, (n_users, n_reserves)) * (rng.rand(n_users, n_reserves) < 0.5)
+    debt = rng.uniform(0, 10, (n_users, n_reserves)) * (rng.rand(n_users, n_reserves) < 0.4)
+    engine.set_balances(users, collateral, debt)
+    engine.set_prices(rng.uniform(0.5, 2.0, n_reserves))
+    return engine
+
+
+@pytest.fixture
+def rng():
+    return np.random.RandomState(7)
+
+
+@pytest.fixture
+def engine(rng):
+    return random_engine(rng)
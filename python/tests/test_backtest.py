@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('web3')
+import backtest
+
+
+def make_backtest_frame():
+    return pd.DataFrame({'block_number': [10, 11, 12, 13],
+                         'transaction_hash': ['0x01', '0x02', '0x03', '0x04'],
+                         'liquidator': ['0xa', '0xb', '0xa', '0xa'],
+                         'user': ['0x1', '0x2', '0x3', '0x4'],
+                         'collateralAsset': ['0xc'] * 4,
+                         'debtAsset': ['0xd'] * 4,
+                         'collected_eth': [1.1, 2.2, 0.5, 3.3],
+                         'paid_eth': [1.0, 2.0, 0.6, 3.0],
+                         'gas_payed': [0.01, 0.02, 0.01, 0.05],
+                         'profit': [0.1, 0.2, -0.1, 0.3],
+                         'reward': [0.09, 0.18, -0.11, 0.25],
+                         'blocks_from_oracle_update': [1.0, 3.0, 2.0, 7.0]},
+                        columns=backtest.BACKTEST_COLUMNS)
+
+
+def test_summary():
+    s = backtest.summary(make_backtest_frame())
+    assert s.liquidations == 4
+    assert s.profit == pytest.approx(0.5)
+    assert s.gas_payed == pytest.approx(0.09)
+    assert s.reward == pytest.approx(0.41)
+    assert s.profitable == pytest.approx(0.75)
+    assert s.median_blocks_from_oracle_update == pytest.approx(2.5)
+
+
+def test_leaderboard():
+    board = backtest.leaderboard(make_backtest_frame())
+    assert list(board.columns) == ['liquidations', 'reward', 'profit', 'gas_payed', 'median_blocks_from_oracle_update']
+    assert list(board.index) == ['0xa', '0xb']
+    assert list(board.liquidations) == [3, 1]
+    assert np.allclose(board.reward.values, [0.23, 0.18])
+    assert np.allclose(board.profit.values, [0.3, 0.2])
+    assert np.allclose(board.gas_payed.values, [0.07, 0.02])
+    assert list(board.median_blocks_from_oracle_update) == [2.0, 3.0]
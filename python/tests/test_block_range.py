@@ -0,0 +1,49 @@
+import pytest
+
+pytest.importorskip('web3')
+import block_range
+
+
+def test_is_too_many_results():
+    for message in ['query returned more than 10000 results', 'Log response size exceeded.',
+                    'exceed maximum block range: 5000', 'block range is too wide']:
+        assert block_range.is_too_many_results(ValueError({'code': -32005, 'message': message}))
+    for message in ['daily request count exceeded, request rate limited', 'project ID request rate exceeded',
+                    'Too Many Requests', 'limit exceeded', 'execution reverted']:
+        assert not block_range.is_too_many_results(ValueError({'code': -32005, 'message': message}))
+
+
+'''fetch_logs of one log per block, windows wider than max_blocks fail as too many results'''
+def make_fetch_logs(max_blocks, calls):
+    def fetch_logs(b1, b2):
+        calls.append((b1, b2))
+        if b2 - b1 + 1 > max_blocks:
+            raise ValueError({'code': -32005, 'message': 'query returned more than 10000 results'})
+        return list(range(b1, b2 + 1))
+    return fetch_logs
+
+
+def test_iter_ranges_covers_range_and_splits():
+    calls = []
+    planner = block_range.BlockRangePlanner(key='test_split', target_results=100, max_window=1000)
+    ranges = list(planner.iter_ranges(make_fetch_logs(40, calls), 1000, 1999))
+    '''windows are contiguous and cover the range once'''
+    assert ranges[0][0] == 1000 and ranges[-1][1] == 1999
+    for (_, b2, _), (b1, _, _) in zip(ranges[:-1], ranges[1:]):
+        assert b1 == b2 + 1
+    assert sum(len(logs) for _, _, logs in ranges) == 1000
+    assert all(b2 - b1 + 1 <= 40 for b1, b2, _ in ranges)
+    assert any(b2 - b1 + 1 > 40 for b1, b2 in calls)
+
+    '''the observed density is kept for the next run'''
+    assert block_range.load_densities()['test_split'] == pytest.approx(planner.density)
+    next_planner = block_range.BlockRangePlanner(key='test_split', target_results=100, max_window=1000)
+    assert next_planner.initial_window() == next_planner.clamp(100 / planner.density)
+
+
+def test_iter_ranges_raises_other_errors():
+    def fetch_logs(b1, b2):
+        raise ValueError({'code': -32005, 'message': 'daily request count exceeded, request rate limited'})
+    planner = block_range.BlockRangePlanner(key='test_rate_limited')
+    with pytest.raises(ValueError):
+        list(planner.iter_ranges(fetch_logs, 0, 100))
@@ -0,0 +1,75 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip('web3')
+import event_store
+import cache_events
+from test_event_store import make_events
+
+
+def make_headers(blocks, tag='a'):
+    return pd.DataFrame({'block_number': list(blocks),
+                         'block_hash': ['0x{}{}'.format(tag, b) for b in blocks],
+                         'parent_hash': ['0x{}{}'.format(tag, b - 1) for b in blocks]},
+                        columns=event_store.BLOCK_COLUMNS)
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    folder = str(tmp_path / 'events')
+    monkeypatch.setattr(event_store, 'EVENT_STORE_FOLDER', folder)
+    monkeypatch.setattr(event_store, 'MANIFEST_FNAME', '{}/manifest.json'.format(folder))
+    monkeypatch.setattr(event_store, 'UNCONFIRMED_FNAME', '{}/unconfirmed.bin'.format(folder))
+    return folder
+
+
+@pytest.fixture
+def canonical(monkeypatch):
+    '''canonical chain served by query_block_headers, hashes tagged by fork'''
+    chain = {'tag': 'a'}
+    monkeypatch.setattr(cache_events, 'query_block_headers', lambda blocks: make_headers(blocks, chain['tag']))
+    return chain
+
+
+def test_rollback_keeps_valid_tier(canonical):
+    event_store.append_events({'Borrow': make_events([1])}, 0, 9, block_hash='0xa9')
+    tier = {'blocks': make_headers([10, 11]), 'events': {'Borrow': make_events([11])}}
+    assert cache_events.rollback_unconfirmed(tier) is tier
+
+
+def test_rollback_of_reorged_tier_blocks(canonical):
+    event_store.append_events({'Borrow': make_events([1])}, 0, 9, block_hash='0xa9')
+    blocks = pd.concat([make_headers([10]), make_headers([11], 'b')], ignore_index=True)
+    tier = cache_events.rollback_unconfirmed({'blocks': blocks, 'events': {'Borrow': make_events([10, 11])}})
+    assert list(tier['blocks'].block_number) == [10]
+    assert list(tier['events']['Borrow'].block_number) == [10]
+
+
+@pytest.mark.parametrize('tier_blocks', [[], [10, 11]])
+def test_deep_reorg_truncates_confirmed_events(canonical, monkeypatch, tier_blocks):
+    monkeypatch.setattr(cache_events.config, 'DEEP_REORG_REFETCH_BLOCKS', 5)
+    event_store.append_events({'Borrow': make_events([1, 5, 8])}, 0, 9, block_hash='0xa9')
+    tier = {'blocks': make_headers(tier_blocks), 'events': {'Borrow': make_events(tier_blocks)}}
+    canonical['tag'] = 'b'
+    tier = cache_events.rollback_unconfirmed(tier)
+    assert len(tier['blocks']) == 0 and len(tier['events']['Borrow']) == 0
+    assert event_store.get_last_block() == 4
+    assert list(event_store.read_events('Borrow').block_number) == [1]
+
+
+def test_query_user_configuration_and_cache(monkeypatch):
+    users = ['0x{:040x}'.format(0x7000 + i) for i in range(4)]
+    bitmasks = {user: 1 << i for i, user in enumerate(users)}
+
+    def batch_getUserConfigurationBitmask(user_address):
+        return pd.DataFrame({'user': list(user_address), 'bitmask': [bitmasks[user] for user in user_address],
+                             'verified_block': 10}, columns=['user', 'bitmask', 'verified_block'])
+
+    monkeypatch.setattr(cache_events, 'batch_getUserConfigurationBitmask', batch_getUserConfigurationBitmask)
+    '''first snapshot is only recorded'''
+    assert cache_events.query_user_configuration_and_cache(users[:3]) == []
+    bitmasks[users[1]] = 3 << 100
+    assert sorted(cache_events.query_user_configuration_and_cache(users)) == [users[1]]
+    assert cache_events.query_user_configuration_and_cache(users) == []
+    stored = cache_events.load_latest_user_configuration_from_cache().set_index('user').bitmask
+    assert stored[users[1]] == 3 << 100 and stored[users[3]] == 1 << 3
@@ -0,0 +1,54 @@
+import os
+import json
+import multiprocessing
+import pytest
+import config
+import cache_manifest
+
+
+def test_atomic_path_keeps_old_file_on_failure(tmp_path):
+    fname = str(tmp_path / 'data.json')
+    cache_manifest.dump_json({'version': 1}, fname)
+    with pytest.raises(RuntimeError):
+        with cache_manifest.atomic_path(fname) as tmp_fname:
+            with open(tmp_fname, 'w') as f:
+                f.write('{"version": ')
+            raise RuntimeError('crash while writing')
+    assert json.load(open(fname)) == {'version': 1}
+    assert os.listdir(str(tmp_path)) == ['data.json']
+
+
+def test_record_and_verify():
+    fname = '{}/test_record/artifact.bin'.format(config.CACHE_FOLDER)
+    cache_manifest.dump_pickle({'a': 1}, fname)
+    latest = cache_manifest.record('test_record_and_verify', fname, last_block=100, version='v1')
+    assert latest['sha256'] == cache_manifest.checksum(fname)
+    assert cache_manifest.get_last_block('test_record_and_verify') == 100
+    assert cache_manifest.get_latest('test_record_and_verify')['version'] == 'v1'
+    assert cache_manifest.get_latest('test_record_and_verify')['fname'] == fname
+
+    with open(fname, 'ab') as f:
+        f.write(b'corrupted')
+    assert cache_manifest.get_latest('test_record_and_verify') is None
+    assert cache_manifest.get_latest('test_record_and_verify', check=False) is not None
+    assert cache_manifest.get_latest('no_such_dataset') is None
+
+    cache_manifest.set_last_block('test_record_and_verify', 120)
+    assert cache_manifest.get_last_block('test_record_and_verify') == 120
+
+
+def increment(fname):
+    for _ in range(20):
+        with cache_manifest.file_lock(fname):
+            n = json.load(open(fname))['n'] if os.path.exists(fname) else 0
+            cache_manifest.dump_json({'n': n + 1}, fname)
+
+
+def test_file_lock_serializes_processes(tmp_path):
+    fname = str(tmp_path / 'counter.json')
+    processes = [multiprocessing.Process(target=increment, args=(fname,)) for _ in range(4)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+    assert json.load(open(fname))['n'] == 80
@@ -0,0 +1,82 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import event_store
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    folder = str(tmp_path / 'events')
+    monkeypatch.setattr(event_store, 'EVENT_STORE_FOLDER', folder)
+    monkeypatch.setattr(event_store, 'MANIFEST_FNAME', '{}/manifest.json'.format(folder))
+    monkeypatch.setattr(event_store, 'UNCONFIRMED_FNAME', '{}/unconfirmed.bin'.format(folder))
+    return folder
+
+
+def make_events(blocks, user='0x{:040x}'.format(1)):
+    n = len(blocks)
+    return pd.DataFrame({'block_number': np.asarray(blocks, dtype=np.int64),
+                         'log_index': np.zeros(n, dtype=np.int64),
+                         'user': [user] * n,
+                         'amount': [10 ** 30 + b for b in blocks]})
+
+
+def test_append_and_read_ranges():
+    event_store.append_events({'Borrow': make_events([1, 5]), 'Repay': None}, 0, 9, block_hash='0x01')
+    event_store.append_events({'Borrow': make_events([12, 19]), 'Repay': make_events([15])}, 10, 19)
+    assert event_store.get_last_block() == 19
+    assert event_store.get_last_block('Repay') == 19
+    assert event_store.get_last_block('Deposit') is None
+    assert event_store.list_events() == ['Borrow', 'Repay']
+
+    df = event_store.read_events('Borrow')
+    assert list(df.block_number) == [1, 5, 12, 19]
+    '''uint256 values are exact after the round trip'''
+    assert df.amount.iloc[3] == 10 ** 30 + 19
+    assert list(event_store.read_events('Borrow', from_block=5, to_block=12).block_number) == [5, 12]
+    assert list(event_store.read_events('Borrow', columns=['user'], from_block=13).columns) == ['user']
+    assert len(event_store.read_events('Deposit')) == 0
+
+
+def test_unconfirmed_tier_is_merged_on_read():
+    event_store.append_events({'Borrow': make_events([1])}, 0, 9)
+    blocks = pd.DataFrame({'block_number': [10, 11], 'block_hash': ['0x0a', '0x0b'], 'parent_hash': ['0x09', '0x0a']},
+                          columns=event_store.BLOCK_COLUMNS)
+    event_store.save_unconfirmed({'blocks': blocks, 'events': {'Borrow': make_events([11])}})
+    assert event_store.get_head_block() == 11
+    assert list(event_store.read_events('Borrow').block_number) == [1, 11]
+    assert list(event_store.read_events('Borrow', unconfirmed=False).block_number) == [1]
+    assert list(event_store.read_events('Borrow', from_block=10).block_number) == [11]
+
+
+def test_verify_and_rewrite_partition(store):
+    event_store.append_events({'Borrow': make_events([1, 2])}, 0, 9)
+    event_store.append_events({'Borrow': make_events([15])}, 10, 19)
+    assert event_store.verify_partitions() == []
+    with open('{}/Borrow/0_9.h5'.format(store), 'ab') as f:
+        f.write(b'corrupted')
+    assert event_store.verify_partitions() == [('Borrow', 0, 9, '0_9.h5')]
+
+    event_store.rewrite_partition('Borrow', make_events([1, 2, 3]), 0, 9)
+    assert event_store.verify_partitions() == []
+    assert list(event_store.read_events('Borrow').block_number) == [1, 2, 3, 15]
+    event_store.rewrite_partition('Borrow', None, 10, 19)
+    assert list(event_store.read_events('Borrow').block_number) == [1, 2, 3]
+
+
+def test_truncate_events(store):
+    event_store.append_events({'Borrow': make_events([1, 5]), 'Repay': make_events([8])}, 0, 9)
+    event_store.append_events({'Borrow': make_events([12, 19]), 'Repay': None}, 10, 19, block_hash='0x13')
+    event_store.truncate_events(6)
+    assert event_store.get_last_block() == 5
+    assert event_store.get_last_block('Borrow') == 5 and event_store.get_last_block('Repay') == 5
+    assert event_store.load_manifest()['last_block_hash'] is None
+    assert list(event_store.read_events('Borrow').block_number) == [1, 5]
+    assert event_store.read_events('Borrow').amount.iloc[1] == 10 ** 30 + 5
+    assert len(event_store.read_events('Repay')) == 0
+    assert event_store.verify_partitions() == []
+    assert sorted(os.listdir('{}/Borrow'.format(store))) == ['0_5.h5']
+    '''ingestion resumes after the truncated block'''
+    event_store.append_events({'Borrow': make_events([7]), 'Repay': None}, 6, 9)
+    assert list(event_store.read_events('Borrow').block_number) == [1, 5, 7]
@@ -0,0 +1,63 @@
+import pytest
+
+pytest.importorskip('web3')
+from web3 import Web3
+import chainlink
+import multicall
+import feed_registry
+
+QUOTE = Web3.toChecksumAddress('0x{:040x}'.format(0xe))
+AGGREGATOR = Web3.toChecksumAddress('0x{:040x}'.format(0xa99))
+ZERO_ADDRESS = '0x' + '0' * 40
+
+
+def to_asset(i):
+    return Web3.toChecksumAddress('0x{:040x}'.format(i))
+
+
+'''getFeed results of (base, quote): aggregator, zero address, 'revert' or 'failed' (aggregate call failed)'''
+GET_FEED = {(to_asset(1), QUOTE): AGGREGATOR,
+            (QUOTE, to_asset(2)): AGGREGATOR,
+            (to_asset(3), QUOTE): ZERO_ADDRESS,
+            (to_asset(4), QUOTE): 'failed'}
+
+
+@pytest.fixture
+def contract(monkeypatch):
+    contract = Web3().eth.contract(address=chainlink.CHAIN_LINK_FEED_REG_ADDR, abi=chainlink.CHAIN_LINK_FEED_REG_ABI)
+    codec = contract.web3.codec
+
+    def try_aggregate(calls, batch_size=None, block_identifier='latest'):
+        results = []
+        for _, data in calls:
+            fn, args = contract.decode_function_input(data)
+            feed = GET_FEED.get((args['base'], args['quote']), 'revert')
+            if feed == 'failed':
+                results.append((False, None))
+            elif feed == 'revert':
+                results.append((False, b''))
+            elif fn.fn_name == 'getFeed':
+                results.append((True, codec.encode_abi(['address'], [feed])))
+            else:
+                results.append((True, codec.encode_abi(['uint8'], [18])))
+        return results
+
+    monkeypatch.setattr(feed_registry, 'get_feed_registry_contract', lambda: contract)
+    monkeypatch.setattr(multicall, 'try_aggregate', try_aggregate)
+    return contract
+
+
+def test_resolve_pairs(contract, monkeypatch):
+    registry = feed_registry.FeedRegistry()
+    registry.resolve_pairs([(to_asset(i), QUOTE) for i in range(1, 6)], block_identifier=100)
+    assert registry.feeds[feed_registry.pair_key(to_asset(1), QUOTE)] == [AGGREGATOR, True, 18]
+    assert registry.feeds[feed_registry.pair_key(to_asset(2), QUOTE)] == [AGGREGATOR, False, 18]
+    '''zero address and reverts are no feed, failed calls are not stored'''
+    assert registry.feeds[feed_registry.pair_key(to_asset(3), QUOTE)] is None
+    assert registry.feeds[feed_registry.pair_key(to_asset(5), QUOTE)] is None
+    assert feed_registry.pair_key(to_asset(4), QUOTE) not in registry.feeds
+    assert registry.last_block == 100
+
+    monkeypatch.setitem(GET_FEED, (to_asset(4), QUOTE), AGGREGATOR)
+    registry.resolve_pairs([(to_asset(4), QUOTE)], block_identifier=101)
+    assert registry.feeds[feed_registry.pair_key(to_asset(4), QUOTE)] == [AGGREGATOR, True, 18]
@@ -0,0 +1,53 @@
+import itertools
+import numpy as np
+import pytest
+import liquidation_planner
+from liquidation_planner import plan_liquidations, PLAN_COLUMNS
+
+
+'''Best profit of every user with health factor below the threshold by enumerating the reserve pairs'''
+def brute_force(engine, liq_bonus, hf_threshold, close_factor=liquidation_planner.CLOSE_FACTOR):
+    bonus = np.maximum(np.asarray(liq_bonus) / 100.0, 1.0)
+    _, _, _, health_factor = engine.compute()
+    S = {}
+    for i in np.flatnonzero(health_factor < hf_threshold):
+        collateral_eth = engine.collateral[i] * engine.prices
+        debt_eth = engine.debt[i] * engine.prices
+        best = 0.0
+        for c, d in itertools.product(range(len(engine.reserves)), repeat=2):
+            covered = min(close_factor * debt_eth[d], collateral_eth[c] / bonus[c])
+            best = max(best, covered * (bonus[c] - 1.0))
+        if best > 0:
+            S[engine.users[i]] = best
+    return S
+
+
+def test_plan_matches_brute_force(engine, monkeypatch):
+    '''several chunks'''
+    monkeypatch.setattr(liquidation_planner, 'CHUNK_SIZE', 16)
+    liq_bonus = [105.0, 110.0, 0.0, 107.5, 115.0]
+    hf_threshold = 1.2
+    df = plan_liquidations(engine, liq_bonus, hf_threshold=hf_threshold)
+    expected = brute_force(engine, liq_bonus, hf_threshold)
+    assert list(df.columns) == PLAN_COLUMNS
+    assert len(expected) > 0
+    assert set(df.user) == set(expected)
+    for _, plan in df.iterrows():
+        assert plan.profit_eth == pytest.approx(expected[plan.user])
+        '''plan amounts are consistent with the chosen pair'''
+        c = engine.reserve_index[plan.collateral_asset]
+        d = engine.reserve_index[plan.debt_asset]
+        row = engine.user_index[plan.user]
+        assert plan.debt_to_cover <= liquidation_planner.CLOSE_FACTOR * engine.debt[row, d] + 1e-9
+        assert plan.collateral_received <= engine.collateral[row, c] + 1e-9
+        assert plan.debt_to_cover_eth == pytest.approx(plan.debt_to_cover * engine.prices[d])
+    assert list(df.profit_eth) == sorted(df.profit_eth, reverse=True)
+
+
+def test_plan_of_user_subset_and_empty(engine):
+    liq_bonus = [105.0] * 5
+    users = engine.users[:50]
+    df = plan_liquidations(engine, liq_bonus, users=users, hf_threshold=np.inf)
+    assert set(df.user) == set(brute_force(engine, liq_bonus, np.inf)).intersection(users)
+    empty = plan_liquidations(engine, liq_bonus, hf_threshold=0.0)
+    assert len(empty) == 0 and list(empty.columns) == PLAN_COLUMNS
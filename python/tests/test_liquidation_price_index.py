@@ -0,0 +1,64 @@
+import numpy as np
+from liquidation_price_index import LiquidationPriceIndex, FALL, RISE
+
+
+def health_factors(engine):
+    return engine.compute()[3]
+
+
+def assert_sorted_consistent(index):
+    '''patched sorted arrays equal the ones of a rebuilt index'''
+    fresh = LiquidationPriceIndex(index.engine)
+    for k in range(len(index.engine.reserves)):
+        for side in (FALL, RISE):
+            prices, rows = index.get_sorted(k, side)
+            expected_prices, expected_rows = fresh.get_sorted(k, side)
+            assert np.array_equal(prices, expected_prices)
+            assert set(rows) == set(expected_rows)
+            assert np.array_equal(index.critical[rows, k], prices)
+
+
+def test_crossed_matches_health_factor(engine):
+    index = LiquidationPriceIndex(engine)
+    n_crossed = 0
+    for k, asset in enumerate(engine.reserves):
+        old_price = engine.prices[k]
+        before = health_factors(engine)
+        for new_price in (old_price * 0.7, old_price * 1.4):
+            engine.prices[k] = new_price
+            after = health_factors(engine)
+            engine.prices[k] = old_price
+            expected = {engine.users[i] for i in np.flatnonzero((before >= 1.0) & (after < 1.0))}
+            assert set(index.crossed(asset, old_price, new_price)) == expected
+            n_crossed += len(expected)
+    assert n_crossed > 0
+
+
+def test_near_liquidation(engine):
+    index = LiquidationPriceIndex(engine)
+    margin = 0.05
+    users = set(index.near_liquidation(margin))
+    before = health_factors(engine)
+    for k in range(len(engine.reserves)):
+        price = engine.prices[k]
+        for new_price in (price * (1.0 - margin), price * (1.0 + margin)):
+            engine.prices[k] = new_price
+            after = health_factors(engine)
+            assert {engine.users[i] for i in np.flatnonzero((before >= 1.0) & (after < 1.0))} <= users
+        engine.prices[k] = price
+
+
+def test_updates_patch_sorted_arrays(engine, rng):
+    index = LiquidationPriceIndex(engine)
+    for k in range(len(engine.reserves)):
+        for side in (FALL, RISE):
+            index.get_sorted(k, side)
+    for step in range(20):
+        if step % 2 == 0:
+            k = int(rng.randint(len(engine.reserves)))
+            index.update_price(engine.reserves[k], engine.prices[k] * rng.uniform(0.8, 1.2))
+        else:
+            users = list(rng.choice(engine.users, 10, replace=False)) + ['0x{:040x}'.format(0x9000 + step)]
+            engine.set_balances(users, rng.uniform(0, 5, (len(users), 5)), rng.uniform(0, 5, (len(users), 5)))
+            index.update_users(users)
+        assert_sorted_consistent(index)
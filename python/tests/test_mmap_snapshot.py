@@ -0,0 +1,80 @@
+import os
+import numpy as np
+import pandas as pd
+import mmap_snapshot
+
+
+def make_frame(n=5):
+    return pd.DataFrame({'block_number': np.arange(n, dtype=np.int64),
+                         'user': ['0x{:040x}'.format(i % 3) for i in range(n)],
+                         'amount': [10 ** 20 + i for i in range(n)],
+                         'name': ['n{}'.format(i) for i in range(n)],
+                         'flag': np.arange(n) % 2 == 0})
+
+
+def test_write_and_load_round_trip():
+    df = make_frame()
+    folder = mmap_snapshot.write_snapshot('test_round_trip', df, block=42)
+    snapshot = mmap_snapshot.load_snapshot('test_round_trip')
+    assert snapshot.folder == folder and snapshot.block == 42 and len(snapshot) == 5
+    assert snapshot.kinds['user'] == 'address' and snapshot.kinds['amount'] == 'uint256'
+    '''columns are memory-mapped'''
+    assert isinstance(snapshot.column('block_number'), np.memmap)
+    frame = snapshot.to_frame()
+    assert list(frame.user) == list(df.user)
+    assert list(frame.name) == list(df.name)
+    assert np.allclose(frame.amount.values, [float(v) for v in df.amount])
+    rows = snapshot.to_frame(['user'], rows=np.array([1, 3]))
+    assert list(rows.user) == [df.user[1], df.user[3]]
+
+
+def test_new_version_replaces_previous():
+    first = mmap_snapshot.write_snapshot('test_versions', make_frame(3), block=1)
+    second = mmap_snapshot.write_snapshot('test_versions', make_frame(4), block=2)
+    assert second != first and not os.path.exists(first)
+    snapshot = mmap_snapshot.load_snapshot('test_versions')
+    assert snapshot.block == 2 and len(snapshot) == 4
+
+
+def test_corrupted_column_is_rejected():
+    folder = mmap_snapshot.write_snapshot('test_corrupted', make_frame(), block=3)
+    with open('{}/block_number.npy'.format(folder), 'r+b') as f:
+        f.seek(-8, os.SEEK_END)
+        f.write(b'\xff' * 8)
+    mmap_snapshot._verified.discard(folder)
+    assert mmap_snapshot.load_snapshot('test_corrupted') is None
+
+
+def test_address_table_ids_are_stable(tmp_path):
+    fname = str(tmp_path / 'addresses.npy')
+    table = mmap_snapshot.AddressTable(fname)
+    ids = table.intern(['0xa' + '0' * 39, '0xb' + '0' * 39, '0xa' + '0' * 39])
+    assert list(ids) == [0, 1, 0]
+    '''a table opened before another writer appended gets the ids of that writer'''
+    stale = mmap_snapshot.AddressTable(fname)
+    stale.get_ids()
+    table.intern(['0xc' + '0' * 39])
+    assert list(stale.intern(['0xd' + '0' * 39, '0xc' + '0' * 39])) == [3, 2]
+    assert list(mmap_snapshot.AddressTable(fname).lookup([0, 1, 2, 3])) == \
+        ['0xa' + '0' * 39, '0xb' + '0' * 39, '0xc' + '0' * 39, '0xd' + '0' * 39]
+
+
+def test_load_accounts_filters_mapped_columns():
+    df = pd.DataFrame({'col': [1.0, 0.0, 2.0], 'debt': [1.0, 1.0, 0.5], 'healthFactor': [0.9, 0.0, 3.0],
+                       'user': ['0x{:040x}'.format(i) for i in range(3)],
+                       'verified_block': np.array([7, 8, 9], dtype=np.int64)})
+    mmap_snapshot.export_accounts(df, block=10, updated_at='20220101_000000')
+    accounts, verified_block = mmap_snapshot.load_accounts(alive=True, hf_max=2.0)
+    assert verified_block == 9
+    assert list(accounts.user) == [df.user[0]]
+
+
+def test_reader_keeps_columns_after_new_version():
+    df = make_frame(3)
+    mmap_snapshot.write_snapshot('test_reader', df, block=1)
+    snapshot = mmap_snapshot.load_snapshot('test_reader')
+    mmap_snapshot.write_snapshot('test_reader', make_frame(4), block=2)
+    assert not os.path.exists(snapshot.folder)
+    frame = snapshot.to_frame()
+    assert list(frame.block_number) == list(df.block_number) and list(frame.name) == list(df.name)
+    assert len(mmap_snapshot.load_snapshot('test_reader')) == 4
@@ -0,0 +1,123 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+pytest.importorskip('web3')
+import eth_abi
+from web3 import Web3
+import multicall
+
+'''Local JSON-RPC stand-in of a node with Multicall2 and a token: eth_call of tryAggregate runs
+   balanceOf of every call, balance of account i is i * 10^18.
+   balanceOf of FAILING_USER fails inside the aggregate (success false),
+   an aggregate containing REVERTING_USER fails as a whole (JSON-RPC error).
+'''
+TOKEN_ADDRESS = Web3.toChecksumAddress('0x' + 'ab' * 20)
+TOKEN_ABI = '[{"inputs":[{"internalType":"address","name":"account","type":"address"}],"name":"balanceOf","outputs":[{"internalType":"uint256","name":"","type":"uint256"}],"stateMutability":"view","type":"function"}]'
+FAILING_USER = Web3.toChecksumAddress('0x{:040x}'.format(0xf00))
+REVERTING_USER = Web3.toChecksumAddress('0x{:040x}'.format(0xdead))
+
+encode = getattr(eth_abi, 'encode', None) or eth_abi.encode_abi
+decode = getattr(eth_abi, 'decode', None) or eth_abi.decode_abi
+
+
+def to_user(i):
+    return Web3.toChecksumAddress('0x{:040x}'.format(i))
+
+
+def balance_of(user):
+    return int(user, 16) * 10 ** 18
+
+
+class Node:
+    def __init__(self):
+        self.aggregate_calls = []
+
+    def eth_call(self, params):
+        data = bytes.fromhex(params[0]['data'][2:])
+        require_success, calls = decode(['bool', '(address,bytes)[]'], data[4:])
+        self.aggregate_calls.append(len(calls))
+        results = []
+        for target, call_data in calls:
+            user = Web3.toChecksumAddress(decode(['address'], call_data[4:])[0])
+            if user == REVERTING_USER:
+                return {'error': {'code': -32000, 'message': 'execution reverted'}}
+            if user == FAILING_USER or Web3.toChecksumAddress(target) != TOKEN_ADDRESS:
+                results.append((False, b''))
+            else:
+                results.append((True, encode(['uint256'], [balance_of(user)])))
+        return {'result': '0x' + encode(['(bool,bytes)[]'], [results]).hex()}
+
+    def handle(self, request):
+        if request['method'] == 'eth_call':
+            reply = self.eth_call(request['params'])
+        elif request['method'] == 'eth_chainId':
+            reply = {'result': '0x1'}
+        else:
+            reply = {'error': {'code': -32601, 'message': 'method not found'}}
+        return dict(reply, jsonrpc='2.0', id=request['id'])
+
+
+@pytest.fixture
+def node():
+    node = Node()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            if isinstance(request, list):
+                reply = [node.handle(r) for r in request]
+            else:
+                reply = node.handle(request)
+            body = json.dumps(reply).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    node.web3 = Web3(Web3.HTTPProvider('http://127.0.0.1:{}'.format(server.server_address[1])))
+    yield node
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def token(node, monkeypatch):
+    multicall_contract = node.web3.eth.contract(address=multicall.MULTICALL2_ADDRESS, abi=multicall.MULTICALL2_ABI)
+    monkeypatch.setattr(multicall, 'get_multicall_contract', lambda: multicall_contract)
+    return node.web3.eth.contract(address=TOKEN_ADDRESS, abi=TOKEN_ABI)
+
+
+def test_call_function_batch(node, token):
+    users = [to_user(i) for i in range(1, 11)]
+    ret = multicall.call_function_batch(token, 'balanceOf', [[user] for user in users], batch_size=4)
+    assert [r[0] for r in ret] == [balance_of(user) for user in users]
+    assert node.aggregate_calls == [4, 4, 2]
+
+
+def test_failed_calls_are_none(node, token):
+    users = [to_user(1), FAILING_USER, to_user(2)]
+    ret = multicall.call_function_batch(token, 'balanceOf', [[user] for user in users], batch_size=10)
+    assert ret[0][0] == balance_of(users[0]) and ret[1] is None and ret[2][0] == balance_of(users[2])
+
+
+def test_failing_aggregate_is_split(node, token):
+    users = [to_user(i) for i in range(1, 8)]
+    users.insert(5, REVERTING_USER)
+    calls = multicall.encode_calls(token, 'balanceOf', [[user] for user in users])
+    results = multicall.try_aggregate_batch(multicall.get_multicall_contract(), calls)
+    assert len(results) == len(users)
+    assert results[5] == (False, None)
+    decoded = multicall.decode_results(token, 'balanceOf', results)
+    assert [d[0] if d is not None else None for d in decoded] == \
+        [balance_of(user) if user != REVERTING_USER else None for user in users]
+    '''halves without the reverting call are not split further'''
+    assert node.aggregate_calls[:3] == [8, 4, 4]
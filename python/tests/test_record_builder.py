@@ -0,0 +1,35 @@
+import numpy as np
+from record_builder import ColumnarRecordBuilder
+
+SCHEMA = [('user', object), ('amount', object), ('block_number', np.int64)]
+
+
+def test_append_grows_and_keeps_rows():
+    builder = ColumnarRecordBuilder(SCHEMA, capacity=2)
+    for i in range(5):
+        builder.append(user='0x{:040x}'.format(i), amount=10 ** 30 + i, block_number=100 + i)
+    df = builder.to_frame()
+    assert len(builder) == 5
+    assert list(df.columns) == ['user', 'amount', 'block_number']
+    assert list(df.block_number) == [100, 101, 102, 103, 104]
+    assert df.block_number.dtype == np.int64
+    '''uint256 values stay exact Python ints'''
+    assert df.amount.iloc[4] == 10 ** 30 + 4
+
+
+def test_extend_and_clear():
+    builder = ColumnarRecordBuilder(SCHEMA, capacity=1)
+    builder.extend({'user': ['a', 'b', 'c'], 'amount': [1, 2, 3], 'block_number': np.array([1, 2, 3])})
+    builder.append(user='d', amount=4, block_number=4)
+    assert list(builder.to_frame().user) == ['a', 'b', 'c', 'd']
+    frame = builder.to_frame()
+    builder.clear()
+    assert len(builder) == 0 and len(builder.to_frame()) == 0
+    '''frames are copies, clearing and refilling does not change them'''
+    builder.append(user='x', amount=0, block_number=0)
+    assert list(frame.user) == ['a', 'b', 'c', 'd']
+
+
+def test_empty_frame_has_schema_columns():
+    df = ColumnarRecordBuilder(SCHEMA).to_frame()
+    assert list(df.columns) == ['user', 'amount', 'block_number'] and len(df) == 0
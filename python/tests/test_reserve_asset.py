@@ -0,0 +1,38 @@
+from reserve_asset import split_user_loan_deposit_bitmask
+from reserve_asset import decode_user_config_bitmasks
+from reserve_asset import decode_asset_config_bitmask
+from reserve_asset import split_asset_config_bitmask
+from reserve_asset import is_borrowing
+
+
+def test_decode_user_config_bitmasks_matches_split(rng):
+    n_reserves = 40
+    bitmasks = [0, 1, 2, 3, (1 << 79), int('10' * 40, 2), int('01' * 40, 2)]
+    bitmasks += [int(''.join(rng.choice(['0', '1'], 2 * n_reserves)), 2) for _ in range(50)]
+    collateral, borrowed = decode_user_config_bitmasks(bitmasks, n_reserves)
+    assert collateral.shape == (len(bitmasks), n_reserves)
+    for i, bitmask in enumerate(bitmasks):
+        S = split_user_loan_deposit_bitmask(bitmask)
+        for k in range(n_reserves):
+            is_col, is_borrowed = S.get(k, (0, 0))
+            assert collateral[i, k] == bool(is_col)
+            assert borrowed[i, k] == bool(is_borrowed)
+
+
+def test_is_borrowing():
+    assert not is_borrowing(0)
+    '''collateral bits only'''
+    assert not is_borrowing(int('10' * 128, 2))
+    assert is_borrowing(1)
+    assert is_borrowing(1 << 254)
+    assert not is_borrowing(1 << 255)
+    assert is_borrowing('4')
+
+
+def test_decode_asset_config_bitmask():
+    bitmask = 8000 | (8250 << 16) | (10500 << 32) | (18 << 48) | (1 << 56) | (1 << 58) | (1000 << 64)
+    ltv, liq_threshold, liq_bonus, decimals, is_active, is_freezed, is_borrowing_enabled = \
+        decode_asset_config_bitmask(bitmask)[:7]
+    assert (ltv, liq_threshold, liq_bonus, decimals) == (80.0, 82.5, 105.0, 18)
+    assert (is_active, is_freezed, is_borrowing_enabled) == (1, 0, 1)
+    assert split_asset_config_bitmask(bitmask) == (80.0, 82.5, 105.0, 18)
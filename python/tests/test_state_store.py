@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+import state_store
+
+
+def make_accounts(users, health_factor, verified_block, col=1.0, debt=1.0):
+    n = len(users)
+    return pd.DataFrame({'col': np.full(n, col), 'debt': np.full(n, debt), 'available': np.zeros(n),
+                         'liquidation_threshold': np.full(n, 80.0), 'ltv': np.full(n, 75.0),
+                         'healthFactor': np.asarray(health_factor, dtype=np.float64),
+                         'user': users, 'verified_block': np.full(n, verified_block, dtype=np.int64)})
+
+
+@pytest.fixture
+def fname(tmp_path):
+    return str(tmp_path / 'state.sqlite')
+
+
+def test_upsert_and_query(fname):
+    state_store.upsert_accounts(make_accounts(['a', 'b', 'c'], [0.9, 1.5, 3.0], 10), last_cached_block=9,
+                                fname=fname)
+    state_store.upsert_accounts(make_accounts(['c'], [0.5], 12, debt=0.0), fname=fname)
+    df = state_store.load_accounts(fname=fname).set_index('user')
+    assert list(df.columns) == [c for c in state_store.ACCOUNT_COLUMNS if c != 'user']
+    assert df.loc['c', 'healthFactor'] == 0.5 and df.loc['c', 'verified_block'] == 12
+    assert state_store.count_accounts(fname=fname) == 3
+    assert set(state_store.load_accounts(hf_max=1.0, fname=fname).user) == {'a', 'c'}
+    assert set(state_store.load_accounts(hf_min=1.0, hf_max=2.0, fname=fname).user) == {'b'}
+    assert set(state_store.load_accounts(alive=True, fname=fname).user) == {'a', 'b'}
+    assert set(state_store.load_accounts(users=['a', 'x'], fname=fname).user) == {'a'}
+    assert set(state_store.load_accounts(verified_from=11, fname=fname).user) == {'c'}
+    assert state_store.count_accounts(verified_from=11, fname=fname) == 1
+    meta = state_store.get_meta(fname=fname)
+    assert meta['last_cached_block'] == '9' and 'updated_at' in meta
+
+
+def test_deltas_only_on_changes(fname):
+    state_store.upsert_accounts(make_accounts(['a'], [2.0], 10), fname=fname)
+    '''same position at a later block: no delta'''
+    state_store.upsert_accounts(make_accounts(['a'], [2.0], 11), fname=fname)
+    state_store.upsert_accounts(make_accounts(['a'], [1.0], 12, debt=2.0), fname=fname)
+    history = state_store.load_history('a', fname=fname)
+    assert list(history.block) == [10, 12]
+    assert list(history.debt) == [1.0, 2.0]
+
+
+def test_user_configuration(fname):
+    bitmask = (1 << 200) | 1
+    config = pd.DataFrame({'user': ['a', 'b'], 'bitmask': [bitmask, 2], 'verified_block': [5, 5]})
+    state_store.upsert_user_configuration(config, fname=fname)
+    state_store.upsert_user_configuration(config.iloc[:1], fname=fname)
+    df = state_store.load_user_configuration(fname=fname).set_index('user')
+    '''uint256 bitmask round trip'''
+    assert df.loc['a', 'bitmask'] == bitmask
+    assert list(state_store.load_user_configuration(users=['b'], fname=fname).bitmask) == [2]
+    '''configuration alone is not account data'''
+    assert state_store.count_accounts(fname=fname) == 0
+    assert len(state_store.load_history('a', fname=fname)) == 1
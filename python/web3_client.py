@@ -0,0 +1,60 @@
+import os
+import requests
+from requests.adapters import HTTPAdapter
+from web3 import Web3
+import config
+
+'''Process-wide registry of Web3 clients and contract handles.
+   One keep-alive requests.Session (connection pool) per endpoint, contract objects are
+   built once per (endpoint, address, abi). The registry is reset after fork, so worker
+   processes never share sockets with the parent.
+'''
+_registry_pid = None
+_sessions = {}
+_clients = {}
+_contracts = {}
+
+
+def _check_pid():
+    global _registry_pid
+    if _registry_pid != os.getpid():
+        _sessions.clear()
+        _clients.clear()
+        _contracts.clear()
+        _registry_pid = os.getpid()
+
+
+def get_session(endpoint=config.Infura_EndPoint):
+    _check_pid()
+    if endpoint not in _sessions:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=config.RPC_POOL_CONNECTIONS,
+                              pool_maxsize=config.RPC_POOL_SIZE)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _sessions[endpoint] = session
+    return _sessions[endpoint]
+
+
+def get_web3(endpoint=config.Infura_EndPoint):
+    _check_pid()
+    if endpoint not in _clients:
+        provider = Web3.HTTPProvider(endpoint, request_kwargs={'timeout': config.RPC_TIMEOUT},
+                                     session=get_session(endpoint))
+        _clients[endpoint] = Web3(provider)
+    return _clients[endpoint]
+
+'''ABI's in the repo are module level constants, so they are keyed by identity,
+   the abi object is kept in the registry to keep its id valid.
+'''
+def get_contract(address, abi, endpoint=config.Infura_EndPoint):
+    _check_pid()
+    key = (endpoint, address, id(abi))
+    if key not in _contracts:
+        contract = get_web3(endpoint).eth.contract(address=address, abi=abi)
+        _contracts[key] = (contract, abi)
+    return _contracts[key][0]
+
+
+def get_lending_pool():
+    return get_contract(config.Lending_Pool_V2_Address, config.Lending_Pool_V2_ABI)